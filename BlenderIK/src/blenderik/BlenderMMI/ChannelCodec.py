@@ -0,0 +1,132 @@
+# std-Library
+from typing import Tuple
+import logging
+logger = logging.getLogger(__name__)
+
+import numpy as np
+
+# MOSIM
+import MMIStandard.avatar.ttypes as tavatar
+
+# Every joint occupies SLOT_WIDTH slots in the decoded buffer: the location
+# (x, y, z) followed by the rotation quaternion in blender order (w, x, y, z).
+SLOT_WIDTH = 7
+
+# channel -> (slot within the joint, sign)
+# coordinate system transforms:
+# translation (x,y,z) -> (-x, y, z)
+# quaternion (w, x, y, z) -> (-w, -x, y, z)
+_CHANNEL_SLOTS = {
+    tavatar.MChannel.XOffset:   (0, -1.),
+    tavatar.MChannel.YOffset:   (1,  1.),
+    tavatar.MChannel.ZOffset:   (2,  1.),
+    tavatar.MChannel.WRotation: (3, -1.),
+    tavatar.MChannel.XRotation: (4, -1.),
+    tavatar.MChannel.YRotation: (5,  1.),
+    tavatar.MChannel.ZRotation: (6,  1.),
+}
+
+class ChannelCodec():
+    """
+    Precompiled mapping between the flat posture values of the MOSIM-Framework
+    and the locations and rotations of the joints in the blender rig.
+
+    The codec is built once from the channel layout of a MAvatarPosture.
+    Decoding and encoding is a single scatter/gather with precomputed indices
+    and sign masks for the coordinate system transform. All methods accept an
+    additional leading batch dimension.
+    """
+
+    def __init__(self, posture: tavatar.MAvatarPosture):
+        """
+        parameters:
+            - posture: the tavatar.MAvatarPosture defining joints and channels
+        """
+        self.joints     = [joint.ID for joint in posture.Joints]
+        self.jointIndex = {name: idx for idx, name in enumerate(self.joints)}
+
+        slots   = []
+        signs   = []
+        offsets = [0]
+        for idx, joint in enumerate(posture.Joints):
+            for channel in joint.Channels:
+                slot, sign = _CHANNEL_SLOTS[channel]
+                slots.append(idx * SLOT_WIDTH + slot)
+                signs.append(sign)
+            offsets.append(len(slots))
+
+        self.slots   = np.array(slots, dtype=np.intp)   # value -> slot in the buffer
+        self.signs   = np.array(signs, dtype=float)     # value -> handedness flip
+        self.offsets = np.array(offsets, dtype=np.intp) # joint -> first value
+
+        # joints without channels stay at zero location and identity rotation
+        self._template = np.zeros((len(self.joints), SLOT_WIDTH))
+        self._template[:, 3] = 1.
+
+        logger.debug("Compiled channel codec for %i joints and %i values",
+            len(self.joints), len(self.slots))
+
+    def __len__(self):
+        return len(self.slots)
+
+    @property
+    def size(self) -> int:
+        """Number of posture values"""
+        return len(self.slots)
+
+    def jointValues(self, joint_id: str) -> slice:
+        """Returns the slice of the posture values belonging to a joint."""
+        idx = self.jointIndex[joint_id]
+        return slice(int(self.offsets[idx]), int(self.offsets[idx+1]))
+
+    def hasRotation(self, joint_id: str) -> bool:
+        """True if any rotation channel of the joint is transmitted."""
+        return any(self.rotationMask(joint_id))
+
+    def rotationMask(self, joint_id: str) -> Tuple[bool, bool, bool, bool]:
+        """Which quaternion components (w, x, y, z) of the joint are transmitted."""
+        mask = [False] * 4
+        idx = self.jointIndex.get(joint_id)
+        if idx is not None:
+            for slot in (self.slots[self.offsets[idx]:self.offsets[idx+1]] % SLOT_WIDTH).tolist():
+                if slot >= 3:
+                    mask[slot - 3] = True
+        return tuple(mask)
+
+    def decode(self, values) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Converts posture values to blender locations and rotations.
+
+        parameters:
+            - values: list[float] or array of shape (..., size)
+
+        returns:
+            - locations: array of shape (..., joints, 3)
+            - rotations: array of shape (..., joints, 4) quaternions (w, x, y, z)
+        """
+        values = np.asarray(values, dtype=float)
+        if values.shape[-1] != self.size:
+            raise ValueError(f"Expected {self.size} posture values, got {values.shape[-1]}")
+
+        lead = values.shape[:-1]
+        buffer = np.broadcast_to(self._template, lead + self._template.shape).copy()
+        buffer.reshape(lead + (-1,))[..., self.slots] = values * self.signs
+        return buffer[..., :3], buffer[..., 3:]
+
+    def encode(self, locations, rotations) -> np.ndarray:
+        """
+        Converts blender locations and rotations to posture values.
+
+        parameters:
+            - locations: array of shape (..., joints, 3)
+            - rotations: array of shape (..., joints, 4) quaternions (w, x, y, z)
+
+        returns:
+            - values: array of shape (..., size)
+        """
+        buffer = np.concatenate((
+            np.asarray(locations, dtype=float),
+            np.asarray(rotations, dtype=float)
+        ), axis=-1)
+        lead = buffer.shape[:-2]
+        return buffer.reshape(lead + (-1,))[..., self.slots] * self.signs
@@ -0,0 +1,93 @@
+"""
+Vectorized conversion between the coordinate systems of the MOSIM-Framework
+and blender, on NumPy arrays with arbitrary leading batch dimensions.
+
+ - positions     (..., 3)  (x, y, z) -> (-x, y, z), both directions
+ - quaternions   (..., 4)  MOSIM (x, y, z, w) <-> blender (w, x, y, z) as (-w, -x, y, z)
+ - euler angles  (..., 3)  (x, y, z) -> (x, -y, -z), both directions
+ - intervals     (..., 3)  lower and upper limits of MInterval3s
+
+The scalar functions of server.convert do the same for single values,
+tests/test_conversion.py checks that both agree. ChannelCodec applies the
+same transform to the flat posture values.
+"""
+from typing import Iterable, Tuple
+import math
+
+import numpy as np
+
+from BlenderMMI.PoseMath import matrices_to_quaternions
+
+POSITION_SIGNS = np.array((-1., 1., 1.))
+EULER_SIGNS = np.array((1., -1., -1.))
+
+def positions_m2b(positions: np.ndarray) -> np.ndarray:
+    return np.asarray(positions, dtype=float) * POSITION_SIGNS
+
+def positions_b2m(positions: np.ndarray) -> np.ndarray:
+    return np.asarray(positions, dtype=float) * POSITION_SIGNS
+
+def quaternions_m2b(quaternions: np.ndarray) -> np.ndarray:
+    """MOSIM (x, y, z, w) to blender (w, x, y, z)."""
+    q = np.asarray(quaternions, dtype=float)
+    return np.stack((-q[..., 3], -q[..., 0], q[..., 1], q[..., 2]), axis=-1)
+
+def quaternions_b2m(quaternions: np.ndarray) -> np.ndarray:
+    """Blender (w, x, y, z) to MOSIM (x, y, z, w)."""
+    q = np.asarray(quaternions, dtype=float)
+    return np.stack((-q[..., 1], q[..., 2], q[..., 3], -q[..., 0]), axis=-1)
+
+def eulers_m2b(eulers: np.ndarray) -> np.ndarray:
+    """Euler angles in the order XZY of blender."""
+    return np.asarray(eulers, dtype=float) * EULER_SIGNS
+
+def eulers_b2m(eulers: np.ndarray) -> np.ndarray:
+    return np.asarray(eulers, dtype=float) * EULER_SIGNS
+
+def euler_rotations_m2b(eulers: np.ndarray) -> np.ndarray:
+    """
+    Blender quaternions (..., 4) of MOSIM euler angles (..., 3), the rotation
+    R = Ry(-y) Rx(x) Rz(-z) like server.convert.rotation_m2b.
+    """
+    e = np.asarray(eulers, dtype=float)
+    cx, sx = np.cos(e[..., 0]), np.sin(e[..., 0])
+    cy, sy = np.cos(-e[..., 1]), np.sin(-e[..., 1])
+    cz, sz = np.cos(-e[..., 2]), np.sin(-e[..., 2])
+    zero, one = np.zeros(e.shape[:-1]), np.ones(e.shape[:-1])
+
+    rx = _matrices(one, zero, zero, zero, cx, -sx, zero, sx, cx)
+    ry = _matrices(cy, zero, sy, zero, one, zero, -sy, zero, cy)
+    rz = _matrices(cz, -sz, zero, sz, cz, zero, zero, zero, one)
+    return matrices_to_quaternions(ry @ rx @ rz)
+
+def interval_centers(lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """
+    Centers of the intervals [lo, hi] like server.convert.intervalCenter: the
+    finite limit of a half-open interval, 0 of an unbounded one.
+    """
+    lo, hi = np.asarray(lo, dtype=float), np.asarray(hi, dtype=float)
+    if np.any(np.isnan(lo) | np.isnan(hi) | (lo == math.inf) | (hi == -math.inf)):
+        raise ValueError("Limits cannot be NaN, min=+inf and max=-inf")
+    finite_lo, finite_hi = np.isfinite(lo), np.isfinite(hi)
+    if np.any(finite_lo & finite_hi & (lo > hi)):
+        raise ValueError("Lower limit greater than upper limit.")
+    with np.errstate(invalid='ignore'):
+        return np.where(finite_lo & finite_hi, .5 * (lo + hi),
+            np.where(finite_lo, lo, np.where(finite_hi, hi, 0.)))
+
+def mvectors_to_array(vectors: Iterable) -> np.ndarray:
+    """(n, 3) array of MVector3s."""
+    return np.array([(v.X, v.Y, v.Z) for v in vectors], dtype=float).reshape(-1, 3)
+
+def mquaternions_to_array(quaternions: Iterable) -> np.ndarray:
+    """(n, 4) array of MQuaternions in MOSIM order (x, y, z, w)."""
+    return np.array([(q.X, q.Y, q.Z, q.W) for q in quaternions], dtype=float).reshape(-1, 4)
+
+def minterval3s_to_arrays(intervals: Iterable) -> Tuple[np.ndarray, np.ndarray]:
+    """(n, 3) arrays of the lower and upper limits of MInterval3s."""
+    limits = np.array([((i.X.Min, i.Y.Min, i.Z.Min), (i.X.Max, i.Y.Max, i.Z.Max))
+        for i in intervals], dtype=float).reshape(-1, 2, 3)
+    return limits[:, 0], limits[:, 1]
+
+def _matrices(*entries) -> np.ndarray:
+    return np.stack(entries, axis=-1).reshape(entries[0].shape + (3, 3))
@@ -1,6 +1,7 @@
 # std-Library
-from typing import List, Optional, Union
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 import logging
+import weakref
 logger = logging.getLogger(__name__)
 
 # MOSIM This only belongs in the Adapter! Refactor
@@ -9,12 +10,28 @@ import MMIStandard.avatar.ttypes as tavatar
 #Blender
 import bpy
 from mathutils import Matrix, Quaternion, Vector, Euler
+import numpy as np
 
-def MVector2Vector(v) -> Vector:
-    return Vector((-v.X, v.Y, v.Z))
+from BlenderMMI.ChannelCodec import ChannelCodec
+from BlenderMMI.RigSnapshot import RigSnapshot, RigSnapshotCache
+from BlenderMMI.PoseMath import local_transforms, matrices_to_quaternions
+from BlenderMMI import Conversion
+from BlenderMMI.SceneUpdateScheduler import scheduler, POSE, CONSTRAINTS, TARGETS
+from BlenderMMI.TwoBoneIK import TwoBoneIK
 
-def MQuaternion2Quaternion(q) -> Quaternion:
-    return Quaternion((-q.W, -q.X, q.Y, q.Z))
+# all living skeletons, their handles become invalid on file reload
+_applications = weakref.WeakSet()
+
+@bpy.app.handlers.persistent
+def _invalidateAfterLoad(*args):
+    """Blender replaces all datablocks when a file is (re)loaded."""
+    logger.debug("File loaded: invalidate handles of %i skeletons", len(_applications))
+    for app in list(_applications):
+        app.invalidateHandles()
+    scheduler.invalidate()
+
+if _invalidateAfterLoad.__name__ not in (h.__name__ for h in bpy.app.handlers.load_post):
+    bpy.app.handlers.load_post.append(_invalidateAfterLoad)
 
 class IntermediateSkeletonApplication():
     """
@@ -25,8 +42,13 @@ class IntermediateSkeletonApplication():
     
     # Attributes:
     #
-    # object
+    # object          resolved once, see _resolveHandles
+    # bones
+    # ikTargets
+    # ikConstraints
+    # copyConstraints
     # posture
+    # codec
     # base_matrix
     # zero_matrix
     # lowerlegLength   # naming!
@@ -55,27 +77,27 @@ class IntermediateSkeletonApplication():
         'LeftFoot': ('LeftFoot', Quaternion()),
         }
     
-    def __init__(self, avatar_id, posture: Optional[tavatar.MAvatarPosture] = None):
+    def __init__(self, avatar_id, posture: Optional[tavatar.MAvatarPosture] = None, 
+            snapshots: Optional[RigSnapshotCache] = None):
         """
         parameters:
             - avatar_id: "lalala"
             - posture: the tavatar.MAvatarPosture for scaling (if already existing)
+            - snapshots: cache of scaled armatures, see BlenderMMI.RigSnapshot
         """
         self._object_id  = avatar_id
         self.posture = posture
-        
-        logger.info(f"New sceleton: {avatar_id}")
-        
-        self.ikConstraints = {bone.name: bone.constraints.get('IK') 
-            for bone in self.object.pose.bones if bone.constraints.get('IK')
-        }
-        logger.debug(f"Found {len(self.ikConstraints)} ik-constraints: [{self.ikConstraints.keys()}]")
-        
-        self.copyConstraints = {bone.name: bone.constraints.get('Copy Rotation') 
-            for bone in self.object.pose.bones if bone.constraints.get('Copy Rotation')
-        }
-        logger.debug(f"Found {len(self.copyConstraints)} copy-constraints: [{self.copyConstraints.keys()}]")
-        
+        self.codec = ChannelCodec(posture) if posture is not None else None
+        self.scheduler = scheduler
+        self._activeConstraints = set()
+        self._object = None
+        self._quaternionMode = False
+        self._twoBoneIK = None
+        self.lastSolution = None    # see server.warmstart
+        self.snapshots = snapshots
+        _applications.add(self)
+        
+        logger.info("New sceleton: %s", avatar_id)
         
         self.base_matrix = {}
         self.zero_matrix = {}
@@ -85,8 +107,8 @@ class IntermediateSkeletonApplication():
             self.ScaleMAvatarPosture(posture)
             
         if self.object is not None:
-            RightKnee               = self.object.pose.bones['RightKnee']
-            RightHip                = self.object.pose.bones['RightHip']
+            RightKnee               = self.bones['RightKnee']
+            RightHip                = self.bones['RightHip']
             self.lowerlegLength     = RightKnee.vector.length
             self.thighLength        = RightHip.vector.length
             
@@ -97,18 +119,177 @@ class IntermediateSkeletonApplication():
         logger.debug("Done initializing %s", self.name)
 
     def __repr__(self):
-        return f"<{self.__class__} self.name"
+        return "<%s %s>" % (self.__class__.__name__, self.name)
         
     @property
     def object(self):
         """Returns the Handle to manipulate the Armature in Blender."""
-        return bpy.data.objects[self._object_id]
+        if self._object is None:
+            self._resolveHandles()
+        return self._object
+        
+    @property
+    def bones(self) -> Dict[str, bpy.types.PoseBone]:
+        """Pose bones by name"""
+        if self._object is None:
+            self._resolveHandles()
+        return self._bones
+        
+    @property
+    def ikTargets(self) -> Dict[str, bpy.types.PoseBone]:
+        """IK-Bones (<name>IK) by the name of their associated bone"""
+        if self._object is None:
+            self._resolveHandles()
+        return self._ikTargets
+        
+    @property
+    def ikConstraints(self) -> Dict[str, bpy.types.Constraint]:
+        if self._object is None:
+            self._resolveHandles()
+        return self._ikConstraints
+        
+    @property
+    def copyConstraints(self) -> Dict[str, bpy.types.Constraint]:
+        if self._object is None:
+            self._resolveHandles()
+        return self._copyConstraints
+        
+    def _resolveHandles(self):
+        """Looks up the armature, its pose bones, IK-Bones and constraints 
+        once. The handles stay valid until invalidateHandles is called."""
+        o = bpy.data.objects[self._object_id]
+        bones = o.pose.bones
+        
+        self._bones = {bone.name: bone for bone in bones}
+        self._ikTargets = {name: self._bones[name+'IK'] 
+            for name in self._bones if name+'IK' in self._bones
+        }
+        self._ikConstraints = {bone.name: bone.constraints.get('IK') 
+            for bone in bones if bone.constraints.get('IK')
+        }
+        logger.debug("Found %i ik-constraints: [%s]", 
+            len(self._ikConstraints), self._ikConstraints.keys())
+        
+        self._copyConstraints = {bone.name: bone.constraints.get('Copy Rotation') 
+            for bone in bones if bone.constraints.get('Copy Rotation')
+        }
+        logger.debug("Found %i copy-constraints: [%s]", 
+            len(self._copyConstraints), self._copyConstraints.keys())
+        
+        self._object = o
+        self._quaternionMode = False
+        self._bulkIndex()
+        return
+        
+    def invalidateHandles(self):
+        """Drops all resolved handles. Necessary whenever Blender rebuilds 
+        the pose (leaving EDIT-mode) or replaces the datablocks (file reload)."""
+        self._object = None
+        self._quaternionMode = False
+        self.lastSolution = None
+        self.scheduler.invalidate(self._object_id)
+        return
     
+    @property
+    def twoBoneIK(self) -> TwoBoneIK:
+        """Analytic solver for hands and feet, built from the scaled rest pose"""
+        if self._twoBoneIK is None:
+            if self._object is None:
+                self._resolveHandles()
+            self._twoBoneIK = TwoBoneIK.fromApplication(self)
+        return self._twoBoneIK
+        
     @property
     def name(self):
         """Name of the Avatar"""
         return self.object.name
         
+    def _bulkIndex(self):
+        """Precomputes the position of the posture joints in the collection 
+        of pose bones for the bulk access."""
+        bones = self.object.pose.bones
+        self._boneCount = len(bones)
+        self._parentIndex = np.array([-1 if bone.parent is None else bones.find(bone.parent.name) 
+            for bone in bones], dtype=np.intp)
+        if self.codec is not None:
+            self._poseIndex = np.array([bones.find(joint_id) 
+                for joint_id in self.codec.joints], dtype=np.intp)
+            if np.any(self._poseIndex < 0):
+                missing = [joint_id for joint_id, idx 
+                    in zip(self.codec.joints, self._poseIndex) if idx < 0]
+                raise ValueError(f"Joints missing in the armature: {missing}")
+        
+        self._restLocations = np.zeros((self._boneCount, 3), dtype=np.float32)
+        self._restRotations = np.zeros((self._boneCount, 4), dtype=np.float32)
+        self._restRotations[:, 0] = 1.
+        return
+        
+    def _ensureQuaternionMode(self):
+        """rotation_mode is an enum and has no bulk access. Nothing else 
+        changes it, so it only needs to be set once per skeleton."""
+        if not self._quaternionMode:
+            for b in self.object.pose.bones:
+                b.rotation_mode = "QUATERNION"
+            self._quaternionMode = True
+        return
+        
+    def getPoseState(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Reads the locations and rotations of all pose bones with one bulk 
+        access each.
+        
+        returns:
+            - locations: array (bones, 3)
+            - rotations: array (bones, 4) quaternions (w, x, y, z)
+        """
+        bones = self.object.pose.bones
+        locations = np.empty(self._boneCount * 3, dtype=np.float32)
+        rotations = np.empty(self._boneCount * 4, dtype=np.float32)
+        bones.foreach_get("location", locations)
+        bones.foreach_get("rotation_quaternion", rotations)
+        return locations.reshape(-1, 3), rotations.reshape(-1, 4)
+        
+    def setPoseState(self, locations: np.ndarray, rotations: np.ndarray):
+        """
+        Writes the locations and rotations of all pose bones with one bulk 
+        access each.
+        
+        parameters:
+            - locations: array (bones, 3)
+            - rotations: array (bones, 4) quaternions (w, x, y, z)
+        """
+        self._ensureQuaternionMode()
+        o = self.object
+        o.pose.bones.foreach_set("location", 
+            np.ascontiguousarray(locations, dtype=np.float32).ravel())
+        o.pose.bones.foreach_set("rotation_quaternion", 
+            np.ascontiguousarray(rotations, dtype=np.float32).ravel())
+        # foreach_set bypasses the rna-update, the depsgraph has to be told
+        o.update_tag()
+        self.scheduler.touch(self._object_id, POSE)
+        self.lastSolution = None
+        return
+        
+    def evaluate(self, reason: str = "") -> bool:
+        """Makes sure the matrices of the pose bones are evaluated. Changed 
+        IK-targets only matter while a constraint is active."""
+        kinds = {POSE, CONSTRAINTS, TARGETS} if self._activeConstraints else {POSE, CONSTRAINTS}
+        return self.scheduler.evaluate(self._object_id, kinds, reason)
+        
+    def resetPose(self):
+        """Puts all pose bones (including IK-Bones) in their rest pose."""
+        self.setPoseState(self._restLocations, self._restRotations)
+        return
+        
+    def snapshotPose(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns a copy of the current pose, see restorePose."""
+        return self.getPoseState()
+        
+    def restorePose(self, snapshot: Tuple[np.ndarray, np.ndarray]):
+        """Restores a pose taken with snapshotPose."""
+        self.setPoseState(*snapshot)
+        return
+        
     def getPostureLegend(self):
         """Accesses the Default-Posture to retrieve the ordering of joint.id's 
         and channels."""
@@ -128,9 +309,11 @@ class IntermediateSkeletonApplication():
         
         if id is not None:
             logger.debug("Reset Position of IK Bone %s.", id)
-            bone = self.object.pose.bones[id]
-            ikbone = self.object.pose.bones[id+'IK'] # use Effector-Map
+            self.evaluate("resetBoneMatrix")
+            bone = self.bones[id]
+            ikbone = self.ikTargets[id]
             ikbone.matrix = bone.matrix
+            self.scheduler.touch(self._object_id, TARGETS)
         else:
             for name in self.ikConstraints.keys():
                 self.resetBoneMatrix(name)
@@ -147,6 +330,24 @@ class IntermediateSkeletonApplication():
                         skeleton. (e.g. from <MAvatarDescription>)
         """
         logger.debug("Call to ScaleMAvatarPosture")
+        key = self.snapshots.key(posture) if self.snapshots is not None else None
+        snapshot = self.snapshots.load(key) if key is not None else None
+        if snapshot is not None and self._applySnapshot(snapshot):
+            logger.debug("%s scaled from the snapshot %s", self._object_id, key)
+        else:
+            snapshot = self._scale(posture)
+            if key is not None:
+                self.snapshots.save(key, snapshot)
+        
+        # the same in the order of the pose bones for the bulk access
+        self._baseStack = np.array([self.base_matrix[b.name] for b in self.object.pose.bones])
+        self._twoBoneIK = None
+                
+        self.resetBoneMatrix()
+        return
+        
+    def _scale(self, posture: tavatar.MAvatarPosture) -> RigSnapshot:
+        """Sets the edit bones to the joints of the posture, returns the result."""
         o = self.object
         armature = o.data
         
@@ -155,26 +356,25 @@ class IntermediateSkeletonApplication():
         
         edit_bones = armature.edit_bones
 
-        for b in o.pose.bones:
-            b.rotation_mode="QUATERNION"
-            b.rotation_quaternion = Quaternion((1,0,0,0))
-            b.location = Vector((0,0,0))
-
-        bpy.context.view_layer.update()
+        self.resetPose()
+        self.scheduler.evaluate(self._object_id, reason="ScaleMAvatarPosture")
         
-        for j in posture.Joints:
+        # local offsets and rotations of all joints in blender coordinates
+        positions = Conversion.positions_m2b(Conversion.mvectors_to_array(j.Position for j in posture.Joints))
+        rotations = Conversion.quaternions_m2b(Conversion.mquaternions_to_array(j.Rotation for j in posture.Joints))
+        for j, position, local_rotation in zip(posture.Joints, positions, rotations):
             # first iteration: set joint heads. 
             #logger.debug('set joint head for %s', j.ID)
             b = edit_bones[j.ID]
             parent_rotation = Quaternion() if j.Parent is None else Quaternion(b.parent["globalRot"])
             
             # global rotation of this joint
-            rotation = parent_rotation @  MQuaternion2Quaternion(j.Rotation)
+            rotation = parent_rotation @  Quaternion(local_rotation)
             b["globalRot"] = rotation
             
             # global position of this joint
             parent_pos = Vector() if j.Parent is None else b.parent.head
-            b.head = parent_pos + parent_rotation @ MVector2Vector(j.Position)
+            b.head = parent_pos + parent_rotation @ Vector(position)
             
         for j in posture.Joints:
             # second iteration: set joint tails
@@ -186,20 +386,59 @@ class IntermediateSkeletonApplication():
                 # in case there is a child, due to the design of the intermediate skeleton, 
                 # the first child is always the child were the joint is pointing to. 
                 b.tail = b.children[0].head
+                
+        heads = np.empty(len(edit_bones) * 3, dtype=np.float32)
+        tails = np.empty(len(edit_bones) * 3, dtype=np.float32)
+        rolls = np.empty(len(edit_bones), dtype=np.float32)
+        edit_bones.foreach_get("head", heads)
+        edit_bones.foreach_get("tail", tails)
+        edit_bones.foreach_get("roll", rolls)
+        edit_names = [b.name for b in edit_bones]
 
         bpy.ops.object.mode_set(mode="OBJECT", toggle=False)    
-        bpy.context.view_layer.update()
+        # leaving EDIT-mode rebuilds the pose bones
+        self.invalidateHandles()
+        self.scheduler.evaluate(self._object_id, reason="ScaleMAvatarPosture")
 
 
-        for b in o.pose.bones:
+        for b in self.object.pose.bones:
             self.zero_matrix[b.name] = Matrix(b.matrix)
             if b.parent is None:
                 self.base_matrix[b.name] = b.matrix.inverted()
             else:
                 self.base_matrix[b.name] = (b.parent.matrix.inverted() @ b.matrix).inverted()
-                
-        self.resetBoneMatrix()
-        return
+        
+        pose_names = [b.name for b in self.object.pose.bones]
+        return RigSnapshot(edit_names, heads.reshape(-1, 3), tails.reshape(-1, 3), rolls, pose_names,
+            np.array([self.zero_matrix[name] for name in pose_names]),
+            np.array([self.base_matrix[name] for name in pose_names]))
+        
+    def _applySnapshot(self, snapshot: RigSnapshot) -> bool:
+        """Sets the edit bones and the matrices from a snapshot in bulk, 
+        without evaluating the scene. False if it does not fit the armature."""
+        o = self.object
+        self.resetPose()
+        bpy.context.view_layer.objects.active = o
+        bpy.ops.object.mode_set(mode="EDIT", toggle=False)
+        
+        edit_bones = o.data.edit_bones
+        matches = [b.name for b in edit_bones] == snapshot.editBones
+        if matches:
+            edit_bones.foreach_set("head", np.ascontiguousarray(snapshot.heads, dtype=np.float32).ravel())
+            edit_bones.foreach_set("tail", np.ascontiguousarray(snapshot.tails, dtype=np.float32).ravel())
+            edit_bones.foreach_set("roll", np.ascontiguousarray(snapshot.rolls, dtype=np.float32))
+            
+        bpy.ops.object.mode_set(mode="OBJECT", toggle=False)
+        # leaving EDIT-mode rebuilds the pose bones
+        self.invalidateHandles()
+        if not matches or [b.name for b in self.object.pose.bones] != snapshot.poseBones:
+            logger.warning("Rig snapshot does not fit the armature %s, scaling it", self._object_id)
+            return False
+            
+        for name, zero, base in zip(snapshot.poseBones, snapshot.zero, snapshot.base):
+            self.zero_matrix[name] = Matrix(zero.tolist())
+            self.base_matrix[name] = Matrix(base.tolist())
+        return True
         
     def ApplyMAvatarPostureValues(self, values: List[float]):
         """
@@ -213,48 +452,29 @@ class IntermediateSkeletonApplication():
         logger.debug("Call to ApplyMAvatarPostureValues")
 
         self.disableAllConstraints()
-        i = 0
-        for joint in self.posture.Joints:
-            posebone = self.object.pose.bones[joint.ID]
-            
-            t = Vector()
-            q = Quaternion()
-            
-            
-            # coordinate system transforms: 
-            # translation (x,y,z) -> (-x, y, z)
-            # quaternion (w, x, y, z) -> (-w, -x, y, z)
-            for channel in joint.Channels: # refactor with dict?
-                if channel == tavatar.MChannel.XOffset:
-                    t.x = -values[i]
-                elif channel == tavatar.MChannel.YOffset:
-                    t.y = values[i]
-                elif channel == tavatar.MChannel.ZOffset:
-                    t.z = values[i]
-                    
-                elif channel == tavatar.MChannel.WRotation:
-                    q.w = -values[i]
-                elif channel == tavatar.MChannel.XRotation:
-                    q.x = -values[i]
-                elif channel == tavatar.MChannel.YRotation:
-                    q.y = values[i]
-                elif channel == tavatar.MChannel.ZRotation:
-                    q.z = values[i]
-                #logger.debug("Apply value %f to joint [%s] in channel %s", values[i], joint.ID, channel)
-                i += 1
-
-            if joint.ID == 'RightWrist' or joint.ID == 'RightMiddleMeta':
-                logger.debug('Apply Position [%s] and Quaternion [%s] to [%s]', t, q, joint.ID)
-            
-            # we can directly set the rotations and locations, due to the fact 
-            # that we set up the blender rig exactly as the intermediate skeleton. 
-            #logger.debug("from vector %s and Quaternion %s at bone %s", posebone.location, posebone.rotation_quaternion, posebone.name)
-            #logger.debug("Apply vector %s and Quaternion %s to bone %s", t, q, posebone.name)
-            posebone.rotation_quaternion = Quaternion(q)
-            posebone.location = Vector(t)
+        
+        # we can directly set the rotations and locations, due to the fact 
+        # that we set up the blender rig exactly as the intermediate skeleton. 
+        # Bones outside of the posture (IK-Bones) keep their state.
+        locations, rotations = self.getPoseState()
+        locations[self._poseIndex], rotations[self._poseIndex] = self.codec.decode(values)
+        self.setPoseState(locations, rotations)
             
         return
     
+    def BakeMAvatarPostureValues(self, values: List[float]):
+        """
+        Writes posture values into the pose like ApplyMAvatarPostureValues, 
+        but keeps the constraints active. Used to continue from a solution.
+        
+        parameters:
+            - values: list[float]
+        """
+        locations, rotations = self.getPoseState()
+        locations[self._poseIndex], rotations[self._poseIndex] = self.codec.decode(values)
+        self.setPoseState(locations, rotations)
+        return
+        
     def ReadMAvatarPostureValues(self) -> List[float]:
         """
         This function reads intermediate skeleton rotation values from the 
@@ -266,60 +486,22 @@ class IntermediateSkeletonApplication():
         """
         
         logger.debug("Call to ReadMAvatarPostureValues")
-        animationValues    = []
-        matrices = {}
-        
-        #rwik = bpy.data.objects['lalala'].pose.bones['RightWrist']
-        #logger.debug("Start of ReadMAvatarPostureValues: RightWrist at position: %s, %s", rwik.matrix.translation, rwik.rotation_quaternion)
-        #for bone in self.object.pose.bones: # refactor!
-        #    matrices[bone.name] = (Matrix(bone.matrix))
-        
-        #rwik = bpy.data.objects['lalala'].pose.bones['RightWrist']
-        #logger.debug("Middle of ReadMAvatarPostureValues: RightWrist at position: %s, %s", rwik.matrix.translation, rwik.rotation_quaternion)
-        #for bone in bpy.data.objects['lalala'].pose.bones:#self.object.pose.bones: # refactor!
-        #    bone.matrix = matrices[bone.name]
-            
-        #logger.debug("End of ReadMAvatarPostureValues: RightWrist at position: %s, %s", rwik.matrix.translation, rwik.rotation_quaternion)
-        bpy.context.view_layer.update()
+        self.evaluate("ReadMAvatarPostureValues")
 
-        for joint in self.posture.Joints:
-            matrix = bpy.data.objects['lalala'].convert_space(
-                pose_bone=bpy.data.objects['lalala'].pose.bones[joint.ID],
-                matrix=bpy.data.objects['lalala'].pose.bones[joint.ID].matrix, 
-                from_space='WORLD', to_space='LOCAL'
-            )
-            q = matrix.to_quaternion()
-            t = matrix.translation
-            if joint.ID=='RightWrist':
-                logger.debug("loop of ReadMAvatarPostureValues: RightWrist at position: %s, %s", t, q)
-
-            # coordinate system transforms: 
-            # translation (x,y,z) -> (-x, y, z)
-            # quaternion (w, x, y, z) -> (-w, -x, y, z)
-            for channel in joint.Channels:
-                if channel == tavatar.MChannel.XOffset:
-                    animationValues.append(-t.x)
-                elif channel == tavatar.MChannel.YOffset:
-                    animationValues.append(t.y)
-                elif channel == tavatar.MChannel.ZOffset:
-                    animationValues.append(t.z)
-                    
-                elif channel == tavatar.MChannel.WRotation:
-                    animationValues.append(-q.w)
-                elif channel == tavatar.MChannel.XRotation:
-                    animationValues.append(-q.x)
-                elif channel == tavatar.MChannel.YRotation:
-                    animationValues.append(q.y)
-                elif channel == tavatar.MChannel.ZRotation:
-                    animationValues.append(q.z)
-                
-            #logger.debug("Read vector %s and Quaternion %s to bone %s", t, q, posebone.name)
+        # all evaluated pose matrices at once, foreach_get delivers them 
+        # column by column
+        o = self.object
+        matrices = np.empty(self._boneCount * 16, dtype=np.float32)
+        o.pose.bones.foreach_get("matrix", matrices)
+        pose = matrices.reshape(-1, 4, 4).transpose(0, 2, 1)
         
-        #rwik = self.object.pose.bones['RightWrist']
-        #pos = rwik.matrix.translation
-        #rot = rwik.rotation_quaternion
+        # same as convert_space(from_space='WORLD', to_space='LOCAL') per bone
+        local = local_transforms(pose, self._parentIndex, self._baseStack, 
+            np.array(o.matrix_world))[self._poseIndex]
+        locations = local[:, :3, 3]
+        rotations = matrices_to_quaternions(local)
         
-        return animationValues
+        return self.codec.encode(locations, rotations).tolist()
         
     def AddPositionConstraint(self, joint_in: str, target: Vector): # t -> Naming!
         """
@@ -336,19 +518,11 @@ class IntermediateSkeletonApplication():
         self.enableIKConstraint(effector)
         
         # Blender pose bones: joint_in-related bones
-        o           = self.object  # Blender's armature
-        IKTarget      = o.pose.bones[effector + "IK"]
-        HandBone      = o.pose.bones[effector] 
-        
-        # Blender pose bones: auxiliary bones
-        PelvisCenter = o.pose.bones["PelvisCenter"]
-        RightAnkle   = o.pose.bones["RightAnkle"]       
-        LeftAnkle    = o.pose.bones["LeftAnkle"]  
-        RightAnkleIK  = o.pose.bones["RightAnkleIK"] # available in IKService_play.blend  
-        LeftAnkleIK   = o.pose.bones["LeftAnkleIK"]  # available in IKService_play.blend 
+        IKTarget      = self.ikTargets[effector]
         
         # Set the IKTarget to the desired position
         IKTarget.matrix.translation    = target # In armature coordinates
+        self.scheduler.touch(self._object_id, TARGETS)
         
         # If the IK-Target is too low, then change the position of the root bone (PelvisCenter) to bend the legs 
         # if targetCoordinates.y < self.bendThreshold and joint_id in {'RightHand', 'LeftHand'}:
@@ -358,25 +532,29 @@ class IntermediateSkeletonApplication():
 
     def FixAtCurrentPosititionRotation(self, joint_in : str):
         logger.debug("Fix other joints current position and rotation. ")
-        print("Fix other joints current position and rotation. ")
         effector, offset = self.effectorMap.get(joint_in, (None, None))
         if effector is None:
             raise Exception(f"Unknown id for joint_in [{joint_in}]")
 
         # Blender pose bones: joint_in-related bones
         o           = self.object  # Blender's armature
-        IKTarget      = o.pose.bones[effector + "IK"]
-        HandBone      = o.pose.bones[effector] 
+        IKTarget      = self.ikTargets[effector]
+        HandBone      = self.bones[effector] 
 
+        self.evaluate("FixAtCurrentPosititionRotation")
         IKTarget.matrix = o.matrix_world @ HandBone.matrix
+        self.scheduler.touch(self._object_id, TARGETS)
         
         self.enableIKConstraint(effector)
         return
     
     def getJointPosition(self, joint_id: str):
-        return self.object.pose.bones[joint_id].head
+        self.evaluate("getJointPosition")
+        return self.bones[joint_id].head
         
     def croutch(self):
+        PelvisCenter = self.bones["PelvisCenter"]
+        RightAnkleIK = self.ikTargets["RightAnkle"]
         self.enableIKConstraint('LeftAnkle')
         self.enableIKConstraint('RightAnkle')
         PelvisCenter.location.y        = -self.lowerlegLength # He jumps here
@@ -390,67 +568,117 @@ class IntermediateSkeletonApplication():
             rot       : rotation, any of (Quaternion, Euler, Matrix)
         """
         
-        logger.debug(f"Call to AddRotationConstraint({joint_id}, {rot})")
-        skeletonQ = Quaternion()
+        logger.debug("Call to AddRotationConstraint(%s, %s)", joint_id, rot)
         if isinstance(rot, (Euler, Matrix)):
             rot = rot.to_quaternion()
 
-        bpy.context.view_layer.update()
         effector, offset = self.effectorMap.get(joint_id, (None, None))
         if effector is None:
             logger.warning("Unknown joint_id [%s]", joint_id)
             return
             
+        # evaluates the pose including previous constraints and puts the 
+        # IK-Bone at the current position of the effector
         self.enableCopyConstraint(effector)
-        bpy.context.view_layer.update()
 
-        #blenderPoseBone = bpy.data.objects['lalala'].pose.bones[effector+"IK"]
-        #logger.debug(f"rot: {rot}")
-        
-        for j in self.posture.Joints: # move to IKService
-            if j.ID == effector:
-                #logger.debug(f"Rotating %s", j)
-                for channel in j.Channels:
-                    if   channel == tavatar.MChannel.WRotation:
-                        skeletonQ.w = rot.w
-                    elif channel == tavatar.MChannel.XRotation:
-                        skeletonQ.x = rot.x
-                    elif channel == tavatar.MChannel.YRotation:
-                        skeletonQ.y = rot.y
-                    elif channel == tavatar.MChannel.ZRotation:
-                        skeletonQ.z = rot.z
-        
+        skeletonQ = self._transmittedRotation(effector, rot)
 
-        ikbone = bpy.data.objects['lalala'].pose.bones[effector+"IK"]
-        # backup translation component
-        translation = Vector(ikbone.matrix.translation)
-        # set rotation constraint, incorporate base-matrix to get the right rotation
-        ikbone.matrix = skeletonQ.to_matrix().to_4x4() #@ ikbone.matrix_basis
-        bpy.context.view_layer.update()
-        # re-set translational component
-        ikbone.matrix.translation = translation
-        bpy.context.view_layer.update()
+        ikbone = self.ikTargets[effector]
+        # set rotation constraint and keep the translation the IK-Bone got 
+        # from resetBoneMatrix in one write, without reading it back
+        matrix = skeletonQ.to_matrix().to_4x4()
+        matrix.translation = self.bones[effector].matrix.translation
+        ikbone.matrix = matrix
+        self.scheduler.touch(self._object_id, TARGETS)
 
         #logger.debug(f"After: {blenderPoseBone.matrix}")
     
+    def _transmittedRotation(self, effector: str, rot: Quaternion) -> Quaternion:
+        """Only the components of the rotation the joint transmits, the others 
+        of the identity."""
+        skeletonQ = Quaternion()
+        for component, transmitted in enumerate(self.codec.rotationMask(effector)):
+            if transmitted:
+                skeletonQ[component] = rot[component]
+        return skeletonQ
+        
+    def setIKTargets(self, targets, fixed: Iterable[str] = ()):
+        """
+        Places the IK-Bones of all targets at once, like FixAtCurrentPosititionRotation 
+        for the <fixed> joints followed by AddPositionConstraint and 
+        AddRotationConstraint for the targets, but without evaluating: the 
+        effectors are read from the last evaluation, which must include the 
+        posture. So the armatures of a batch wave share one evaluation.
+        
+        parameters:
+            - targets: (joint_id, position, rotation) in armature coordinates, 
+                       position or rotation may be None
+            - fixed: joints held at their current position and rotation
+        """
+        goals = {}  # effector -> [position, rotation, fixed]
+        for joint_in in fixed:
+            effector, offset = self.effectorMap.get(joint_in, (None, None))
+            if effector is None:
+                raise Exception(f"Unknown id for joint_in [{joint_in}]")
+            goals[effector] = [None, None, True]
+        for target in targets:
+            effector, offset = self.effectorMap.get(target.joint_id, (None, None))
+            if effector is None:
+                raise Exception(f"Unknown id for joint_in [{target.joint_id}]")
+            goal = goals.setdefault(effector, [None, None, False])
+            if target.position is not None:
+                goal[0] = target.position
+            if target.rotation is not None:
+                goal[1] = target.rotation
+                
+        for effector, (position, rotation, hold) in goals.items():
+            matrix = Matrix(self.bones[effector].matrix)
+            if rotation is not None:
+                if isinstance(rotation, (Euler, Matrix)):
+                    rotation = rotation.to_quaternion()
+                translation = matrix.translation
+                matrix = self._transmittedRotation(effector, rotation).to_matrix().to_4x4()
+                matrix.translation = translation
+            if position is not None:
+                matrix.translation = position
+            self.ikTargets[effector].matrix = matrix
+            if position is not None or hold:
+                self._unmuteIKConstraint(effector)
+            if rotation is not None:
+                self._unmuteCopyConstraint(effector)
+        self.scheduler.touch(self._object_id, TARGETS)
+        return
+        
     def getJointRotation(self, joint_id: str):
-        return self.object.pose.bones[joint_id].rotation_quaternion
+        return self.bones[joint_id].rotation_quaternion
     
     def solveIK(self):
         logger.debug("Call to solveIK")
-        pass # bpy.ops.scene.update() # 
+        self.evaluate("solveIK")
         
     def enableIKConstraint(self, name):
         self.resetBoneMatrix(name)
+        self._unmuteIKConstraint(name)
+        return
+        
+    def _unmuteIKConstraint(self, name):
         constraint = self.ikConstraints.get(name, None)
         constraint.mute = False
+        self._activeConstraints.add(('IK', name))
+        self.scheduler.touch(self._object_id, CONSTRAINTS)
         return
         
     def enableCopyConstraint(self, name):
         self.resetBoneMatrix(name)
+        self._unmuteCopyConstraint(name)
+        return
+        
+    def _unmuteCopyConstraint(self, name):
         try:
             constraint = self.copyConstraints[name]
             constraint.mute = False
+            self._activeConstraints.add(('Copy Rotation', name))
+            self.scheduler.touch(self._object_id, CONSTRAINTS)
         except KeyError:
             logger.exception("Can't find Copy-Constraint %s", name)
             raise Exception("Can't find Copy-Constraint %s", name)
@@ -464,6 +692,9 @@ class IntermediateSkeletonApplication():
         for name, constraint in self.copyConstraints.items():
             constraint.mute = True
         
+        self._activeConstraints.clear()
+        self.scheduler.touch(self._object_id, CONSTRAINTS)
+        self.lastSolution = None
         logger.debug("All known Constraints disabled.")
         return
         
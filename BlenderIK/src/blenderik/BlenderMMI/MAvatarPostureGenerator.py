@@ -14,18 +14,19 @@ import json
 from MMIStandard.avatar.ttypes import MAvatarPosture, MJoint, MJointType, MChannel
 from MMIStandard.math.ttypes import MQuaternion, MVector3
 
+from BlenderMMI.ChannelCodec import ChannelCodec
+from BlenderMMI import Conversion
+
 #from BlenderMMI.IntermediateSkeletonApplication import IntermediateSkeletonApplication
 
 #--> MQuaternion(q.x, q.z, q.y, -q.w)
 #--> MVector3(v.x, v.z, v.y)
 
 def MVector2Vector(v):
-    #return Vector((v.X, v.Z, v.Y))
-    return Vector((-v.X, v.Y, v.Z))
+    return Vector(Conversion.positions_m2b((v.X, v.Y, v.Z)))
 
 def MQuaternion2Quaternion(q):
-    #return Quaternion((-q.W, q.X, q.Z, q.Y))
-    return Quaternion((-q.W, -q.X, q.Y, q.Z))
+    return Quaternion(Conversion.quaternions_m2b((q.X, q.Y, q.Z, q.W)))
 
 def ID2MChannel(id):
     if(id == 0):
@@ -145,10 +146,12 @@ def CreateArmature(posture):
     ###
     # position head
     ###
-    for j in posture.Joints:
+    positions = Conversion.positions_m2b(Conversion.mvectors_to_array(j.Position for j in posture.Joints))
+    rotations = Conversion.quaternions_m2b(Conversion.mquaternions_to_array(j.Rotation for j in posture.Joints))
+    for j, position, rotation in zip(posture.Joints, positions, rotations):
         b = edit_bones[j.ID]
-        rotation = MQuaternion2Quaternion(j.Rotation)
-        position = MVector2Vector(j.Position)
+        rotation = Quaternion(rotation)
+        position = Vector(position)
         
         if not j.Parent is None:
             parent = GetJointByName(posture.Joints, j.Parent)
@@ -259,60 +262,22 @@ def CreateArmature(posture):
     return o
 
 
-def ApplyMAvatarPostureValues(o, posture, values):
-    i = 0
-    for j in posture.Joints:
-        pb = o.pose.bones[j.ID]
-        
-        t = Vector()
-        q = Quaternion()
-        
-        for c in j.Channels:
-            if c == MChannel.XOffset:
-                t.x = -values[i]
-            elif c == MChannel.YOffset:
-                t.y = values[i]
-            elif c == MChannel.ZOffset:
-                t.z = values[i]
-                
-            elif c == MChannel.WRotation:
-                q.w = -values[i]
-            elif c == MChannel.XRotation:
-                q.x = -values[i]
-            elif c == MChannel.YRotation:
-                q.y = values[i]
-            elif c == MChannel.ZRotation:
-                q.z = values[i]
-            i += 1
+def ApplyMAvatarPostureValues(o, posture, values, codec=None):
+    if codec is None:
+        codec = ChannelCodec(posture)
+    locations, rotations = codec.decode(values)
+    for joint_id, t, q in zip(codec.joints, locations, rotations):
+        pb = o.pose.bones[joint_id]
         pb.rotation_quaternion = q
         pb.location = t
         
         
-def ReadMAvatarPostureValues(o, posture):
-    data = []
-    
-    for j in posture.Joints:
-        pb = o.pose.bones[j.ID]
-        t = pb.location
-        q = pb.rotation_quaternion
-
-        for c in j.Channels:
-            if c == MChannel.XOffset:
-                data.append(-t.x)
-            elif c == MChannel.YOffset:
-                data.append(t.y)
-            elif c == MChannel.ZOffset:
-                data.append(t.z)
-                
-            elif c == MChannel.WRotation:
-                data.append(-q.w)
-            elif c == MChannel.XRotation:
-                data.append(-q.x)
-            elif c == MChannel.YRotation:
-                data.append(q.y)
-            elif c == MChannel.ZRotation:
-                data.append(q.z)
-    return data
+def ReadMAvatarPostureValues(o, posture, codec=None):
+    if codec is None:
+        codec = ChannelCodec(posture)
+    locations = [o.pose.bones[joint_id].location for joint_id in codec.joints]
+    rotations = [o.pose.bones[joint_id].rotation_quaternion for joint_id in codec.joints]
+    return codec.encode(locations, rotations).tolist()
 
 
 #path = bpy.path.abspath("//new_intermediate.mos")
@@ -0,0 +1,90 @@
+"""
+Vectorized rotation and transformation helpers working on NumPy arrays.
+Matrices are row-major (like mathutils), quaternions in blender order
+(w, x, y, z). All functions accept arbitrary leading batch dimensions.
+"""
+
+import numpy as np
+
+def matrices_to_quaternions(m: np.ndarray) -> np.ndarray:
+    """
+    Converts rotation matrices (..., 3, 3) or (..., 4, 4) to unit quaternions
+    (..., 4). Follows the branches of mathutils' Matrix.to_quaternion, so the
+    signs of the quaternions match.
+    """
+    m = np.asarray(m, dtype=float)[..., :3, :3]
+    # normalize the axes, like mathutils does before the conversion
+    m = m / np.linalg.norm(m, axis=-2, keepdims=True)
+
+    m00, m01, m02 = m[..., 0, 0], m[..., 0, 1], m[..., 0, 2]
+    m10, m11, m12 = m[..., 1, 0], m[..., 1, 1], m[..., 1, 2]
+    m20, m21, m22 = m[..., 2, 0], m[..., 2, 1], m[..., 2, 2]
+
+    q = np.empty(m.shape[:-2] + (4,))
+    tr = 0.25 * (1. + m00 + m11 + m22)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # w dominant
+        s = np.sqrt(np.maximum(tr, 0.))
+        qw = np.stack((s, (m21-m12)/(4.*s), (m02-m20)/(4.*s), (m10-m01)/(4.*s)), axis=-1)
+        # x dominant
+        s = 2. * np.sqrt(np.maximum(1. + m00 - m11 - m22, 0.))
+        qx = np.stack(((m21-m12)/s, 0.25*s, (m01+m10)/s, (m02+m20)/s), axis=-1)
+        # y dominant
+        s = 2. * np.sqrt(np.maximum(1. + m11 - m00 - m22, 0.))
+        qy = np.stack(((m02-m20)/s, (m01+m10)/s, 0.25*s, (m12+m21)/s), axis=-1)
+        # z dominant
+        s = 2. * np.sqrt(np.maximum(1. + m22 - m00 - m11, 0.))
+        qz = np.stack(((m10-m01)/s, (m02+m20)/s, (m12+m21)/s, 0.25*s), axis=-1)
+
+    use_w = (tr > 1e-4)[..., None]
+    use_x = ((m00 > m11) & (m00 > m22))[..., None]
+    use_y = (m11 > m22)[..., None]
+    q = np.where(use_w, qw, np.where(use_x, qx, np.where(use_y, qy, qz)))
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+def quaternions_to_matrices(q: np.ndarray) -> np.ndarray:
+    """Converts quaternions (..., 4) to rotation matrices (..., 3, 3)."""
+    q = np.asarray(q, dtype=float)
+    q = q / np.linalg.norm(q, axis=-1, keepdims=True)
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+
+    m = np.empty(q.shape[:-1] + (3, 3))
+    m[..., 0, 0] = 1. - 2.*(y*y + z*z)
+    m[..., 0, 1] = 2.*(x*y - w*z)
+    m[..., 0, 2] = 2.*(x*z + w*y)
+    m[..., 1, 0] = 2.*(x*y + w*z)
+    m[..., 1, 1] = 1. - 2.*(x*x + z*z)
+    m[..., 1, 2] = 2.*(y*z - w*x)
+    m[..., 2, 0] = 2.*(x*z - w*y)
+    m[..., 2, 1] = 2.*(y*z + w*x)
+    m[..., 2, 2] = 1. - 2.*(x*x + y*y)
+    return m
+
+def local_transforms(pose: np.ndarray, parents: np.ndarray, base: np.ndarray,
+        world: np.ndarray = None) -> np.ndarray:
+    """
+    Computes the local (basis) transforms of all bones of an armature from
+    their pose matrices, like Object.convert_space(from_space='WORLD',
+    to_space='LOCAL') does bone by bone.
+
+    parameters:
+        - pose: (..., bones, 4, 4) pose matrices
+        - parents: (bones,) index of the parent bone, -1 for roots
+        - base: (bones, 4, 4) inverse rest matrices relative to the parent
+        - world: (4, 4) world matrix of the armature object
+
+    returns:
+        - (..., bones, 4, 4) local matrices
+    """
+    pose = np.asarray(pose, dtype=float)
+    parents = np.asarray(parents)
+
+    parent_inv = np.broadcast_to(np.eye(4), pose.shape).copy()
+    has_parent = parents >= 0
+    parent_inv[..., has_parent, :, :] = np.linalg.inv(pose[..., parents[has_parent], :, :])
+
+    if world is not None:
+        pose = np.linalg.inv(np.asarray(world, dtype=float)) @ pose
+
+    return base @ parent_inv @ pose
@@ -0,0 +1,105 @@
+# std-Library
+from pathlib import Path
+from typing import NamedTuple, List, Optional
+import hashlib
+import os
+import tempfile
+import logging
+logger = logging.getLogger(__name__)
+
+import numpy as np
+
+# Version of the snapshot layout, part of the key
+VERSION = 1
+
+class RigSnapshot(NamedTuple):
+    """
+    Scaled armature of an IntermediateSkeletonApplication: the edit bones
+    after ScaleMAvatarPosture and the matrices derived from the rest pose,
+    each in the order of the names.
+    """
+    editBones: List[str]
+    heads: np.ndarray       # (edit bones, 3)
+    tails: np.ndarray       # (edit bones, 3)
+    rolls: np.ndarray       # (edit bones,)
+    poseBones: List[str]
+    zero: np.ndarray        # (pose bones, 4, 4) zero_matrix
+    base: np.ndarray        # (pose bones, 4, 4) base_matrix
+
+class RigSnapshotCache():
+    """
+    Directory of RigSnapshots, so a later start loads the scaled armatures
+    instead of computing them. A snapshot is keyed by a hash of the
+    blend-file and the joints of the posture (the .mos-file of the default
+    avatar), any change of either leads to a new one.
+    """
+
+    def __init__(self, directory, blendfile):
+        """
+        parameters:
+            - directory: of the snapshots, created if necessary
+            - blendfile: path of the blend-file the armatures come from
+        """
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._blendHash = _fileHash(Path(blendfile))
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, posture) -> str:
+        """Key of the scaled armature of <posture> (MAvatarPosture)."""
+        digest = hashlib.sha1(self._blendHash)
+        digest.update(b"%i" % VERSION)
+        for joint in posture.Joints:
+            position, rotation = joint.Position, joint.Rotation
+            digest.update(("%s|%s|%r|%r|%r|%r|%r|%r|%r;" % (joint.ID, joint.Parent,
+                position.X, position.Y, position.Z,
+                rotation.X, rotation.Y, rotation.Z, rotation.W)).encode("utf-8"))
+        return digest.hexdigest()
+
+    def load(self, key: str) -> Optional[RigSnapshot]:
+        path = self._path(key)
+        if not path.exists():
+            self.misses += 1
+            return None
+        try:
+            with np.load(str(path)) as data:
+                snapshot = RigSnapshot(
+                    editBones=data["editBones"].tolist(), heads=data["heads"],
+                    tails=data["tails"], rolls=data["rolls"],
+                    poseBones=data["poseBones"].tolist(), zero=data["zero"], base=data["base"])
+        except (OSError, KeyError, ValueError):
+            logger.warning("Rig snapshot %s is unreadable, it is rebuilt", path, exc_info=True)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return snapshot
+
+    def save(self, key: str, snapshot: RigSnapshot):
+        path = self._path(key)
+        # written to a file of its own first, a concurrent start never reads half 
+        # a file and concurrent saves do not write into each other's
+        handle, partial = tempfile.mkstemp(prefix=path.stem + ".", suffix=".npz", dir=str(self.dir))
+        partial = Path(partial)
+        try:
+            with os.fdopen(handle, "wb") as file:
+                np.savez(file, editBones=np.array(snapshot.editBones), heads=snapshot.heads,
+                    tails=snapshot.tails, rolls=snapshot.rolls, poseBones=np.array(snapshot.poseBones),
+                    zero=snapshot.zero, base=snapshot.base)
+            partial.replace(path)
+        except BaseException:
+            if partial.exists():
+                partial.unlink()
+            raise
+        logger.debug("Rig snapshot saved to %s", path)
+        return
+
+    def _path(self, key: str) -> Path:
+        return self.dir/("rig_%s.npz" % key)
+
+def _fileHash(path: Path) -> bytes:
+    digest = hashlib.sha1()
+    with path.open("rb") as file:
+        for chunk in iter(lambda: file.read(2**20), b""):
+            digest.update(chunk)
+    return digest.digest()
@@ -0,0 +1,87 @@
+# std-Library
+from typing import Hashable, Iterable, Optional
+import logging
+import time
+logger = logging.getLogger(__name__)
+
+#Blender
+import bpy
+
+# What a step changed. Evaluated matrices of the deform bones depend on the
+# pose and the constraints, those of the IK-Bones on the targets.
+POSE        = 'pose'
+CONSTRAINTS = 'constraints'
+TARGETS     = 'targets'
+ALL         = frozenset((POSE, CONSTRAINTS, TARGETS))
+
+class SceneUpdateScheduler():
+    """
+    Coalesces the depsgraph evaluations of the view layer.
+
+    Steps which change an armature mark it as dirty with touch(). Steps which
+    need evaluated matrices call evaluate(), which only updates the view layer
+    if something they depend on is dirty. The number of evaluations is counted
+    in total and per request, their time in total.
+    """
+
+    def __init__(self):
+        self._dirty         = {}    # key -> set of kinds
+        self.evaluations    = 0     # since start of the service
+        self.evaluationTime = 0.    # seconds spent in evaluations since start of the service
+        self.lastRequest    = 0     # evaluations of the last finished request
+        self.lastRequestTime = 0.   # seconds of those evaluations
+        self._requestStart  = 0
+        self._requestTime   = 0.
+
+    def touch(self, key: Hashable, kind: str = POSE):
+        """Marks the armature <key> as changed in <kind>."""
+        self._dirty.setdefault(key, set()).add(kind)
+        return
+
+    def isDirty(self, key: Optional[Hashable] = None, kinds: Iterable[str] = ALL) -> bool:
+        """True if the armature <key> (or any armature) changed in <kinds>."""
+        if key is None:
+            return any(not dirty.isdisjoint(kinds) for dirty in self._dirty.values())
+        # changes under the key None concern every armature
+        return not (self._dirty.get(key, set()) | self._dirty.get(None, set())).isdisjoint(kinds)
+
+    def evaluate(self, key: Optional[Hashable] = None, kinds: Iterable[str] = ALL,
+            reason: str = "") -> bool:
+        """
+        Updates the view layer if the armature <key> (or any armature) changed
+        in <kinds>. An update evaluates every armature in the scene, so all of
+        them are clean afterwards.
+
+        returns:
+            - True if the depsgraph was evaluated
+        """
+        if not self.isDirty(key, kinds):
+            return False
+
+        start = time.perf_counter()
+        bpy.context.view_layer.update()
+        self.evaluationTime += time.perf_counter() - start
+        self._dirty.clear()
+        self.evaluations += 1
+        logger.debug("Depsgraph evaluation %i (%s)", self.evaluations, reason)
+        return True
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """Forgets all state of the armature <key> (or of all armatures), e.g.
+        after a file reload. The next evaluate() will update."""
+        self._dirty.setdefault(key, set()).update(ALL)
+        return
+
+    def beginRequest(self):
+        self._requestStart = self.evaluations
+        self._requestTime = self.evaluationTime
+        return
+
+    def endRequest(self) -> int:
+        """Returns the number of evaluations since beginRequest()."""
+        self.lastRequest = self.evaluations - self._requestStart
+        self.lastRequestTime = self.evaluationTime - self._requestTime
+        return self.lastRequest
+
+# all armatures share one view layer
+scheduler = SceneUpdateScheduler()
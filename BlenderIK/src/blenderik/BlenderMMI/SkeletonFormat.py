@@ -0,0 +1,246 @@
+"""
+Compiled skeletons: the joints of a .mos-file as contiguous arrays in a
+binary file next to it (intermediate.mos -> intermediate.mskel), so loading
+an avatar description does not parse the JSON and build the MJoints.
+
+Layout, little-endian, every array aligned to 8 bytes:
+ - header       magic "MSKL", VERSION, sha1 of the .mos-file, number of
+                joints, bytes of the avatar id and of the joint names
+ - parents      (joints,)    int32, index of the parent joint, -1 for the root
+ - types        (joints,)    int32, MJointType
+ - positions    (joints, 3)  float64, MOSIM (x, y, z)
+ - rotations    (joints, 4)  float64, MOSIM (x, y, z, w)
+ - channels     (joints, 7)  int8, the channel ids of the .mos-file, -1 padded
+ - avatar id, joint names   utf-8, the names separated by "\\0"
+
+CompiledSkeleton maps the file into memory, the arrays are views of it and
+only the pages read are loaded. The MAvatarPosture is built on demand. The
+arrays keep the mapping alive, it is released with the last of them.
+"""
+# std-Library
+from pathlib import Path
+from typing import List, Optional, Union
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import logging
+logger = logging.getLogger(__name__)
+
+import numpy as np
+
+# MOSIM-declarations
+from MMIStandard.avatar.ttypes import MAvatarPosture, MJoint, MChannel
+from MMIStandard.math.ttypes import MQuaternion, MVector3
+
+MAGIC = b"MSKL"
+# Version of the layout, a file of another version is compiled again
+VERSION = 1
+SUFFIX = ".mskel"
+
+# magic, version, sha1 of the source, joints, bytes of avatar id and names
+_HEADER = struct.Struct("<4sI20sIII")
+_ALIGNMENT = 8
+_MAX_CHANNELS = 7
+# channel ids of the .mos-files, like MAvatarPostureGenerator.ID2MChannel
+_CHANNELS = (MChannel.XOffset, MChannel.YOffset, MChannel.ZOffset,
+    MChannel.XRotation, MChannel.YRotation, MChannel.ZRotation, MChannel.WRotation)
+
+class CompiledSkeleton():
+    """A compiled skeleton, memory-mapped."""
+
+    def __init__(self, path: Union[str, Path], buffer: Optional[bytes] = None):
+        """
+        parameters:
+            - path: of the compiled skeleton
+            - buffer: content of the file, if it is already read
+        """
+        self.path = Path(path)
+        if buffer is not None:
+            self._map = buffer
+        else:
+            with self.path.open("rb") as file:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read()
+        except ValueError:
+            self.close()
+            raise
+
+    def _read(self):
+        if len(self._map) < _HEADER.size:
+            raise ValueError("%s is not a compiled skeleton" % self.path)
+        magic, version, self.sourceHash, count, idBytes, nameBytes = _HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError("%s is not a compiled skeleton" % self.path)
+        if version != VERSION:
+            raise ValueError("%s has version %i instead of %i" % (self.path, version, VERSION))
+        self.count = count
+
+        offset = _align(_HEADER.size)
+        self.parents, offset = self._array(offset, np.int32, (count,))
+        self.types, offset = self._array(offset, np.int32, (count,))
+        self.positions, offset = self._array(offset, np.float64, (count, 3))
+        self.rotations, offset = self._array(offset, np.float64, (count, 4))
+        self.channels, offset = self._array(offset, np.int8, (count, _MAX_CHANNELS))
+        if offset + idBytes + nameBytes > len(self._map):
+            raise ValueError("%s is truncated" % self.path)
+        self._idRange = (offset, offset + idBytes)
+        self._nameRange = (offset + idBytes, offset + idBytes + nameBytes)
+        self._names: Optional[List[str]] = None
+
+    def _array(self, offset: int, dtype, shape):
+        array = np.frombuffer(self._map, dtype=np.dtype(dtype).newbyteorder("<"),
+            count=int(np.prod(shape)), offset=offset).reshape(shape)
+        return array, _align(offset + array.nbytes)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def avatarID(self) -> str:
+        return self._map[self._idRange[0]:self._idRange[1]].decode("utf-8")
+
+    @property
+    def names(self) -> List[str]:
+        """Joint names, decoded on the first use."""
+        if self._names is None:
+            names = self._map[self._nameRange[0]:self._nameRange[1]].decode("utf-8")
+            self._names = names.split("\0") if self.count else []
+        return self._names
+
+    def posture(self) -> MAvatarPosture:
+        """
+        The MAvatarPosture of the .mos-file. Every call builds a new one, so
+        callers may change it.
+        """
+        names = self.names
+        parents = self.parents.tolist()
+        types = self.types.tolist()
+        positions = self.positions.tolist()
+        rotations = self.rotations.tolist()
+        joints = []
+        for idx, name in enumerate(names):
+            channels = [_CHANNELS[c] for c in self.channels[idx].tolist() if c >= 0]
+            parent = names[parents[idx]] if parents[idx] >= 0 else None
+            joints.append(MJoint(name, types[idx], MVector3(*positions[idx]),
+                MQuaternion(*rotations[idx]), channels, parent))
+        return MAvatarPosture(self.avatarID, joints)
+
+    def close(self):
+        """
+        Drops the references of the skeleton to the file. Arrays taken from
+        it stay valid, the file is unmapped once the last of them is gone.
+        """
+        self.parents = self.types = self.positions = self.rotations = self.channels = None
+        self._map = None
+        return
+
+def compiledPath(source: Union[str, Path]) -> Path:
+    """Path of the compiled skeleton of the .mos-file <source>."""
+    return Path(source).with_suffix(SUFFIX)
+
+def compileSkeleton(source: Union[str, Path], target: Optional[Union[str, Path]] = None) -> Path:
+    """
+    Compiles the .mos-file <source> to <target>, by default next to it.
+
+    returns:
+        - the path of the compiled skeleton
+    """
+    source = Path(source)
+    target = Path(target) if target is not None else compiledPath(source)
+    content = source.read_bytes()
+    data = json.loads(content.decode("utf-8"))
+    joints = data["Joints"]
+    names = [j["ID"] for j in joints]
+    index = {name: idx for idx, name in enumerate(names)}
+
+    parents, types, positions, rotations = [], [], [], []
+    channels = np.full((len(joints), _MAX_CHANNELS), -1, dtype=np.int8)
+    for idx, j in enumerate(joints):
+        parent = j.get("Parent")
+        if parent is not None and parent not in index:
+            raise ValueError("Parent %s of joint %s is not a joint of %s" % (parent, j["ID"], source))
+        parents.append(index[parent] if parent is not None else -1)
+        types.append(j["Type"])
+        positions.append((j["Position"]["X"], j["Position"]["Y"], j["Position"]["Z"]))
+        rotations.append((j["Rotation"]["X"], j["Rotation"]["Y"], j["Rotation"]["Z"], j["Rotation"]["W"]))
+        ids = j.get("Channels") or []
+        if len(ids) > _MAX_CHANNELS or any(not 0 <= c < len(_CHANNELS) for c in ids):
+            raise ValueError("Invalid channels %s of joint %s in %s" % (ids, j["ID"], source))
+        channels[idx, :len(ids)] = ids
+
+    if any("\0" in name for name in names):
+        raise ValueError("Joint names of %s cannot contain \\0" % source)
+    avatarID = data["AvatarID"].encode("utf-8")
+    nameBytes = "\0".join(names).encode("utf-8")
+    arrays = [np.array(parents, dtype="<i4"), np.array(types, dtype="<i4"),
+        np.array(positions, dtype="<f8").reshape(-1, 3),
+        np.array(rotations, dtype="<f8").reshape(-1, 4), channels]
+
+    # written to a file of its own first, a concurrent start never reads half 
+    # a file and concurrent compilations do not write into each other's
+    handle, partial = tempfile.mkstemp(prefix=target.name + ".", suffix=".partial", dir=str(target.parent))
+    partial = Path(partial)
+    try:
+        with os.fdopen(handle, "wb") as file:
+            file.write(_HEADER.pack(MAGIC, VERSION, hashlib.sha1(content).digest(),
+                len(joints), len(avatarID), len(nameBytes)))
+            for array in arrays:
+                _pad(file)
+                file.write(array.tobytes())
+            _pad(file)
+            file.write(avatarID)
+            file.write(nameBytes)
+        partial.replace(target)
+    except BaseException:
+        if partial.exists():
+            partial.unlink()
+        raise
+    logger.debug("Compiled %s to %s", source, target)
+    return target
+
+def load(path: Union[str, Path]) -> CompiledSkeleton:
+    """
+    CompiledSkeleton of <path>, a compiled skeleton or a .mos-file. The
+    compiled skeleton of a .mos-file is (re)compiled next to it if it is
+    missing, of another version or of another content of the .mos-file.
+    """
+    path = Path(path)
+    if path.suffix == SUFFIX:
+        return CompiledSkeleton(path)
+    compiled = compiledPath(path)
+    if compiled.exists():
+        try:
+            skeleton = CompiledSkeleton(compiled)
+            if skeleton.sourceHash == hashlib.sha1(path.read_bytes()).digest():
+                return skeleton
+            skeleton.close()
+            logger.info("%s is outdated, it is compiled again", compiled)
+        except ValueError:
+            logger.info("%s is unreadable, it is compiled again", compiled, exc_info=True)
+    try:
+        return CompiledSkeleton(compileSkeleton(path, compiled))
+    except OSError:
+        # a read-only installation, compile into a temporary file and keep it in memory
+        logger.warning("Cannot write %s, the skeleton is compiled in memory", compiled, exc_info=True)
+        with tempfile.TemporaryDirectory() as directory:
+            target = compileSkeleton(path, Path(directory)/compiled.name)
+            return CompiledSkeleton(compiled, target.read_bytes())
+
+def loadPosture(path: Union[str, Path]) -> MAvatarPosture:
+    """MAvatarPosture of the compiled skeleton of <path>, see load."""
+    skeleton = load(path)
+    try:
+        return skeleton.posture()
+    finally:
+        skeleton.close()
+
+def _align(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+def _pad(file):
+    file.write(b"\0" * (_align(file.tell()) - file.tell()))
+    return
@@ -0,0 +1,246 @@
+# std-Library
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+import logging
+import math
+logger = logging.getLogger(__name__)
+
+import numpy as np
+
+from BlenderMMI.ChannelCodec import ChannelCodec
+from BlenderMMI.PoseMath import matrices_to_quaternions, quaternions_to_matrices
+
+# end joint -> (upper bone, lower bone). The bones are named after the joint
+# at their head, so the chain shoulder-elbow-wrist is moved by the bones
+# RightShoulder and RightElbow.
+CHAINS = {
+    'RightWrist': ('RightShoulder', 'RightElbow'),
+    'LeftWrist':  ('LeftShoulder', 'LeftElbow'),
+    'RightAnkle': ('RightHip', 'RightKnee'),
+    'LeftAnkle':  ('LeftHip', 'LeftKnee'),
+}
+
+# Mosim-Name -> end joint
+EFFECTORS = {
+    'RightHand':  'RightWrist',
+    'LeftHand':   'LeftWrist',
+    'RightWrist': 'RightWrist',
+    'LeftWrist':  'LeftWrist',
+    'RightFoot':  'RightAnkle',
+    'LeftFoot':   'LeftAnkle',
+    'RightAnkle': 'RightAnkle',
+    'LeftAnkle':  'LeftAnkle',
+}
+
+_EPS = 1e-9
+
+class _Chain(NamedTuple):
+    path: List[int]     # joint indices from the root to the end joint
+    upper: int
+    lower: int
+    end: int
+
+class TwoBoneIK():
+    """
+    Analytic IK for the arms and legs of the intermediate skeleton.
+
+    Works on the posture values only and does not touch blender. The rest
+    transforms of the bones are taken once from the scaled armature (see
+    fromApplication), afterwards a solve is a forward kinematic along the
+    chain, the law of cosines and two frame alignments.
+
+    The swivel of the chain is taken from the input pose: the elbow (knee)
+    stays on the side it pointed to, only the distance to the target changes.
+    """
+
+    tolerance = 1e-4    # distance at which a target counts as reached
+
+    def __init__(self, codec: ChannelCodec, parents: Sequence[int], rest: np.ndarray):
+        """
+        parameters:
+            - codec: ChannelCodec of the posture
+            - parents: index of the parent joint for each joint of the codec, -1 for roots
+            - rest: (joints, 4, 4) rest transform of each bone relative to its parent
+        """
+        self.codec   = codec
+        self.parents = np.asarray(parents, dtype=np.intp)
+        self.rest    = np.asarray(rest, dtype=float)
+
+        self.chains: Dict[str, _Chain] = {}
+        for end_id, (upper_id, lower_id) in CHAINS.items():
+            if not all(j in codec.jointIndex for j in (end_id, upper_id, lower_id)):
+                continue
+            end = codec.jointIndex[end_id]
+            path = [end]
+            while self.parents[path[-1]] >= 0:
+                path.append(int(self.parents[path[-1]]))
+            self.chains[end_id] = _Chain(path[::-1], codec.jointIndex[upper_id],
+                codec.jointIndex[lower_id], end)
+
+        logger.debug("Two-bone IK for %s", list(self.chains))
+
+    @classmethod
+    def fromApplication(cls, app) -> "TwoBoneIK":
+        """Takes the rest transforms from a scaled IntermediateSkeletonApplication."""
+        parents = [app.codec.jointIndex.get(joint.Parent, -1) for joint in app.posture.Joints]
+        rest = np.linalg.inv(app._baseStack[app._poseIndex])
+        return cls(app.codec, parents, rest)
+
+    def supports(self, targets) -> bool:
+        """True if every target is a position or rotation of a hand or foot."""
+        return len(targets) > 0 and all(
+            EFFECTORS.get(target.joint_id) in self.chains for target in targets)
+
+    def solve(self, values, targets) -> Tuple[np.ndarray, bool]:
+        """
+        parameters:
+            - values: posture values
+            - targets: JointTargets (joint_id, position, rotation) in blender
+                       armature coordinates, position or rotation may be None
+
+        returns:
+            - posture values with the chains moved to their targets
+            - True if all positions could be reached
+        """
+        locations, rotations = self.codec.decode(values)
+
+        # positions and rotations of the same effector come in separate targets
+        goals = {}
+        for target in targets:
+            end_id = EFFECTORS[target.joint_id]
+            position, rotation = goals.get(end_id, (None, None))
+            if target.position is not None:
+                position = np.asarray(target.position, dtype=float)
+            if target.rotation is not None:
+                rotation = np.asarray(target.rotation, dtype=float)
+            goals[end_id] = (position, rotation)
+
+        reached = True
+        for end_id, (position, rotation) in goals.items():
+            reached &= self._solveChain(self.chains[end_id], locations, rotations,
+                position, rotation)
+
+        return self.codec.encode(locations, rotations), reached
+
+    def _solveChain(self, chain: _Chain, locations: np.ndarray, rotations: np.ndarray,
+            position: Optional[np.ndarray], rotation: Optional[np.ndarray]) -> bool:
+        """Solves one chain in place of locations and rotations."""
+        pose = self._forward(chain.path, locations, rotations)
+        upper, lower, end = chain.upper, chain.lower, chain.end
+        parent = self.parents[upper]
+        parent_pose = pose[parent] if parent >= 0 else np.eye(4)
+
+        W_upper = pose[upper][:3, :3]
+        W_lower = pose[lower][:3, :3]
+        reached = True
+
+        if position is not None:
+            A = pose[upper][:3, 3]
+            B = pose[lower][:3, 3]
+            C = pose[end][:3, 3]
+            l1 = _norm(B - A)
+            l2 = _norm(C - B)
+
+            # direction and clamped distance to the target
+            AT = position - A
+            dist = _norm(AT)
+            c = _normalize(C - A)
+            u = AT / dist if dist > _EPS else c
+            d = min(max(dist, abs(l1 - l2) + 1e-6), l1 + l2 - 1e-6)
+            reached = abs(dist - d) <= self.tolerance
+
+            # swivel: side of the old chain the middle joint points to
+            pole = (B - A) - np.dot(B - A, c) * c
+            if _norm(pole) < 1e-6 * l1:
+                # stretched chain, bend around the hinge axis of the lower bone
+                pole = _cross(W_lower[:, 0], c)
+            n_old = _normalize(_cross(c, pole))
+            pole = pole - np.dot(pole, u) * u
+            if _norm(pole) < _EPS:
+                pole = _cross(n_old, u)
+            pole = _normalize(pole)
+            n_new = _normalize(_cross(u, pole))
+
+            # law of cosines
+            a = (l1*l1 - l2*l2 + d*d) / (2. * d)
+            h = math.sqrt(max(l1*l1 - a*a, 0.))
+            B_new = A + a * u + h * pole
+            T = A + d * u
+
+            R1 = _frame(B_new - A, n_new) @ _frame(B - A, n_old).T
+            C_rot = B_new + R1 @ (C - B)
+            R2 = _frame(T - B_new, n_new) @ _frame(C_rot - B_new, n_new).T
+
+            W_upper = R1 @ W_upper
+            W_lower = R2 @ R1 @ W_lower
+
+            # back to the local rotations, both in one conversion
+            rest = self.rest
+            local = np.stack((
+                (parent_pose[:3, :3] @ rest[upper][:3, :3]).T @ W_upper,
+                (W_upper @ rest[lower][:3, :3]).T @ W_lower
+            ))
+            rotations[[upper, lower]] = _toQuaternion(local, rotations[[upper, lower]])
+
+        if rotation is not None and self.codec.hasRotation(self.codec.joints[end]):
+            # like the Copy-Rotation-Constraint: the end bone gets the rotation in armature space
+            W_end = quaternions_to_matrices(rotation)
+            rotations[end] = _toQuaternion(
+                (W_lower @ self.rest[end][:3, :3]).T @ W_end, rotations[end])
+
+        return reached
+
+    def jointStates(self, values, joints: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        State of <joints> in the posture <values>, like the pose bones of the 
+        armature give it: the heads (joints, 3) in armature coordinates and 
+        the local rotations (joints, 4) as quaternions (w, x, y, z).
+        """
+        locations, rotations = self.codec.decode(values)
+        indices = [self.codec.jointIndex[joint_id] for joint_id in joints]
+        # the ancestors of each joint, parents before their children
+        path = []
+        for idx in indices:
+            chain = [idx]
+            while self.parents[chain[-1]] >= 0:
+                chain.append(int(self.parents[chain[-1]]))
+            path.extend(joint for joint in reversed(chain) if joint not in path)
+        pose = self._forward(path, locations, rotations)
+        heads = np.array([pose[idx][:3, 3] for idx in indices]).reshape(-1, 3)
+        return heads, rotations[indices].reshape(-1, 4)
+
+    def _forward(self, path: List[int], locations: np.ndarray, rotations: np.ndarray) -> Dict[int, np.ndarray]:
+        """Pose matrices (armature space) of the joints along path."""
+        basis = np.zeros((len(path), 4, 4))
+        basis[:, :3, :3] = quaternions_to_matrices(rotations[path])
+        basis[:, :3, 3] = locations[path]
+        basis[:, 3, 3] = 1.
+
+        pose = {}
+        for idx, joint in enumerate(path):
+            parent = self.parents[joint]
+            local = self.rest[joint] @ basis[idx]
+            pose[joint] = pose[parent] @ local if parent >= 0 else local
+        return pose
+
+# np.cross and np.linalg.norm have a large overhead for single 3-vectors
+def _norm(v: np.ndarray) -> float:
+    return math.sqrt(np.dot(v, v))
+
+def _cross(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.array((a[1]*b[2] - a[2]*b[1], a[2]*b[0] - a[0]*b[2], a[0]*b[1] - a[1]*b[0]))
+
+def _normalize(v: np.ndarray) -> np.ndarray:
+    return v / max(_norm(v), _EPS)
+
+def _frame(direction: np.ndarray, normal: np.ndarray) -> np.ndarray:
+    """Orthonormal frame with the columns direction, normal and their cross product."""
+    x = _normalize(direction)
+    y = _normalize(normal - np.dot(normal, x) * x)
+    m = np.empty((3, 3))
+    m[:, 0], m[:, 1], m[:, 2] = x, y, _cross(x, y)
+    return m
+
+def _toQuaternion(m: np.ndarray, previous: np.ndarray) -> np.ndarray:
+    """Quaternions of m on the same hemisphere as the previous rotations."""
+    q = matrices_to_quaternions(m)
+    return np.where(np.sum(q * previous, axis=-1, keepdims=True) < 0., -q, q)
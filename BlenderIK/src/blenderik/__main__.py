@@ -5,6 +5,8 @@ from argparse import ArgumentParser
 import json
 import logging
 import unittest
+import time
+STARTED = time.perf_counter()
 sys.path.append(Path(__file__).parent.as_posix())
 logger = logging.getLogger(__name__)
 
@@ -21,12 +23,13 @@ except ModuleNotFoundError:
     sys.exit(1)
 
 from server import EIKServer
+from server.eikserver import serverOptionsFromConfig
 
 
 
 DEFAULT_CONFIG = {
     "LOGGING": {
-        "loggingLevel": "DEBUG"
+        "loggingLevel": "INFO"
     },
     "SERVICEDESCRIPTION": {
         "Name": "ikService",
@@ -39,11 +42,62 @@ DEFAULT_CONFIG = {
     },
     "IKSERVER": {
         "address": "127.0.0.1",
-        "port": "8904"
+        "port": "8904",
+        "solver": "blender",
+        "warmStart": "no",
+        "warmStartTolerance": "1e-4",
+        "maxIterations": "1",
+        "tolerance": "1e-3",
+        "serverMode": "threadpool",
+        "serverThreads": "4",
+        "framed": "no",
+        "acceleratedProtocol": "no"
     },
     "REGISTERSERVICE": {
         "address": "127.0.0.1",
-        "port": "9009"
+        "port": "9009",
+        "heartbeat": "30",
+        "maxBackoff": "30"
+    },
+    "AVATARS": {
+        "capacity": "8"
+    },
+    "CACHE": {
+        "enabled": "yes",
+        "size": "1024",
+        "ttl": "60",
+        "postureQuantum": "1e-4",
+        "targetQuantum": "1e-3"
+    },
+    "STARTUP": {
+        "snapshots": "snapshots",
+        "warmUp": "8"
+    },
+    "SESSIONS": {
+        "capacity": "256",
+        "ttl": "600",
+        "tolerance": "0"
+    },
+    "TRACING": {
+        "sampleEvery": "0",
+        "ringSize": "32"
+    },
+    "METRICS": {
+        "port": "0"
+    },
+    "RECORDER": {
+        "enabled": "no",
+        "directory": "recording",
+        "sampleEvery": "1",
+        "buffer": "1024",
+        "segmentRecords": "16384"
+    },
+    "SUPERVISOR": {
+        "workers": "0",
+        "threads": "1",
+        "pinning": "no",
+        "maxMemory": "0",
+        "directory": "workers"
     }
 }
 def run(config, cli_args):
@@ -59,25 +113,132 @@ def run(config, cli_args):
         config['IKSERVER']['address'] = ip
         config['IKSERVER']['port'] = port
     
+    if cli_args.workers is not None:
+        config['SUPERVISOR']['workers'] = str(cli_args.workers)
+    if cli_args.threads is not None:
+        config['SUPERVISOR']['threads'] = str(cli_args.threads)
+    if cli_args.pin:
+        config['SUPERVISOR']['pinning'] = 'yes'
+    
     # read description.json    
     with Path("description.json").open() as file:
         description = json.load(file)
     
     logger.info("%s", description)
-    IKServer = EIKServer(description['Name'], description['ID'], description['Language'])
+    if config.getint('SUPERVISOR', 'workers') > 0:
+        IKServer = _supervisor(description, config)
+    else:
+        IKServer = _ikserver(description, config)
+        IKServer.warmUp(config.getint('STARTUP', 'warmUp'))
         
     IKServer.init_thrift(
         config.get('IKSERVER', 'address'), 
         config.getint('IKSERVER', 'port')
     )
+    logger.info("Ready after %.2fs", time.perf_counter() - STARTED)
         
     IKServer.register(
         config.get('REGISTERSERVICE', 'address'), 
-        config.getint('REGISTERSERVICE', 'port')
+        config.getint('REGISTERSERVICE', 'port'),
+        heartbeat=config.getfloat('REGISTERSERVICE', 'heartbeat'),
+        max_backoff=config.getfloat('REGISTERSERVICE', 'maxBackoff')
     )
     
     IKServer.start()
     
+def worker(config, cli_args):
+    """Serves for a supervisor without registration."""
+    ip, port = cli_args.address.split(':')
+    with Path("description.json").open() as file:
+        description = json.load(file)
+    # the workers share the configuration, only the supervisor could own the port
+    config['METRICS']['port'] = '0'
+        
+    IKServer = _ikserver(description, config)
+    # the supervisor waits for the port, so the worker is warm when it opens
+    IKServer.warmUp(config.getint('STARTUP', 'warmUp'))
+    IKServer.init_thrift(ip, int(port))
+    logger.info("Worker ready after %.2fs", time.perf_counter() - STARTED)
+    IKServer.start()
+    
+def _ikserver(description, config):
+    return EIKServer.fromConfig(config, name=description['Name'], id=description['ID'], 
+        language=description['Language'])
+    
+def _supervisor(description, config):
+    from server.supervisor import Supervisor
+    from MMIStandard.core.ttypes import MServiceDescription
+    from BlenderMMI import SkeletonFormat
+    
+    resources = Path(bpy.data.filepath).parent
+    posture = resources/config.get('RESOURCES', 'initialPosture')
+    # compiled once here, the workers get it with the .mos-file
+    SkeletonFormat.load(posture).close()
+    return Supervisor(
+        MServiceDescription(Name=description['Name'], ID=description['ID'], 
+            Language=description['Language']),
+        Path(__file__),
+        workers=config.getint('SUPERVISOR', 'workers'),
+        threads=config.getint('SUPERVISOR', 'threads'),
+        pinning=config.getboolean('SUPERVISOR', 'pinning'),
+        max_memory=config.getint('SUPERVISOR', 'maxMemory'),
+        directory=Path(config.get('SUPERVISOR', 'directory')),
+        resources=[posture, SkeletonFormat.compiledPath(posture)],
+        server_options=serverOptionsFromConfig(config)
+    )
+    
+def bench(config, cli_args):
+    """Replays a workload in this process and reports latency and accuracy."""
+    from server.bench import Benchmark, compare
+    from BlenderMMI import SkeletonFormat
+    
+    resources = Path(bpy.data.filepath).parent
+    benchmark = Benchmark(SkeletonFormat.loadPosture(resources/config.get('RESOURCES', 'initialPosture')), 
+        avatars=cli_args.avatars, seed=cli_args.seed,
+        solver=cli_args.solver or config.get('IKSERVER', 'solver'),
+        warm_start=config.getboolean('IKSERVER', 'warmStart'),
+        warm_start_tolerance=config.getfloat('IKSERVER', 'warmStartTolerance'))
+        
+    cases_path = Path(cli_args.cases) if cli_args.cases else resources/'PostureValueCases.json'
+    if cases_path.exists():
+        with cases_path.open() as file:
+            cases = json.load(file)
+    else:
+        logger.warning("%s not found: benchmark with the T-pose only", cases_path)
+        app = benchmark.service.app
+        app.resetPose()
+        cases = {"tpose": app.ReadMAvatarPostureValues()}
+    benchmark.addCases(cases, targets=cli_args.targets)
+    if cli_args.records:
+        benchmark.addRecords(Path(cli_args.records))
+        
+    report = benchmark.run(iterations=cli_args.iterations, warmup=cli_args.warmup)
+    with Path(cli_args.output).open('w') as file:
+        json.dump(report, file, indent=2)
+    for name, summary in report["entrypoints"].items():
+        logger.info("%s: %.1f/s, p50 %.3f ms, p99 %.3f ms", name, summary["throughput"], 
+            summary["p50"], summary["p99"])
+    logger.info("Report written to %s", cli_args.output)
+    
+    if cli_args.baseline:
+        with Path(cli_args.baseline).open() as file:
+            regressions = compare(report, json.load(file), cli_args.tolerance)
+        for regression in regressions:
+            logger.error("Regression: %s", regression)
+        if regressions:
+            sys.exit(2)
+        logger.info("No regressions against %s", cli_args.baseline)
+    
+def compileSkeletons(config, cli_args):
+    """Compiles the .mos-files to the binary skeleton format, by default the initial posture."""
+    from BlenderMMI import SkeletonFormat
+    
+    sources = [Path(path) for path in cli_args.sources] or \
+        [Path(bpy.data.filepath).parent/config.get('RESOURCES', 'initialPosture')]
+    for source in sources:
+        target = SkeletonFormat.compileSkeleton(source)
+        logger.info("Compiled %s to %s", source, target)
+    
 def test(config, cli_args):
     logger.info("running tests")
     unittest.main(module="tests" , argv=['BlenderIkService'], verbosity=3)
@@ -137,7 +298,53 @@ if __name__ == '__main__':
     run_parser.add_argument('-d', '--description',
         help="Path to the service description",
         default='')
+    run_parser.add_argument('-w', '--workers', type=int,
+        help="Number of Blender worker processes behind the endpoint (0: serve in this process)",
+        default=None)
+    run_parser.add_argument('-t', '--threads', type=int,
+        help="Number of threads Blender may use in each worker",
+        default=None)
+    run_parser.add_argument('--pin', action='store_true',
+        help="Pin each worker to cpus of its own")
     run_parser.set_defaults(func=run)
+    
+    worker_parser = subparsers.add_parser('worker', help="Start Service as worker of a supervisor")
+    worker_parser.add_argument('-a', '--address', 
+        help="Address and Port under which the Server will operate",
+        required=True)
+    worker_parser.set_defaults(func=worker)
+    
+    bench_parser = subparsers.add_parser('bench', help="Benchmark the service in this process")
+    bench_parser.add_argument('--cases', 
+        help="JSON with posture values by name (default: resources/PostureValueCases.json)",
+        default='')
+    bench_parser.add_argument('--records', 
+        help="Directory of an IKRecorder-recording to replay",
+        default='')
+    bench_parser.add_argument('--targets', type=int, default=4,
+        help="Random reachable targets per posture case")
+    bench_parser.add_argument('--avatars', type=int, default=1,
+        help="Number of avatars the requests are spread over")
+    bench_parser.add_argument('--iterations', type=int, default=10,
+        help="Repetitions of the workload")
+    bench_parser.add_argument('--warmup', type=int, default=1,
+        help="Repetitions before the measurement")
+    bench_parser.add_argument('--solver', default='',
+        help="Solver instead of the one of the configuration")
+    bench_parser.add_argument('--seed', type=int, default=0,
+        help="Seed of the random targets")
+    bench_parser.add_argument('-o', '--output', default='bench.json',
+        help="Path of the JSON-report")
+    bench_parser.add_argument('--baseline', default='',
+        help="JSON-report to compare with, exits with 2 on regressions")
+    bench_parser.add_argument('--tolerance', type=float, default=0.1,
+        help="Relative deterioration counted as regression")
+    bench_parser.set_defaults(func=bench)
+    
+    compile_parser = subparsers.add_parser('compile', help="Compile .mos-files to the binary skeleton format")
+    compile_parser.add_argument('sources', nargs='*',
+        help=".mos-files to compile (default: the initial posture of the configuration)")
+    compile_parser.set_defaults(func=compileSkeletons)
         
     cmd_args = argparser.parse_args(raw_args)
     print(Path.cwd())
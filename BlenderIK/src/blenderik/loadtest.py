@@ -0,0 +1,371 @@
+"""
+Load test of the IK service over Thrift. Runs outside of blender, with the
+clients of server.thriftserver (TCompactProtocol, TBufferedTransport or with
+--framed TFramedTransport for the server modes nonblocking and asyncio).
+
+    python loadtest.py load --address 127.0.0.1:8904 --connections 8 --duration 30
+    python loadtest.py load --address 127.0.0.1:8904 --rate 100 --rate 200 --rate 400
+    python loadtest.py load --registry 127.0.0.1:9009 --records recording
+    python loadtest.py registry --address 127.0.0.1:9009
+
+Without --rate, every connection sends its next request as soon as the last
+one returned (closed loop), which measures the saturation throughput. With
+--rate, requests arrive at exponentially distributed intervals (open loop)
+and the latency is measured from the arrival, so queueing in front of a
+saturated service shows up. Several rates give the throughput curve.
+Failed requests count as errors, a connection that loses the service
+reconnects and stops only if the service cannot be reached again.
+
+With --registry, a stand-in for the MMIRegisterService is started at that
+address and the load is sent to the first service registering there, so
+"run" of the service can be exercised offline, registration included.
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import threading
+import logging
+import random
+import queue
+import json
+import time
+import uuid
+import sys
+
+sys.path.append(Path(__file__).parent.as_posix())
+logger = logging.getLogger("loadtest")
+
+import numpy as np
+
+from server.metrics import Histogram, PERCENTILES
+from server.thriftserver import ServerOptions, openClient
+from server import workload
+
+# MOSIM-declarations
+from MMIStandard.services import MInverseKinematicsService
+from MMIStandard.register import MMIRegisterService
+from MMIStandard.avatar.ttypes import MAvatarPostureValues
+from MMIStandard.core.ttypes import MBoolResponse
+
+from thrift.transport import TSocket
+from thrift.transport import TTransport
+from thrift.protocol import TCompactProtocol
+from thrift.server import TServer
+
+# blender coordinates of the boxes of the synthetic hand targets
+SYNTHETIC_TARGETS = {
+    'RightHand': ((-0.6, 0.9, 0.1), (-0.1, 1.5, 0.6)),
+    'LeftHand':  ((0.1, 0.9, 0.1), (0.6, 1.5, 0.6)),
+}
+
+class RegistryStandIn(MMIRegisterService.Iface):
+    """Accepts every registration, for tests without the MOSIM-launcher."""
+
+    def __init__(self):
+        self.services = []
+        self.registered = threading.Event()
+
+    def RegisterService(self, description):
+        if not any(service.ID == description.ID for service in self.services):
+            logger.info("Registered %s at %s", description.Name, description.Addresses)
+        # a renewal replaces the registration
+        self.services = [service for service in self.services if service.ID != description.ID]
+        self.services.append(description)
+        self.registered.set()
+        return MBoolResponse(Successful=True)
+
+    def UnregisterService(self, description):
+        self.services = [service for service in self.services if service.ID != description.ID]
+        return MBoolResponse(Successful=True)
+
+    def GetRegisteredServices(self, sessionID):
+        return list(self.services)
+
+    def CreateSessionID(self, properties):
+        return str(uuid.uuid4())
+
+    def serve(self, address: str, port: int) -> TServer.TServer:
+        """Serves in a background thread."""
+        processor = MMIRegisterService.Processor(self)
+        server = TServer.TThreadedServer(processor, TSocket.TServerSocket(host=address, port=port),
+            TTransport.TBufferedTransportFactory(), TCompactProtocol.TCompactProtocolFactory(),
+            daemon=True)
+        threading.Thread(target=server.serve, name="RegistryStandIn", daemon=True).start()
+        logger.info("Registry stand-in at %s:%i", address, port)
+        return server
+
+class Result():
+    """Latency and errors per method."""
+
+    def __init__(self):
+        self.latency: Dict[str, Histogram] = {}
+        self.errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, method: str, seconds: float, failed: bool):
+        with self._lock:
+            histogram = self.latency.get(method)
+            if histogram is None:
+                histogram = self.latency[method] = Histogram()
+            if failed:
+                self.errors[method] = self.errors.get(method, 0) + 1
+        histogram.record(seconds)
+        return
+
+    def summary(self, elapsed: float) -> dict:
+        summary = {}
+        for method, histogram in self.latency.items():
+            entry = {"count": histogram.count, "errors": self.errors.get(method, 0),
+                "throughput": histogram.count / elapsed}
+            for percentile, value in zip(PERCENTILES, histogram.percentiles()):
+                entry["p%i" % percentile] = value * 1000.
+            entry["max"] = histogram.max * 1000.
+            summary[method] = entry
+        count = sum(histogram.count for histogram in self.latency.values())
+        summary["total"] = {"count": count, "errors": sum(self.errors.values()),
+            "throughput": count / elapsed}
+        return summary
+
+class Connection():
+    """Client of one connection, opened again after a transport error."""
+
+    def __init__(self, address: str, port: int, options: ServerOptions):
+        self.address = address
+        self.port    = port
+        self.options = options
+        self.transport, self.client = openClient(MInverseKinematicsService.Client, address, port, options)
+
+    def call(self, request: workload.Request, arrival: float, result: Result) -> bool:
+        """
+        Sends the request and adds it to the result, a failure as an error.
+
+        returns:
+            - False if the connection was lost and cannot be opened again
+        """
+        try:
+            getattr(self.client, request.method)(*request.args)
+        except (TTransport.TTransportException, OSError) as x:
+            result.add(request.method, time.perf_counter() - arrival, True)
+            logger.warning("%s failed, reconnecting: %s", request.method, x)
+            return self._reconnect()
+        except Exception:
+            logger.debug("%s failed", request.method, exc_info=True)
+            result.add(request.method, time.perf_counter() - arrival, True)
+            return True
+        result.add(request.method, time.perf_counter() - arrival, False)
+        return True
+
+    def close(self):
+        self.transport.close()
+        return
+
+    def _reconnect(self) -> bool:
+        self.close()
+        try:
+            self.transport, self.client = openClient(MInverseKinematicsService.Client, 
+                self.address, self.port, self.options)
+        except (TTransport.TTransportException, OSError):
+            logger.error("Cannot reconnect to %s:%i, the connection stops", self.address, self.port, 
+                exc_info=True)
+            return False
+        return True
+
+def synthetic(cases: Dict[str, List[float]], count: int, mix: Dict[str, float], avatar_id: str,
+        rng: random.Random) -> List[workload.Request]:
+    """Random requests with targets for one or both hands."""
+    methods, weights = zip(*mix.items())
+    requests = []
+    for idx in range(count):
+        name, values = rng.choice(list(cases.items()))
+        effectors = rng.sample(list(SYNTHETIC_TARGETS), rng.randint(1, len(SYNTHETIC_TARGETS)))
+        targets = [(effector, np.array([rng.uniform(low, high) for low, high in zip(*SYNTHETIC_TARGETS[effector])]))
+            for effector in effectors]
+        posture = MAvatarPostureValues(AvatarID=avatar_id, PostureData=list(values))
+        method = rng.choices(methods, weights)[0]
+        if method == "ComputeIK":
+            args = (posture, [prop for effector, position in targets
+                for prop in workload.ikProperties(effector, position, None)])
+        else:
+            # the constraints of CalculateIKPosture are given for the wrists
+            args = (posture, [workload.jointConstraint(effector.replace("Hand", "Wrist"), position, None)
+                for effector, position in targets], {})
+        requests.append(workload.Request(method, name, args, targets))
+    return requests
+
+def closedLoop(address: str, port: int, options: ServerOptions, requests: List[workload.Request],
+        connections: int, duration: float) -> dict:
+    """Each connection sends back to back for <duration> seconds."""
+    result = Result()
+    deadline = time.perf_counter() + duration
+
+    def client(offset: int):
+        connection = Connection(address, port, options)
+        idx = offset
+        try:
+            while time.perf_counter() < deadline:
+                if not connection.call(requests[idx % len(requests)], time.perf_counter(), result):
+                    break
+                idx += connections
+        finally:
+            connection.close()
+
+    start = time.perf_counter()
+    _runThreads(client, connections)
+    return result.summary(time.perf_counter() - start)
+
+def openLoop(address: str, port: int, options: ServerOptions, requests: List[workload.Request],
+        connections: int, duration: float, rate: float, rng: random.Random) -> dict:
+    """Requests arrive at <rate> per second (Poisson) and are sent by the next free connection."""
+    result = Result()
+    arrivals = queue.Queue()
+
+    def client(offset: int):
+        connection = Connection(address, port, options)
+        try:
+            while True:
+                arrival = arrivals.get()
+                # the other connections serve the remaining arrivals
+                if arrival is None or not connection.call(*arrival, result):
+                    break
+        finally:
+            connection.close()
+
+    def generator():
+        start = time.perf_counter()
+        scheduled = start
+        idx = 0
+        while scheduled < start + duration:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            arrivals.put((requests[idx % len(requests)], scheduled))
+            idx += 1
+            scheduled += rng.expovariate(rate)
+        for _ in range(connections):
+            arrivals.put(None)
+
+    threading.Thread(target=generator, name="Arrivals", daemon=True).start()
+    start = time.perf_counter()
+    _runThreads(client, connections)
+    summary = result.summary(time.perf_counter() - start)
+    summary["total"]["offered"] = rate
+    return summary
+
+def _runThreads(target, count: int):
+    threads = [threading.Thread(target=target, args=(idx,), name="Connection%i" % idx)
+        for idx in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return
+
+def _address(value: str) -> Tuple[str, int]:
+    host, port = value.split(":")
+    return host, int(port)
+
+def load(cli_args):
+    rng = random.Random(cli_args.seed)
+    if cli_args.records:
+        requests = list(workload.fromRecording(cli_args.records, cli_args.requests))
+    else:
+        with Path(cli_args.cases).open() as file:
+            cases = json.load(file)
+        mix = {name: float(weight) for name, weight in
+            (entry.split("=") for entry in cli_args.mix.split(","))}
+        requests = synthetic(cases, cli_args.requests, mix, cli_args.avatar, rng)
+    if not requests:
+        raise ValueError("No requests in the workload")
+
+    if cli_args.registry:
+        registry = RegistryStandIn()
+        registry.serve(*_address(cli_args.registry))
+        logger.info("Waiting for a service to register")
+        registry.registered.wait()
+        service = registry.services[0].Addresses[0]
+        address, port = service.Address, service.Port
+    else:
+        address, port = _address(cli_args.address)
+
+    # the server mode itself does not matter to the clients
+    options = ServerOptions(framed=cli_args.framed, accelerated=cli_args.accelerated)
+    report = {"address": "%s:%i" % (address, port), "connections": cli_args.connections,
+        "requests": len(requests)}
+    if not cli_args.rate:
+        report["closed"] = closedLoop(address, port, options, requests, cli_args.connections,
+            cli_args.duration)
+        report["saturation"] = report["closed"]["total"]["throughput"]
+    else:
+        report["open"] = []
+        report["saturation"] = 0.
+        for rate in cli_args.rate:
+            summary = openLoop(address, port, options, requests, cli_args.connections,
+                cli_args.duration, rate, rng)
+            report["open"].append(summary)
+            achieved = summary["total"]["throughput"]
+            logger.info("Offered %.1f/s, achieved %.1f/s", rate, achieved)
+            # the service keeps up, while it answers (almost) all of the arrivals
+            if achieved >= 0.95 * rate:
+                report["saturation"] = max(report["saturation"], achieved)
+
+    for section in ([report["closed"]] if "closed" in report else report["open"]):
+        for method, entry in section.items():
+            if method != "total":
+                logger.info("%s: %i requests, %i errors, %.1f/s, p50 %.2f ms, p99 %.2f ms", method,
+                    entry["count"], entry["errors"], entry["throughput"], entry["p50"], entry["p99"])
+    logger.info("Saturation throughput: %.1f/s", report["saturation"])
+    with Path(cli_args.output).open("w") as file:
+        json.dump(report, file, indent=2)
+    return
+
+def registry(cli_args):
+    RegistryStandIn().serve(*_address(cli_args.address))
+    try:
+        while True:
+            time.sleep(1.)
+    except KeyboardInterrupt:
+        pass
+    return
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    argparser = ArgumentParser(prog='loadtest')
+    subparsers = argparser.add_subparsers(help='sub-command help')
+
+    load_parser = subparsers.add_parser('load', help="Send requests to the service")
+    load_parser.add_argument('-a', '--address', default='127.0.0.1:8904',
+        help="Address and Port of the service")
+    load_parser.add_argument('-r', '--registry', default='',
+        help="Start a registry stand-in here and load the first service registering")
+    load_parser.add_argument('-c', '--connections', type=int, default=4,
+        help="Number of concurrent connections")
+    load_parser.add_argument('--framed', action='store_true',
+        help="Framed transport, for the server modes nonblocking and asyncio")
+    load_parser.add_argument('--accelerated', action='store_true',
+        help="Accelerated compact protocol")
+    load_parser.add_argument('--rate', type=float, action='append',
+        help="Open loop with this arrival rate per second, may be repeated")
+    load_parser.add_argument('-d', '--duration', type=float, default=10.,
+        help="Seconds per run")
+    load_parser.add_argument('--records', default='',
+        help="Directory of an IKRecorder-recording to replay")
+    load_parser.add_argument('--cases',
+        default=(Path(__file__).parents[2]/"resources"/"PostureValueCases.json").as_posix(),
+        help="JSON with posture values by name for the synthetic requests")
+    load_parser.add_argument('--mix', default='ComputeIK=1,CalculateIKPosture=1',
+        help="Weights of the methods of the synthetic requests")
+    load_parser.add_argument('-n', '--requests', type=int, default=1000,
+        help="Number of distinct requests, which are repeated")
+    load_parser.add_argument('--avatar', default='lalala',
+        help="AvatarID of the synthetic requests")
+    load_parser.add_argument('--seed', type=int, default=0)
+    load_parser.add_argument('-o', '--output', default='loadtest.json',
+        help="Path of the JSON-report")
+    load_parser.set_defaults(func=load)
+
+    registry_parser = subparsers.add_parser('registry', help="Serve a stand-in of the MMIRegisterService")
+    registry_parser.add_argument('-a', '--address', default='127.0.0.1:9009')
+    registry_parser.set_defaults(func=registry)
+
+    cmd_args = argparser.parse_args()
+    cmd_args.func(cmd_args)
@@ -1 +1,6 @@
-from .eikserver import EIKServer
+def __getattr__(name):
+    # the server needs blender, the other modules (e.g. for the load test) do not
+    if name == "EIKServer":
+        from .eikserver import EIKServer
+        return EIKServer
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,168 @@
+from collections import OrderedDict
+from typing import Dict, Optional
+import logging
+
+# Blender-Imports
+import bpy
+
+# private-imports
+from BlenderMMI.IntermediateSkeletonApplication import IntermediateSkeletonApplication
+from BlenderMMI.RigSnapshot import RigSnapshotCache
+
+# MOSIM-declarations
+from MMIStandard.avatar.ttypes import MAvatarPosture
+
+logger = logging.getLogger(__name__)
+
+class AvatarRegistry():
+    """
+    Keeps a scaled armature (IntermediateSkeletonApplication) per AvatarID.
+
+    The armatures are duplicates of the template rig in the blend-file. At
+    most <capacity> of them exist at the same time, the least recently used
+    one is removed when another is needed. The postures of all registered
+    avatars are kept, so an evicted avatar is re-created on its next request.
+    """
+
+    def __init__(self, template_id: str, capacity: int = 8, snapshots: Optional[RigSnapshotCache] = None):
+        """
+        parameters:
+            - template_id: name of the armature-object in the blend-file
+            - capacity: maximum number of armatures in the scene
+            - snapshots: cache of the scaled armatures, None to scale every time
+        """
+        if capacity < 1:
+            raise ValueError("The capacity of the AvatarRegistry must be at least 1")
+
+        self.template_id = template_id
+        self.capacity    = capacity
+        self.snapshots   = snapshots
+        self.default     = None             # AvatarID for requests with unknown ids
+        self.postures    = dict()           # AvatarID -> MAvatarPosture
+        self._instances  = OrderedDict()    # AvatarID -> IntermediateSkeletonApplication, LRU first
+        self._unknown    = set()
+
+        self.hits        = 0
+        self.misses      = 0
+        self.evictions   = 0
+
+    def __contains__(self, avatar_id):
+        return avatar_id in self.postures
+
+    def __len__(self):
+        return len(self._instances)
+
+    def changed(self, posture: MAvatarPosture) -> bool:
+        """True if <posture> is not the registered posture of its avatar."""
+        return self.postures.get(posture.AvatarID) != posture
+
+    def instance(self, avatar_id: str) -> Optional[IntermediateSkeletonApplication]:
+        """The armature of the avatar, if it exists. Unlike get, neither
+        creates nor counts it."""
+        return self._instances.get(avatar_id)
+
+    def register(self, posture: MAvatarPosture) -> IntermediateSkeletonApplication:
+        """Registers or replaces an avatar and returns its scaled armature."""
+        avatar_id = posture.AvatarID
+        logger.debug("Register avatar %s", avatar_id)
+
+        self.postures[avatar_id] = posture
+        if avatar_id in self._instances:
+            # the scaling changed
+            self._evict(avatar_id)
+
+        if self.default is None:
+            self.default = avatar_id
+
+        return self.get(avatar_id)
+
+    def get(self, avatar_id: str) -> IntermediateSkeletonApplication:
+        """Returns the armature of the avatar, creating it if necessary.
+        Unknown ids are routed to the default avatar."""
+        if avatar_id not in self.postures:
+            if avatar_id not in self._unknown:
+                logger.warning("Unknown AvatarID %s, using avatar %s", avatar_id, self.default)
+                self._unknown.add(avatar_id)
+            avatar_id = self.default
+
+        app = self._instances.get(avatar_id)
+        if app is not None:
+            self.hits += 1
+            self._instances.move_to_end(avatar_id)
+            return app
+
+        self.misses += 1
+        while len(self._instances) >= self.capacity:
+            self._evict(next(iter(self._instances)))
+
+        app = self._instantiate(avatar_id)
+        self._instances[avatar_id] = app
+        return app
+
+    def clear(self):
+        """Removes all armatures. The registered postures are kept."""
+        for avatar_id in list(self._instances):
+            self._evict(avatar_id)
+        return
+
+    def statistics(self) -> Dict[str, int]:
+        statistics = {
+            "AvatarsRegistered": len(self.postures),
+            "AvatarsInstantiated": len(self._instances),
+            "AvatarCapacity": self.capacity,
+            "AvatarHits": self.hits,
+            "AvatarMisses": self.misses,
+            "AvatarEvictions": self.evictions,
+        }
+        if self.snapshots is not None:
+            statistics["RigSnapshotHits"] = self.snapshots.hits
+            statistics["RigSnapshotMisses"] = self.snapshots.misses
+        return statistics
+
+    def _instantiate(self, avatar_id: str) -> IntermediateSkeletonApplication:
+        if self.template_id in self._instanceObjects():
+            o = _duplicateArmature(bpy.data.objects[self.template_id], avatar_id)
+            logger.info("Created armature %s for avatar %s", o.name, avatar_id)
+            object_id = o.name
+        else:
+            # the template itself is free
+            object_id = self.template_id
+
+        return IntermediateSkeletonApplication(object_id, self.postures[avatar_id], self.snapshots)
+
+    def _instanceObjects(self):
+        return {app._object_id for app in self._instances.values()}
+
+    def _evict(self, avatar_id: str):
+        app = self._instances.pop(avatar_id)
+        self.evictions += 1
+        object_id = app._object_id
+        app.invalidateHandles()
+        if object_id != self.template_id:
+            logger.info("Remove armature %s of avatar %s", object_id, avatar_id)
+            _removeArmature(bpy.data.objects[object_id])
+        return
+
+def _duplicateArmature(template, name: str):
+    """Copies the armature object and its data. The constraints of the copy
+    still point at the template and are redirected to the copy."""
+    o = template.copy()
+    o.data = template.data.copy()
+    o.name = name # blender may add a suffix
+    for collection in template.users_collection:
+        collection.objects.link(o)
+
+    for bone in o.pose.bones:
+        for constraint in bone.constraints:
+            if getattr(constraint, 'target', None) == template:
+                constraint.target = o
+            if getattr(constraint, 'pole_target', None) == template:
+                constraint.pole_target = o
+    return o
+
+def _removeArmature(o):
+    armature = o.data
+    bpy.data.objects.remove(o, do_unlink=True)
+    if armature.users == 0:
+        bpy.data.armatures.remove(armature)
+    return
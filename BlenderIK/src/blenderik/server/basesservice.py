@@ -41,12 +41,8 @@ class BaseService(MMIServiceBase.Iface):
         """
         logger.debug("Call to Setup")
         self.app.disableAllConstraints()
-        bpy.context.view_layer.update()
-        for b in self.app.object.pose.bones: # Should this be a method of self.app?
-            b.rotation_mode="QUATERNION"
-            b.rotation_quaternion = Quaternion((1,0,0,0))
-            b.location = Vector((0,0,0))
-        bpy.context.view_layer.update()
+        self.app.resetPose()
+        self.app.evaluate("Setup")
         #self.app.ScaleMAvatarPosture(description)
         return MBoolResponse(Successful=True)
     
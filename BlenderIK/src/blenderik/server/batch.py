@@ -0,0 +1,92 @@
+"""
+Convention for batches of ComputeIK-jobs over <MMIServiceBase>.Consume.
+
+Request properties:
+ - "Method":     "ComputeIKBatch"
+ - "Jobs":       JSON-list of jobs
+                 {"AvatarID": str, "PostureData": [float],
+                  "IKProperties": [{"Target": "RightHand", "OperationType": "SetPosition",
+                                    "Values": [float], "Weight": float}]}
+                 Target and OperationType may also be given by their number.
+ - "Solver":     optional, see IKService
+
+Response properties:
+ - "Successful": "True" if all jobs were successful
+ - "Error":      only if the request itself is invalid, e.g. without "Jobs";
+                 there are no "Results" then
+ - "Results":    JSON-list in the order of the jobs
+                 {"AvatarID": str, "PostureData": [float], "Success": bool,
+                  "Time": float (ms), "Error": str}
+ - "Time":       time of the whole batch (ms)
+"""
+from typing import Dict, List, Tuple
+import json
+
+# MOSIM-declarations
+from MMIStandard.services.ttypes import MIKProperty, MIKOperationType
+from MMIStandard.avatar.ttypes import MAvatarPostureValues, MEndeffectorType
+
+METHOD = "ComputeIKBatch"
+
+def loadJobs(properties: Dict[str, str]) -> List[dict]:
+    """The jobs of a request as JSON-objects. Raises KeyError or ValueError 
+    for a missing or malformed "Jobs"."""
+    jobs = json.loads(properties["Jobs"])
+    if not isinstance(jobs, list) or not all(isinstance(job, dict) for job in jobs):
+        raise ValueError("Jobs must be a list of objects")
+    return jobs
+
+def decodeJobs(properties: Dict[str, str]) -> List[Tuple[MAvatarPostureValues, List[MIKProperty]]]:
+    """Raises KeyError or ValueError for an invalid request, see invalidRequest."""
+    try:
+        return [_decodeJob(job) for job in loadJobs(properties)]
+    except (TypeError, AttributeError) as x:
+        raise ValueError("Invalid job: %s" % x)
+
+def invalidRequest(error: Exception) -> Dict[str, str]:
+    """Response to a request whose jobs cannot be decoded."""
+    if isinstance(error, KeyError):
+        return {"Successful": "False", "Error": "Missing %s" % error}
+    return {"Successful": "False", "Error": str(error)}
+
+def encodeResults(jobs, results, elapsed: float) -> Dict[str, str]:
+    """
+    parameters:
+        - jobs: of the request, see decodeJobs
+        - results: BatchResults of IKService.ComputeIKBatch
+        - elapsed: time of the whole batch in seconds
+    """
+    encoded = [{
+        # the id of the request, a failed job has no posture
+        "AvatarID": avatarPval.AvatarID,
+        "PostureData": result.posture.PostureData if result.posture else [],
+        "Success": result.success,
+        "Time": result.time * 1000.,
+        "Error": result.error,
+    } for (avatarPval, MIKprops), result in zip(jobs, results)]
+    return {
+        "Successful": str(all(result.success for result in results)),
+        "Results": json.dumps(encoded),
+        "Time": str(elapsed * 1000.),
+    }
+
+def _decodeJob(job: dict) -> Tuple[MAvatarPostureValues, List[MIKProperty]]:
+    posture = MAvatarPostureValues(AvatarID=job.get("AvatarID"),
+        PostureData=[float(value) for value in job["PostureData"]])
+    return posture, [_decodeIKProperty(prop) for prop in job.get("IKProperties", [])]
+
+def _decodeIKProperty(prop: dict) -> MIKProperty:
+    return MIKProperty(
+        Values=[float(value) for value in prop["Values"]],
+        Weight=float(prop.get("Weight", 1.)),
+        Target=_enumValue(MEndeffectorType, prop["Target"]),
+        OperationType=_enumValue(MIKOperationType, prop["OperationType"]),
+    )
+
+def _enumValue(enum, value) -> int:
+    if isinstance(value, str):
+        try:
+            return enum._NAMES_TO_VALUES[value]
+        except KeyError:
+            raise ValueError("Unknown %s %s" % (enum.__name__, value))
+    return int(value)
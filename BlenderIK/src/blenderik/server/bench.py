@@ -0,0 +1,232 @@
+"""
+Replay benchmark of the IK service, see the subcommand "bench".
+
+The workload consists of
+ - the postures of PostureValueCases.json (or the T-pose of the armature),
+ - random reachable targets for hands and feet: the arm (leg) of a case
+   posture is bent randomly, its end joint gives the target, and
+ - the requests of an IKRecorder-recording.
+
+Each generated case is requested through ComputeIK and CalculateIKPosture for
+a number of avatars. The report holds the throughput and latency per entry
+point, per stage (see server.metrics) and per avatar, and the residuals of the
+position targets. It is written as JSON and can be compared with a baseline.
+"""
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from pathlib import Path
+import platform
+import logging
+import math
+import time
+
+import numpy as np
+
+from BlenderMMI.PoseMath import quaternions_to_matrices, matrices_to_quaternions
+from server.ikservice import IKService, TEMPLATE_ID
+from server.metrics import Histogram, STAGES, PERCENTILES
+from server.resultcache import ResultCache
+from server import workload
+from BlenderMMI.TwoBoneIK import EFFECTORS
+
+# MOSIM-declarations
+from MMIStandard.avatar.ttypes import MAvatarPosture, MAvatarPostureValues
+
+logger = logging.getLogger(__name__)
+
+# MOSIM-names of the effectors of the generated targets for ComputeIK and CalculateIKPosture
+TARGETS = {
+    'RightHand': 'RightWrist',
+    'LeftHand':  'LeftWrist',
+    'RightFoot': 'RightAnkle',
+    'LeftFoot':  'LeftAnkle',
+}
+
+# metrics of the report, where larger values are worse
+COMPARED = ("p50", "p90", "p99")
+
+class Job(NamedTuple):
+    method: str             # "ComputeIK" or "CalculateIKPosture"
+    case: str
+    args: Tuple
+    goals: List[Tuple[str, np.ndarray]]     # (end joint, position in blender coordinates)
+
+class Benchmark():
+    """Replays a workload against an in-process IKService."""
+
+    def __init__(self, posture: MAvatarPosture, avatars: int = 1, seed: int = 0, **kwargs):
+        """
+        parameters:
+            - posture: MAvatarPosture of the avatars
+            - avatars: number of avatars, each with an armature of its own
+            - seed: of the random targets
+            - kwargs: options of the IKService, by default without result cache
+        """
+        kwargs.setdefault("cache", ResultCache(size=0))
+        kwargs.setdefault("capacity", max(8, avatars + 1))
+        self.service = IKService(posture, **kwargs)
+        self.random  = np.random.default_rng(seed)
+        self.avatars = []
+        for idx in range(avatars):
+            avatar = MAvatarPosture(AvatarID="bench%i" % idx, Joints=posture.Joints)
+            self.service.SetAvatar(avatar)
+            self.avatars.append(avatar.AvatarID)
+        self.jobs: List[Job] = []
+
+    def addCases(self, cases: Dict[str, List[float]], targets: int = 4, max_angle: float = 0.8):
+        """
+        Adds requests for the posture cases, each with <targets> random reachable
+        position targets per effector, for both entry points.
+        """
+        ik = self.service.registry.get(self.avatars[0]).twoBoneIK
+        for name, values in cases.items():
+            for target in range(targets):
+                goals = []
+                for effector, end in TARGETS.items():
+                    if end in ik.chains:
+                        goals.append((effector, end, self._reachable(ik, values, end, max_angle)))
+                for avatar_id in self.avatars:
+                    posture = MAvatarPostureValues(AvatarID=avatar_id, PostureData=list(values))
+                    case = "%s/%i" % (name, target)
+                    self.jobs.append(Job("ComputeIK", case, (posture, [prop 
+                        for effector, end, position in goals
+                        for prop in workload.ikProperties(effector, position, None)]),
+                        [(end, position) for effector, end, position in goals]))
+                    self.jobs.append(Job("CalculateIKPosture", case, (posture, [
+                        workload.jointConstraint(end, position, None, TEMPLATE_ID) 
+                        for effector, end, position in goals], {}),
+                        [(end, position) for effector, end, position in goals]))
+        return
+
+    def addRecords(self, directory: Path, limit: Optional[int] = None):
+        """Adds the requests of an IKRecorder-recording, at most <limit>."""
+        for request in workload.fromRecording(directory, limit):
+            goals = [(EFFECTORS[joint], position) for joint, position in request.goals 
+                if joint in EFFECTORS]
+            self.jobs.append(Job(request.method, request.name, request.args, goals))
+        return
+
+    def run(self, iterations: int = 10, warmup: int = 1) -> dict:
+        """Replays the jobs <warmup> + <iterations> times and returns the report."""
+        if not self.jobs:
+            raise ValueError("No jobs in the workload")
+        for iteration in range(warmup):
+            self._replay(None, None)
+
+        self.service.metrics.reset()
+        methods = {}
+        avatars = {}
+        residuals = {}
+        start = time.perf_counter()
+        for iteration in range(iterations):
+            self._replay((methods, avatars), residuals)
+        elapsed = time.perf_counter() - start
+
+        return {
+            "meta": {
+                "jobs": len(self.jobs),
+                "iterations": iterations,
+                "avatars": len(self.avatars),
+                "solver": self.service.solver,
+                "warmStart": self.service.warmStart,
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "time": elapsed,
+            },
+            "entrypoints": {name: _summary(histogram, elapsed) for name, histogram in methods.items()},
+            "stages": {name: _summary(self.service.metrics.stages[name], elapsed)
+                for name in STAGES if self.service.metrics.stages[name].count},
+            "avatars": {name: _summary(histogram, elapsed) for name, histogram in avatars.items()},
+            "accuracy": {name: _residuals(values) for name, values in residuals.items()},
+        }
+
+    def _replay(self, histograms: Optional[Tuple[Dict, Dict]], residuals: Optional[Dict]):
+        for job in self.jobs:
+            method = getattr(self.service, job.method)
+            start = time.perf_counter()
+            result = method(*job.args)
+            elapsed = time.perf_counter() - start
+            if histograms is None:
+                continue
+            avatar_id = job.args[0].AvatarID
+            for histogram, key in zip(histograms, (job.method, avatar_id)):
+                histogram.setdefault(key, Histogram()).record(elapsed)
+            if job.goals:
+                values = result.Posture.PostureData if job.method == "CalculateIKPosture" else result.PostureData
+                residuals.setdefault(job.method, []).extend(
+                    self._residuals(avatar_id, values, job.goals))
+        return
+
+    def _residuals(self, avatar_id: str, values: List[float], goals) -> List[float]:
+        ik = self.service.registry.get(avatar_id).twoBoneIK
+        locations, rotations = ik.codec.decode(values)
+        return [float(np.linalg.norm(_endPosition(ik, end, locations, rotations) - position))
+            for end, position in goals if end in ik.chains]
+
+    def _reachable(self, ik, values: List[float], end: str, max_angle: float) -> np.ndarray:
+        """Position of <end> after random rotations of the two bones of its chain."""
+        locations, rotations = ik.codec.decode(values)
+        chain = ik.chains[end]
+        for joint in (chain.upper, chain.lower):
+            axis = self.random.normal(size=3)
+            axis /= np.linalg.norm(axis)
+            angle = self.random.uniform(-max_angle, max_angle)
+            turn = np.concatenate(([math.cos(angle / 2.)], math.sin(angle / 2.) * axis))
+            rotations[joint] = matrices_to_quaternions(
+                quaternions_to_matrices(rotations[joint]) @ quaternions_to_matrices(turn))
+        return _endPosition(ik, end, locations, rotations)
+
+def compare(report: dict, baseline: dict, tolerance: float = 0.1) -> List[str]:
+    """
+    Returns the regressions of <report> against <baseline>: latencies and
+    residuals more than <tolerance> (relative) worse, throughput more than
+    <tolerance> lower.
+    """
+    regressions = []
+    for section in ("entrypoints", "stages", "avatars"):
+        for name, old in baseline.get(section, {}).items():
+            new = report.get(section, {}).get(name)
+            if new is None:
+                continue
+            for key in COMPARED:
+                if new[key] > old[key] * (1. + tolerance):
+                    regressions.append("%s %s %s: %.3f ms > %.3f ms" % (section, name, key, new[key], old[key]))
+            if new["throughput"] < old["throughput"] * (1. - tolerance):
+                regressions.append("%s %s throughput: %.1f/s < %.1f/s" % (section, name,
+                    new["throughput"], old["throughput"]))
+    for name, old in baseline.get("accuracy", {}).items():
+        new = report.get("accuracy", {}).get(name)
+        if new is None:
+            continue
+        for key in ("mean", "max"):
+            # residuals below a tenth of a millimeter are noise
+            if new[key] > max(old[key] * (1. + tolerance), 1e-4):
+                regressions.append("accuracy %s %s: %.6f m > %.6f m" % (name, key, new[key], old[key]))
+        if new["reached"] < old["reached"] - tolerance:
+            regressions.append("accuracy %s reached: %.3f < %.3f" % (name, new["reached"], old["reached"]))
+    return regressions
+
+def _summary(histogram: Histogram, elapsed: float) -> dict:
+    """Latency in ms and throughput per second."""
+    summary = {"count": histogram.count,
+        "throughput": histogram.count / elapsed if elapsed > 0 else 0.}
+    for percentile, value in zip(PERCENTILES, histogram.percentiles()):
+        summary["p%i" % percentile] = value * 1000.
+    summary["max"] = histogram.max * 1000.
+    summary["mean"] = histogram.total / histogram.count * 1000. if histogram.count else 0.
+    return summary
+
+def _residuals(values: List[float]) -> dict:
+    """Distances (m) of the end joints to their targets."""
+    values = np.asarray(values)
+    return {
+        "count": len(values),
+        "mean": float(values.mean()),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max()),
+        # see IKService.REACHED_TOLERANCE
+        "reached": float(np.mean(values <= 1e-3)),
+    }
+
+def _endPosition(ik, end: str, locations: np.ndarray, rotations: np.ndarray) -> np.ndarray:
+    chain = ik.chains[end]
+    return ik._forward(chain.path, locations, rotations)[chain.end][:3, 3]
@@ -3,43 +3,36 @@ from mathutils import Vector
 from MMIStandard.constraints.ttypes import MInterval, MInterval3
 
 from typing import Tuple
-    
+
+import numpy as np
+
+from server import constrainteval
+
+# The checks of a single constraint, server.constrainteval evaluates all
+# constraints of a request at once.
+
 def rotationconstraint(mRotation: Tuple[float, float, float], limits: MInterval3) -> float:
-    return _l1normbox(mRotation, limits)
-    
+    """ Returns zero if the euler angles lie inside of the limits or the
+    L1-norm of the angles to the limits"""
+    lo, hi = constrainteval.limits(limits)
+    return float(np.sum(constrainteval.angleExcess(np.asarray(mRotation, dtype=float),
+        np.array(lo), np.array(hi))))
+
 def _l1normbox(position, limits) -> float:
-    """ Returns zero if the position lies inside of the Box or the L1-norm 
+    """ Returns zero if the position lies inside of the Box or the L1-norm
     distances to the edge of the cube"""
-    
-    L1err = 0.
-    L1err += max(limits.X.Min-position[0], 0.)
-    L1err += max(position[0]-limits.X.Max, 0.)
-        
-    L1err += max(limits.Y.Min-position[1], 0.)
-    L1err += max(position[1]-limits.Y.Max, 0.)
-        
-    L1err += max(limits.Z.Min-position[2], 0.)
-    L1err += max(position[2]-limits.Z.Max, 0.)
-        
-    return L1err
-    
+    lo, hi = constrainteval.limits(limits)
+    return float(np.sum(np.abs(constrainteval.boxExcess(np.asarray(position, dtype=float),
+        np.array(lo), np.array(hi)))))
+
 def _l1normellipsoid(position, limits) -> float:
     """ Returns zero if position is inside the Ellipsoid, defined by the limits.
-    If position is outside of the limits, the L1-norm to the closest Point on 
+    If position is outside of the limits, the L1-norm to the closest Point on
     the surface of the ellipsoid is returned."""
-    
-    L1err = 0.
-    center = interval3Center(limits)
-    rel = position - center
-    
-    k = rel.x^2/a^2 + rel.y^2/b^2 + rel.z^2/c^2
-    if k > 1:
-        err = 1 - 1/math.sqrt(k)
-        L1err += rel.x * err
-        L1err += rel.y * err
-        L1err += rel.z * err
-        
-    return L1err
+    lo, hi = constrainteval.limits(limits)
+    center, semi = constrainteval.ellipsoid(np.array(lo), np.array(hi))
+    return float(np.sum(np.abs(constrainteval.ellipsoidExcess(
+        np.asarray(position, dtype=float) - center, semi))))
     
 _HANDLERS = {
     'BOX': _l1normbox,
@@ -49,8 +42,8 @@ _HANDLERS = {
 }
 
 def translationconstraint(mPosition: Vector, limits: MInterval3, shape) -> float:
-                    
+
     try:
         return _HANDLERS[shape](mPosition, limits)
     except KeyError:
-        raise ValueError("Unknown shape %s. Must be one of %s" % (shape, _HANDLERS.keys()))
\ No newline at end of file
+        raise ValueError("Unknown shape %s. Must be one of %s" % (shape, _HANDLERS.keys()))
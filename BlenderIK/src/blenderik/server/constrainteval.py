@@ -0,0 +1,243 @@
+"""
+Vectorized evaluation of the MJointConstraints of a request.
+
+ConstraintSet compiles the translation limits (box or ellipsoid) and the
+rotation limits (euler angles) of the constraints into arrays. evaluate
+checks all of them at once against the joint positions and rotations of a
+posture, or of a batch of postures (any leading dimensions), and returns
+the residual of every constraint: how far the joint is outside of its limits.
+
+The residuals are in MOSIM coordinates, meters for the translation and
+radians for the rotation; a constraint with both limits adds them up. A
+constraint without a joint constraint has the residual NaN.
+
+Property "ErrorNorm" of CalculateIKPosture, the values in MIKServiceResult.Error:
+ - "L1"     (default) sum of the absolute residuals per constraint
+ - "L2"     euclidean norm of the residuals per constraint
+ - "both"   the L1 values followed by the L2 values
+"""
+from typing import Dict, Hashable, List, NamedTuple, Optional, Tuple
+import math
+
+import numpy as np
+
+from BlenderMMI.Conversion import interval_centers
+
+# MOSIM-declarations
+from MMIStandard.avatar.ttypes import MJointType
+from MMIStandard.constraints.ttypes import MConstraint, MInterval3
+
+ERROR_NORM = "ErrorNorm"
+L1 = "l1"
+L2 = "l2"
+BOTH = "both"
+
+# values of MTranslationConstraintType, check.py accepts the names as well
+BOX = 0
+ELLIPSOID = 1
+_SHAPES = {'BOX': BOX, BOX: BOX, 'ELLIPSOID': ELLIPSOID, ELLIPSOID: ELLIPSOID}
+
+# smallest semi-axis of an ellipsoid, a flat one is still an ellipsoid
+_EPS = 1e-9
+# bisection steps for the closest point on an ellipsoid, halving the interval each time
+_ITERATIONS = 48
+
+class Residuals(NamedTuple):
+    """Residuals (..., constraints) of a ConstraintSet."""
+    l1: np.ndarray
+    l2: np.ndarray
+
+    def satisfied(self, tolerance: float = 0.) -> np.ndarray:
+        """True (per posture) if every constraint is within <tolerance>."""
+        return np.all(np.isnan(self.l1) | (self.l1 <= tolerance), axis=-1)
+
+    def errors(self, norm: str = L1) -> List[float]:
+        """Error of MIKServiceResult in <norm>, for a single posture."""
+        if norm == L2:
+            return self.l2.tolist()
+        if norm == BOTH:
+            return self.l1.tolist() + self.l2.tolist()
+        return self.l1.tolist()
+
+class ConstraintSet():
+    """The limits of constraints as arrays, in the order of the constraints."""
+
+    def __init__(self, constraints: List[MConstraint], norm: Optional[str] = None):
+        """
+        parameters:
+            - constraints: of the request
+            - norm: of the errors, the value of the property ErrorNorm
+        """
+        self.norm = (norm or L1).lower()
+        if self.norm not in (L1, L2, BOTH):
+            raise ValueError("Unknown %s %s, use one of %s" % (ERROR_NORM, norm, ", ".join((L1, L2, BOTH))))
+        self.count = len(constraints)
+        self.joints: List[str] = []     # joints to evaluate, in the order of the arrays of evaluate
+        joints: Dict[str, int] = {}
+        translations, rotations = [], []
+        self._checked = np.zeros(self.count, dtype=bool)
+
+        for idx, constraint in enumerate(constraints):
+            jointConstraint = constraint.JointConstraint
+            if jointConstraint is None or jointConstraint.GeometryConstraint is None:
+                continue
+            name = MJointType._VALUES_TO_NAMES.get(jointConstraint.JointType, "Undefined")
+            if name not in joints:
+                joints[name] = len(self.joints)
+                self.joints.append(name)
+            joint = joints[name]
+            self._checked[idx] = True
+
+            geometry = jointConstraint.GeometryConstraint
+            if geometry.TranslationConstraint is not None:
+                translation = geometry.TranslationConstraint
+                try:
+                    shape = _SHAPES[translation.Type if translation.Type is not None else BOX]
+                except KeyError:
+                    raise ValueError("Unknown shape %s. Must be one of %s" % (translation.Type, list(_SHAPES)))
+                translations.append((idx, joint, shape) + limits(translation.Limits))
+            if geometry.RotationConstraint is not None:
+                rotations.append((idx, joint) + limits(geometry.RotationConstraint.Limits))
+
+        self._tRows  = np.array([row[0] for row in translations], dtype=np.int64)
+        self._tJoint = np.array([row[1] for row in translations], dtype=np.int64)
+        self._tLo    = np.array([row[3] for row in translations]).reshape(-1, 3)
+        self._tHi    = np.array([row[4] for row in translations]).reshape(-1, 3)
+        self._tShape = np.array([row[2] for row in translations], dtype=np.int64)
+        # the ellipsoids are given by their bounding box
+        self._ellipsoids = np.flatnonzero(self._tShape == ELLIPSOID)
+        self._center, self._semi = ellipsoid(self._tLo[self._ellipsoids], self._tHi[self._ellipsoids])
+
+        self._rRows  = np.array([row[0] for row in rotations], dtype=np.int64)
+        self._rJoint = np.array([row[1] for row in rotations], dtype=np.int64)
+        self._rLo    = np.array([row[2] for row in rotations]).reshape(-1, 3)
+        self._rHi    = np.array([row[3] for row in rotations]).reshape(-1, 3)
+
+    def __len__(self):
+        return self.count
+
+    def signature(self) -> Hashable:
+        """
+        The constraints as the errors see them: the rows in the order of the
+        request with their joints, shapes and limits. Requests with equal
+        targets but other constraints, or another order, differ in it.
+        """
+        return (self.norm, tuple(self.joints), self._checked.tobytes(),
+            self._tRows.tobytes(), self._tJoint.tobytes(), self._tShape.tobytes(),
+            self._tLo.tobytes(), self._tHi.tobytes(),
+            self._rRows.tobytes(), self._rJoint.tobytes(), self._rLo.tobytes(), self._rHi.tobytes())
+
+    def evaluate(self, positions: np.ndarray, rotations: np.ndarray) -> Residuals:
+        """
+        parameters:
+            - positions: (..., joints, 3) positions of self.joints in MOSIM coordinates
+            - rotations: (..., joints, 3) euler angles of self.joints in MOSIM coordinates,
+                         like check.rotationconstraint gets them
+
+        returns:
+            - Residuals (..., constraints)
+        """
+        positions = np.asarray(positions, dtype=float)
+        rotations = np.asarray(rotations, dtype=float)
+        batch = positions.shape[:-2]
+
+        l1 = np.zeros(batch + (self.count,))
+        squares = np.zeros(batch + (self.count,))
+
+        if len(self._tRows):
+            excess = self._translationExcess(positions)
+            l1[..., self._tRows] += np.sum(np.abs(excess), axis=-1)
+            squares[..., self._tRows] += np.sum(excess * excess, axis=-1)
+
+        if len(self._rRows):
+            excess = angleExcess(rotations[..., self._rJoint, :], self._rLo, self._rHi)
+            l1[..., self._rRows] += np.sum(excess, axis=-1)
+            squares[..., self._rRows] += np.sum(excess * excess, axis=-1)
+
+        l2 = np.sqrt(squares)
+        l1[..., ~self._checked] = np.nan
+        l2[..., ~self._checked] = np.nan
+        return Residuals(l1, l2)
+
+    def translationExcess(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Vectors (..., joints, 3) from the closest points within the translation 
+        limits to the joints at <positions> (..., joints, 3), summed over the 
+        constraints of a joint. Moving a joint by minus its vector satisfies them.
+        """
+        positions = np.asarray(positions, dtype=float)
+        if not len(self._tRows):
+            return np.zeros_like(positions)
+        incidence = (self._tJoint == np.arange(len(self.joints))[:, None]).astype(float)
+        return np.einsum('jt,...tc->...jc', incidence, self._translationExcess(positions))
+
+    def _translationExcess(self, positions: np.ndarray) -> np.ndarray:
+        points = positions[..., self._tJoint, :]
+        excess = boxExcess(points, self._tLo, self._tHi)
+        if len(self._ellipsoids):
+            excess[..., self._ellipsoids, :] = ellipsoidExcess(
+                points[..., self._ellipsoids, :] - self._center, self._semi)
+        return excess
+
+    def errors(self, positions: np.ndarray, rotations: np.ndarray) -> List[float]:
+        """Error of MIKServiceResult for the joints of a single posture."""
+        return self.evaluate(positions, rotations).errors(self.norm)
+
+def limits(interval3: MInterval3) -> Tuple[Tuple[float, float, float], Tuple[float, float, float]]:
+    """(lower, upper) limits of the axes of an MInterval3."""
+    lo = (interval3.X.Min, interval3.Y.Min, interval3.Z.Min)
+    hi = (interval3.X.Max, interval3.Y.Max, interval3.Z.Max)
+    if any(math.isnan(value) for value in lo + hi) or any(l > h for l, h in zip(lo, hi)):
+        raise ValueError("Limits cannot be NaN and the lower limit not greater than the upper limit.")
+    return lo, hi
+
+def boxExcess(points: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """Vector (..., 3) from the closest point of the box [lo, hi] to the points, zero inside."""
+    return np.maximum(points - hi, 0.) - np.maximum(lo - points, 0.)
+
+def ellipsoid(lo: np.ndarray, hi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Center and semi-axes of the ellipsoids in the boxes [lo, hi]. An unbounded
+    axis has an infinite semi-axis."""
+    with np.errstate(invalid='ignore'):
+        semi = np.where(np.isfinite(lo) & np.isfinite(hi), .5 * (hi - lo), np.inf)
+    return interval_centers(lo, hi), semi
+
+def ellipsoidExcess(relative: np.ndarray, semi: np.ndarray) -> np.ndarray:
+    """
+    Vector (..., 3) from the closest point on the surface of the ellipsoid to
+    the points <relative> to its center, zero inside. An infinite semi-axis
+    leaves that axis unconstrained.
+
+    The closest point of y is x = a² y / (a² + t) for the root t > 0 of
+    sum((a y / (a² + t))²) = 1, found by bisection of all points at once.
+    """
+    finite = np.isfinite(semi)
+    a = np.where(finite, np.maximum(semi, _EPS), 1.)
+    y = np.where(finite, np.abs(relative), 0.)
+    a2 = a * a
+    ay = a * y
+    outside = np.sum((y / a) ** 2, axis=-1) > 1.
+
+    # the root is below |a y|, as each term is less than (a y / t)²
+    lo = np.zeros(outside.shape)
+    hi = np.linalg.norm(ay, axis=-1)
+    for step in range(_ITERATIONS):
+        t = .5 * (lo + hi)
+        larger = np.sum((ay / (a2 + t[..., None])) ** 2, axis=-1) > 1.
+        lo = np.where(larger, t, lo)
+        hi = np.where(larger, hi, t)
+    t = (.5 * (lo + hi))[..., None]
+
+    excess = y * t / (a2 + t)
+    return np.where(outside[..., None], np.copysign(excess, relative), 0.)
+
+def angleExcess(angles: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """Angle (..., 3) between the angles and the intervals [lo, hi] on the circle,
+    zero inside. Intervals of a full turn or more, or unbounded ones, hold every angle."""
+    with np.errstate(invalid='ignore'):
+        free = ~(np.isfinite(lo) & np.isfinite(hi)) | (hi - lo >= 2. * math.pi)
+        width = np.where(free, 0., hi - lo)
+    lo = np.where(free, 0., lo)
+    offset = np.mod(angles - lo, 2. * math.pi)
+    excess = np.where(offset <= width, 0., np.minimum(offset - width, 2. * math.pi - offset))
+    return np.where(free, 0., excess)
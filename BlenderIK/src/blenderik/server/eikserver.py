@@ -22,8 +22,10 @@
 import sys
 import bpy
 import logging
+import threading
+import time
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
 #sys.path.append('C:/MOSIM/Gitlab/Core/Python') # location of MMIPython
 
 from mathutils import Vector, Quaternion
@@ -31,42 +33,70 @@ from mathutils import Vector, Quaternion
 
 # MOSIM-declarations
 from MMIStandard.services import MInverseKinematicsService
-from MMIStandard.register import MMIRegisterService
 from MMIStandard.avatar.ttypes import MAvatarDescription
 from MMIStandard.core.ttypes import MIPAddress, MBoolResponse, MServiceDescription
 
 # Load from BlenderIKService
-from BlenderMMI.MAvatarPostureGenerator import JSON2MAvatarPosture
+from BlenderMMI import SkeletonFormat
 from BlenderMMI.IntermediateSkeletonApplication import IntermediateSkeletonApplication
 
 from .ikservice import IKService
+from . import batch
+from .executor import MainThreadExecutor, MainThreadHandler, completed
+from .resultcache import ResultCache
+from .tracing import RequestTracer
+from .metrics import MetricsEndpoint, TimedProtocolFactory
+from .ikrecorder import IKRecorder
+from .sessions import SessionStore, SESSION_ID
+from .thriftserver import ServerOptions, createServer, protocolFactory, SERVER_MODES
+from BlenderMMI.RigSnapshot import RigSnapshotCache
 
 ## Load from Gitlab!
 #from MMIPython.core.services.service_access import ServiceAccess
-from MMIPython.core.utils.thrift_client import ThriftClient
-
-# Load from Blender/Python/Lib/site-packages (modified Blender distribution)
-from thrift.transport import TSocket
-from thrift.transport import TTransport
-from thrift.protocol import TCompactProtocol
-from thrift.server import TServer
 
 logger = logging.getLogger(__name__)
 
 RESOURCES = Path(bpy.data.filepath).parent
-m_avatar_posture = JSON2MAvatarPosture(RESOURCES/"intermediate.mos")
+_default_posture = None
+
+def defaultPosture():
+    """MAvatarPosture of intermediate.mos, loaded from its compiled skeleton 
+    on the first use."""
+    global _default_posture
+    if _default_posture is None:
+        _default_posture = SkeletonFormat.loadPosture(RESOURCES/"intermediate.mos")
+    return _default_posture
 
 class EIKServer(IKService):
     
-    def __init__(self, name, id, language, ip=None, port=None):        
-        
-        super().__init__(m_avatar_posture)
+    def __init__(self, name, id, language, ip=None, port=None, tracer=None, 
+            metrics_port=0, server_options=None, posture=None, **kwargs):        
+        """
+        parameters:
+            - name, id, language: of the service description
+            - ip, port: address of the service
+            - tracer: RequestTracer for the requests, by default no sampling
+            - metrics_port: local port of the Prometheus-endpoint, 0 disables it
+            - server_options: ServerOptions of the Thrift-Server, see server.thriftserver
+            - posture: MAvatarPosture of the default avatar, by default intermediate.mos
+            - kwargs: options of the IKService (capacity, solver, warm_start, 
+                      warm_start_tolerance, cache, metrics, recorder, sessions,
+                      snapshots, max_iterations, tolerance)
+        """
+        super().__init__(posture if posture is not None else defaultPosture(), **kwargs)
         self.name = name
         self.id = id
         self.language = language
         self.ip = ip
         self.port = port
         self.server = None
+        self.serverOptions = server_options if server_options is not None else ServerOptions()
+        # all blender-work is done in the main thread
+        self.executor = MainThreadExecutor()
+        self.tracer = tracer if tracer is not None else RequestTracer()
+        self.metricsEndpoint = MetricsEndpoint(self.metrics, port=metrics_port) if metrics_port else None
+        self.registrar = None
+        self._lastLoad = (time.perf_counter(), 0.)
         
     @property
     def description(self):
@@ -83,8 +113,16 @@ class EIKServer(IKService):
         """
         Implementation for <MMIServiceBase>: Returns the present status of the 
         service."""
-        #logger.info("Call to dummy-Method GetStatus. This is not properly implemented yet.")
-        return {"Running": "True"} # dummy
+        status = {"Running": "True", "PendingRequests": str(self.executor.pending)}
+        status.update({key: str(value) for key, value in self.registry.statistics().items()})
+        status.update({key: str(value) for key, value in self.cache.statistics().items()})
+        status.update({key: str(value) for key, value in self.metrics.statistics().items()})
+        status.update({key: str(value) for key, value in self.sessions.statistics().items()})
+        if self.recorder is not None:
+            status.update({key: str(value) for key, value in self.recorder.statistics().items()})
+        if self.registrar is not None:
+            status.update({key: str(value) for key, value in self.registrar.statistics().items()})
+        return status
         
     def GetDescription(self) -> MServiceDescription:
         """
@@ -101,21 +139,30 @@ class EIKServer(IKService):
         instead of transferring the full hierarchy, only the posture values can 
         be transmitted if being initialized in before.
         
+        Opens a session for delta-encoded requests (see server.sessions) 
+        under the property "SessionID" or a new id, which is returned in the 
+        LogData as "SessionID=<id>".
+        
         Parameters:
          - description 
          - properties
 
         """
         logger.debug("Call to Setup")
-        self.app.disableAllConstraints()
-        bpy.context.view_layer.update()
-        for b in self.app.object.pose.bones: # Should this be a method of self.app?
-            b.rotation_mode="QUATERNION"
-            b.rotation_quaternion = Quaternion((1,0,0,0))
-            b.location = Vector((0,0,0))
-        bpy.context.view_layer.update()
-        #self.app.ScaleMAvatarPosture(description)
-        return MBoolResponse(Successful=True)
+        session = self.sessions.open((properties or {}).get(SESSION_ID), description)
+        if description is not None and description.ZeroPosture is not None:
+            # scales an armature of its own for this avatar, unless the 
+            # posture is the known one
+            description.ZeroPosture.AvatarID = description.AvatarID
+            self.SetAvatar(description.ZeroPosture)
+            
+        # an armature created later starts its first request cold, with a reset
+        app = self.registry.instance(self._current)
+        if app is not None:
+            app.disableAllConstraints()
+            app.resetPose()
+            app.evaluate("Setup")
+        return MBoolResponse(Successful=True, LogData=["%s=%s" % (SESSION_ID, session.id)])
     
     def Consume(self, properties: Dict[str, str]) -> Dict[str, str]:
         """
@@ -125,70 +172,195 @@ class EIKServer(IKService):
         
         Parameters:
          - properties
+         
+        Supported methods (property "Method"):
+         - ComputeIKBatch   see server.batch
+         - Tracing          changes the RequestTracer, optional properties
+                            "SampleEvery" (0 disables) and "RingSize"
 
         """
-        logging.error("Call to Consume: Method is not implemented!")
-        pass
+        return self._prepareConsume(properties)()
+        
+    def _prepareConsume(self, properties: Dict[str, str]):
+        """Decodes the request outside of the main thread."""
+        method = properties.get("Method")
+        if method == batch.METHOD:
+            start = time.perf_counter()
+            try:
+                jobs = batch.decodeJobs(properties)
+            except (KeyError, ValueError) as x:
+                logger.error("Call to Consume: invalid batch, %s", x)
+                return completed(batch.invalidRequest(x))
+            job = self._prepareComputeIKBatch(jobs, properties)
+            return lambda: batch.encodeResults(jobs, job(), time.perf_counter() - start)
+        if method == "Tracing":
+            self.tracer.configure(_optionalInt(properties.get("SampleEvery")),
+                _optionalInt(properties.get("RingSize")))
+            return completed({"Successful": "True", "SampleEvery": str(self.tracer.sample_every),
+                "RingSize": str(self.tracer.ring_size)})
+            
+        logger.error("Call to Consume: Method %s is not implemented!", method)
+        return lambda: {"Successful": "False", "Error": "Unknown Method %s" % method}
     
-    def register(self, registry_host, registry_port):    
-        # Connect to MMILauncher
-        logger.debug("Connecting to Registry at %s::%i.", registry_host, registry_port)
-        registered = False
+    def register(self, registry_host, registry_port, heartbeat=30., max_backoff=30.):    
+        """Registers the service in the background and renews the registration 
+        with the current load every <heartbeat> seconds, see server.registrar."""
+        # only needed once, not worth importing with the service
+        from .registrar import Registrar
+        
         if not (self.ip and self.port):
             logger.warning("Own address unknown for registration. Please init_thrift before registration!")
             
-        while not registered:
-            # timeout?
-            try:
-                with ThriftClient(registry_host, registry_port, MMIRegisterService.Client) as client:
-                    response   = client._access.RegisterService(self.description)
-                    sessionID  = client._access.CreateSessionID(dict())
-                    registered = response.Successful
-                    if registered:
-                        self.launcherAddress = MIPAddress(Address=registry_host, Port=registry_port)
-                        logger.info("Registered successfully at MMIRegister [%s]", self.launcherAddress)
-            except TTransport.TTransportException as x:
-                logger.warning(f"Registration Server at {registry_host}:{registry_port} unreachable!")
-                # time.sleep(1)
-            except Exception as x:
-                logger.exception("Unknown Exception -> Abort Registration!")
-                raise x
-                
+        self.registrar = Registrar(lambda: self.description, registry_host, registry_port, 
+            heartbeat=heartbeat, max_backoff=max_backoff, load=self.load)
+        self.registrar.start()
+        self.launcherAddress = MIPAddress(Address=registry_host, Port=registry_port)
         return
+        
+    def load(self) -> Dict[str, str]:
+        """Load of the service since the last call, published by the registrar."""
+        now = time.perf_counter()
+        busy = self.executor.busyTime
+        last, lastBusy = self._lastLoad
+        self._lastLoad = (now, busy)
+        return {
+            "PendingRequests": str(self.executor.pending),
+            # share of the time the main thread was solving
+            "Utilization": "%.3f" % (min(1., (busy - lastBusy) / (now - last)) if now > last else 0.),
+        }
     
-    def init_thrift(self, address, port, nthreads=4):
-        logger.info("Initalizing Thrift-Server at %s::%i with %i threads.", address, port, nthreads)
-        IKProcessor = MInverseKinematicsService.Processor(self)
-        trans_svr   = TSocket.TServerSocket(host=address, port=port) 
+    def init_thrift(self, address, port, nthreads=None):
+        options = self.serverOptions
+        if nthreads is not None:
+            options = options._replace(threads=nthreads)
+        logger.info("Initalizing %s Thrift-Server at %s::%i with %i threads.", options.mode, 
+            address, port, options.threads)
+        # the threads only do the (de)serialization and the preparation of 
+        # the requests, the rest is queued for the main thread.
+        IKProcessor = MInverseKinematicsService.Processor(MainThreadHandler(self, self.executor, 
+            self.tracer, self.metrics))
         # self.ownAddress = MIPAddress(Address=address, Port=port)
-        trans_fac   = TTransport.TBufferedTransportFactory()
-        proto_fac   = TCompactProtocol.TCompactProtocolFactory()
-        self.server = TServer.TThreadPoolServer(IKProcessor, trans_svr, 
-            trans_fac, proto_fac)
-        self.server.setNumThreads(nthreads)
+        proto_fac   = TimedProtocolFactory(protocolFactory(options), self.metrics)
+        self.server = createServer(IKProcessor, address, port, options, proto_fac)
         self.ip = address
         self.port = port
         logger.debug('Thrift-Server initialized.')
         return
     
     def start(self): 
+        """Serves in background-threads and executes the requests in the 
+        calling (main) thread until stop() is called."""
         if self.server:
-            self.server.serve()
+            thread = threading.Thread(target=self._serve, name="ThriftServer", daemon=True)
+            thread.start()
             logger.info('Server running')
+            self.tracer.start()
+            if self.metricsEndpoint is not None:
+                self.metricsEndpoint.start()
+            try:
+                self.executor.run()
+            finally:
+                if self.registrar is not None:
+                    self.registrar.stop()
+                self.tracer.stop()
+                if self.metricsEndpoint is not None:
+                    self.metricsEndpoint.stop()
+                if self.recorder is not None:
+                    self.recorder.close()
         else:
             logger.error("Can't start server; need to initialize first!")
             
         return
         
+    def stop(self):
+        self.executor.shutdown()
+        return
+        
+    def _serve(self):
+        try:
+            self.server.serve()
+        except Exception:
+            logger.exception("Thrift-Server stopped")
+        finally:
+            self.stop()
+        return
+        
     #def __del__(self): # This need explanation or logic
      #   logger.info("Server closes down")
         
     @staticmethod
-    def fromConfig(config):
-        
-        name = config.get('IKSERVER', 'name', fallback='ikService')
-        id = config.get('IKSERVER', 'id', fallback='123456')
-        language = config.get('IKSERVER', 'language', fallback='BlenderPython')
-        server = EIKServer(name, id, language)
+    def fromConfig(config, name: Optional[str] = None, id: Optional[str] = None, 
+            language: Optional[str] = None):
+        """
+        EIKServer with the options of <config>. name, id and language, e.g.
+        of the description.json, take precedence over the section [IKSERVER].
+        """
+        if name is None:
+            name = config.get('IKSERVER', 'name', fallback='ikService')
+        if id is None:
+            id = config.get('IKSERVER', 'id', fallback='123456')
+        if language is None:
+            language = config.get('IKSERVER', 'language', fallback='BlenderPython')
+        server = EIKServer(name, id, language, 
+            capacity=config.getint('AVATARS', 'capacity', fallback=8), 
+            solver=config.get('IKSERVER', 'solver', fallback='blender'),
+            warm_start=config.getboolean('IKSERVER', 'warmStart', fallback=False),
+            warm_start_tolerance=config.getfloat('IKSERVER', 'warmStartTolerance', fallback=1e-4),
+            max_iterations=config.getint('IKSERVER', 'maxIterations', fallback=1),
+            tolerance=config.getfloat('IKSERVER', 'tolerance', fallback=1e-3),
+            cache=resultCacheFromConfig(config),
+            tracer=requestTracerFromConfig(config),
+            recorder=recorderFromConfig(config),
+            sessions=sessionStoreFromConfig(config),
+            snapshots=rigSnapshotsFromConfig(config),
+            metrics_port=config.getint('METRICS', 'port', fallback=0),
+            server_options=serverOptionsFromConfig(config))
         return server
-        
\ No newline at end of file
+        
+def serverOptionsFromConfig(config) -> ServerOptions:
+    mode = config.get('IKSERVER', 'serverMode', fallback='threadpool').lower()
+    if mode not in SERVER_MODES:
+        logger.warning("Unknown serverMode %s: using threadpool", mode)
+        mode = 'threadpool'
+    return ServerOptions(
+        mode=mode,
+        threads=config.getint('IKSERVER', 'serverThreads', fallback=4),
+        framed=config.getboolean('IKSERVER', 'framed', fallback=False),
+        accelerated=config.getboolean('IKSERVER', 'acceleratedProtocol', fallback=False))
+    
+def rigSnapshotsFromConfig(config) -> Optional[RigSnapshotCache]:
+    directory = config.get('STARTUP', 'snapshots', fallback='snapshots')
+    if not directory:
+        return None
+    return RigSnapshotCache(directory, bpy.data.filepath)
+    
+def sessionStoreFromConfig(config) -> SessionStore:
+    return SessionStore(
+        capacity=config.getint('SESSIONS', 'capacity', fallback=256),
+        ttl=config.getfloat('SESSIONS', 'ttl', fallback=600.),
+        tolerance=config.getfloat('SESSIONS', 'tolerance', fallback=0.))
+    
+def resultCacheFromConfig(config) -> ResultCache:
+    if not config.getboolean('CACHE', 'enabled', fallback=True):
+        return ResultCache(size=0)
+    return ResultCache(
+        size=config.getint('CACHE', 'size', fallback=1024),
+        ttl=config.getfloat('CACHE', 'ttl', fallback=60.),
+        posture_quantum=config.getfloat('CACHE', 'postureQuantum', fallback=1e-4),
+        target_quantum=config.getfloat('CACHE', 'targetQuantum', fallback=1e-3))
+        
+def requestTracerFromConfig(config) -> RequestTracer:
+    return RequestTracer(
+        sample_every=config.getint('TRACING', 'sampleEvery', fallback=0),
+        ring_size=config.getint('TRACING', 'ringSize', fallback=32))
+        
+def recorderFromConfig(config) -> Optional[IKRecorder]:
+    if not config.getboolean('RECORDER', 'enabled', fallback=False):
+        return None
+    return IKRecorder(config.get('RECORDER', 'directory', fallback='recording'),
+        sample_every=config.getint('RECORDER', 'sampleEvery', fallback=1),
+        buffer=config.getint('RECORDER', 'buffer', fallback=1024),
+        segment_records=config.getint('RECORDER', 'segmentRecords', fallback=16384))
+        
+def _optionalInt(value):
+    return int(value) if value not in (None, "") else None
@@ -0,0 +1,144 @@
+from concurrent.futures import Future
+from functools import partial
+from typing import Callable
+import threading
+import logging
+import queue
+import time
+
+logger = logging.getLogger(__name__)
+
+def completed(value) -> Callable:
+    """Job whose result is already known. MainThreadHandler returns it 
+    without queueing it for the main thread."""
+    job = lambda: value
+    job.completed = True
+    return job
+
+class MainThreadExecutor():
+    """
+    Ordered job queue, which is worked off by the thread calling run().
+
+    Blender's data may only be changed from its main thread. The threads of
+    the Thrift-Server submit their jobs here and wait for the result, while
+    the main thread executes one job after the other in the order of arrival.
+    """
+
+    def __init__(self):
+        self._jobs     = queue.Queue()
+        self._thread   = None
+        self.processed = 0
+        self.busyTime  = 0.     # seconds spent in jobs
+
+    @property
+    def pending(self) -> int:
+        """Number of jobs waiting in the queue"""
+        return self._jobs.qsize()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Queues fn(*args, **kwargs) and returns a Future for its result."""
+        future = Future()
+        self._jobs.put((future, partial(fn, *args, **kwargs)))
+        return future
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """Executes fn(*args, **kwargs) in the main thread and returns its result.
+        Exceptions are re-raised in the calling thread."""
+        if threading.current_thread() is self._thread:
+            # a job submitting another job would wait for itself
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    def run(self):
+        """Works off the queue until shutdown() is called. Blocks the calling thread."""
+        self._thread = threading.current_thread()
+        logger.debug("Executor running in %s", self._thread.name)
+        while True:
+            future, job = self._jobs.get()
+            if job is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.perf_counter()
+            try:
+                future.set_result(job())
+            except BaseException as x:
+                future.set_exception(x)
+            self.busyTime += time.perf_counter() - start
+            self.processed += 1
+
+        # jobs queued after the shutdown
+        while not self._jobs.empty():
+            future, job = self._jobs.get_nowait()
+            if job is not None:
+                future.cancel()
+        self._thread = None
+        return
+
+    def shutdown(self):
+        """Stops run() once the jobs queued so far are done. May be called 
+        from any thread."""
+        self._jobs.put((None, None))
+        return
+
+class MainThreadHandler():
+    """
+    Proxy for the handler of a Thrift-Processor.
+
+    The threads of the server read and decode a request, call the matching
+    method here and encode the response. The method itself is executed by the
+    executor in the main thread. If the handler defines a method
+    _prepare<Name>, it is called in the server-thread first and returns the
+    job for the main thread. So the next request is decoded and its input
+    converted, while the current one is solved. Jobs marked as completed
+    (e.g. cached results) are answered without waiting for the main thread.
+    Requests are reported to the optional RequestTracer and Metrics.
+    """
+
+    def __init__(self, handler, executor: MainThreadExecutor, tracer=None, metrics=None):
+        self._handler  = handler
+        self._executor = executor
+        self._tracer   = tracer
+        self._metrics  = metrics
+
+    def __getattr__(self, name):
+        method = getattr(self._handler, name)
+        if not callable(method):
+            return method
+
+        prepare = getattr(self._handler, "_prepare" + name, None)
+
+        def dispatch(*args, **kwargs):
+            if prepare is not None:
+                job = prepare(*args, **kwargs)
+                if getattr(job, "completed", False):
+                    return job()
+            else:
+                job = partial(method, *args, **kwargs)
+            return self._executor.call(job)
+
+        if self._tracer is None and self._metrics is None:
+            dispatch.__name__ = name
+            return dispatch
+
+        tracer, metrics = self._tracer, self._metrics
+
+        def observed(*args, **kwargs):
+            trace = tracer.begin(name, args) if tracer is not None else None
+            start = time.perf_counter()
+            try:
+                result = dispatch(*args, **kwargs)
+            except Exception as error:
+                if metrics is not None:
+                    metrics.request(name, time.perf_counter() - start, failed=True)
+                if tracer is not None:
+                    tracer.failed(name, error)
+                raise
+            if metrics is not None:
+                metrics.request(name, time.perf_counter() - start)
+            if tracer is not None:
+                tracer.end(trace, result)
+            return result
+
+        observed.__name__ = name
+        return observed
@@ -1,32 +1,257 @@
+"""
+Binary recording of the IK-requests and their results.
 
-from datetime import datetime
-import pickle
+The recording is a directory of segments "segment_<n>.ikr". A segment starts
+with a header of HEADER_SIZE bytes and holds records of a fixed width, see
+recordType. The width depends on the number of posture values, which is
+stored in the header, so a segment can be opened as a numpy.memmap of
+records. The scalar fields of a record (time, method, avatar, number of
+targets) index the float arrays: posture, result and the targets in blender
+coordinates, NaN where a target has no position or rotation.
+
+IKRecorder writes the records in a background thread. RecordingReader opens
+the segments memory-mapped.
+"""
+from typing import Iterator, List, Optional, Sequence
 from pathlib import Path
+import itertools
+import threading
 import logging
+import queue
+import time
+
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
-class IKRecorder:
-	
-    def __init__(self, name = "unknown"):
+MAGIC       = b"IKREC001"
+HEADER_SIZE = 64
+MAX_TARGETS = 8
+METHODS     = ("ComputeIK", "CalculateIKPosture")
+
+HEADER_TYPE = np.dtype([
+    ("magic", "S8"),
+    ("width", "<u4"),
+    ("max_targets", "<u4"),
+    ("created", "<f8"),
+    ("reserved", "V40"),
+])
+
+def recordType(width: int, max_targets: int = MAX_TARGETS) -> np.dtype:
+    """Record of a request with <width> posture values."""
+    return np.dtype([
+        ("time", "<f8"),                            # unix time of the request
+        ("duration", "<f4"),                        # seconds to solve it
+        ("method", "u1"),                           # index in METHODS
+        ("success", "u1"),
+        ("targets", "u1"),                          # number of valid targets
+        ("avatar", "S32"),
+        ("posture", "<f8", (width,)),
+        ("result", "<f8", (width,)),
+        ("joints", "S16", (max_targets,)),
+        ("positions", "<f8", (max_targets, 3)),
+        ("rotations", "<f8", (max_targets, 4)),     # w, x, y, z
+    ])
+
+class IKRecorder():
+    """
+    Records requests without blocking the request path.
+
+    add() takes every <sample_every>-th request into a bounded queue and
+    returns; requests arriving while the queue is full are dropped and
+    counted. A background thread packs the queued records and appends them to
+    the current segment, which is closed after <segment_records> records.
+    """
+
+    def __init__(self, name: str = "unknown", sample_every: int = 1, buffer: int = 1024,
+            segment_records: int = 16384):
+        """
+        parameters:
+            - name: directory of the recording, relative to the working directory
+            - sample_every: record every n-th request
+            - buffer: maximum number of queued records
+            - segment_records: records per segment
+        """
         logger.info("New IKRecorder %s", name)
-        self.name = name
-        self.count = 0
-        self.dir = Path.cwd().joinpath(self.name)
+        self.name            = name
+        self.dir             = Path.cwd().joinpath(self.name)
+        self.sample_every    = max(1, sample_every)
+        self.segment_records = segment_records
+        self.count           = 0    # records written
+        self.dropped         = 0    # records lost to a full queue
+        # next() of a count is atomic, the requests are sampled from several threads
+        self._seen           = itertools.count(1)
+        self._queue          = queue.Queue(maxsize=buffer)
+        self._file           = None
+        self._width          = None
+        self._inSegment      = 0
+        self._segment        = _nextSegment(self.dir)
+
         logger.info("recording-folder: %s", self.dir.as_posix())
-        if not self.dir.exists():
-            logger.info("Create folder for recording: %s",  self.dir.as_posix())
-            self.dir.mkdir()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._thread = threading.Thread(target=self._write, name="IKRecorder", daemon=True)
+        self._thread.start()
+
+    @property
+    def isempty(self) -> bool:
+        return self.count == 0 and self._queue.empty()
+
+    def sample(self) -> bool:
+        """True if the next request is to be recorded."""
+        return next(self._seen) % self.sample_every == 0
+
+    def add(self, method: str, avatar_id: str, posture: Sequence[float], targets,
+            result: Sequence[float], success: bool, duration: float):
+        """
+        Queues a record, never blocks.
+
+        parameters:
+            - method: one of METHODS
+            - targets: JointTargets in blender coordinates
+            - result: posture values of the result
+        """
+        try:
+            self._queue.put_nowait((time.time(), duration, METHODS.index(method), success,
+                avatar_id or "", posture, targets, result))
+        except queue.Full:
+            self.dropped += 1
         return
-        
-    def addRecord(self, payload):
-        logger.debug("Add new Record to %s", self.name)
-        data = (datetime.now(), payload)
-        file = self.dir.joinpath(f"dump_{self.count}.pickle")
-        self.count += 1
-        with open(file, 'wb') as f:
-            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+
+    def close(self):
+        """Writes the queued records and stops the thread."""
+        self._queue.put(None)
+        self._thread.join()
         return
-        
-    @property
-    def isempty(self):
-        return bool(self.data)
\ No newline at end of file
+
+    def statistics(self):
+        return {"RecordsWritten": self.count, "RecordsDropped": self.dropped}
+
+    def _write(self):
+        try:
+            while True:
+                entries = [self._queue.get()]
+                # everything queued in the meantime goes in one write
+                while len(entries) < 256:
+                    try:
+                        entries.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = None in entries
+                entries = [entry for entry in entries if entry is not None]
+                if entries:
+                    self._append(entries)
+                if stop:
+                    break
+        except Exception:
+            logger.exception("IKRecorder %s stopped", self.name)
+        finally:
+            if self._file is not None:
+                self._file.close()
+        return
+
+    def _append(self, entries: List[tuple]):
+        # the width of a segment is fixed, postures of another width start a new one
+        start = 0
+        for idx in range(1, len(entries) + 1):
+            if idx == len(entries) or len(entries[idx][5]) != len(entries[start][5]):
+                self._appendSegment(entries[start:idx])
+                start = idx
+        return
+
+    def _appendSegment(self, entries: List[tuple]):
+        width = len(entries[0][5])
+        while entries:
+            if self._file is None or self._width != width or self._inSegment >= self.segment_records:
+                self._openSegment(width)
+            chunk = entries[:self.segment_records - self._inSegment]
+            entries = entries[len(chunk):]
+            self._file.write(_pack(chunk, width).tobytes())
+            self._file.flush()
+            self._inSegment += len(chunk)
+            self.count += len(chunk)
+        return
+
+    def _openSegment(self, width: int):
+        if self._file is not None:
+            self._file.close()
+        path = self.dir/("segment_%06i.ikr" % self._segment)
+        self._segment += 1
+        header = np.zeros(1, dtype=HEADER_TYPE)
+        header["magic"] = MAGIC
+        header["width"] = width
+        header["max_targets"] = MAX_TARGETS
+        header["created"] = time.time()
+        self._file = path.open("wb")
+        self._file.write(header.tobytes())
+        self._width = width
+        self._inSegment = 0
+        logger.debug("Recording to %s", path)
+        return
+
+def _pack(entries: List[tuple], width: int) -> np.ndarray:
+    records = np.zeros(len(entries), dtype=recordType(width))
+    records["positions"] = np.nan
+    records["rotations"] = np.nan
+    for record, (timestamp, duration, method, success, avatar_id, posture, targets, result) in zip(records, entries):
+        record["time"] = timestamp
+        record["duration"] = duration
+        record["method"] = method
+        record["success"] = success
+        record["avatar"] = avatar_id.encode("utf-8")[:32]
+        record["posture"] = posture
+        record["result"] = result
+        targets = targets[:MAX_TARGETS]
+        record["targets"] = len(targets)
+        for idx, target in enumerate(targets):
+            record["joints"][idx] = target.joint_id.encode("utf-8")[:16]
+            if target.position is not None:
+                record["positions"][idx] = tuple(target.position)
+            if target.rotation is not None:
+                record["rotations"][idx] = tuple(target.rotation)
+    return records
+
+def _nextSegment(directory: Path) -> int:
+    """Index after the highest segment in <directory>, gaps are not reused."""
+    indices = [int(path.stem[len("segment_"):]) for path in directory.glob("segment_*.ikr")
+        if path.stem[len("segment_"):].isdigit()]
+    return max(indices) + 1 if indices else 0
+
+class RecordingReader():
+    """
+    Reads a recording of IKRecorder. The segments are opened as memmaps of
+    records (see recordType), a segment being written may be read as well.
+    """
+
+    def __init__(self, directory):
+        self.dir = Path(directory)
+        self.segments = sorted(self.dir.glob("segment_*.ikr"))
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        """Yields the records of each segment."""
+        for path in self.segments:
+            records = self.open(path)
+            if records is not None:
+                yield records
+
+    def __len__(self) -> int:
+        return sum(len(records) for records in self)
+
+    @staticmethod
+    def open(path: Path) -> Optional[np.ndarray]:
+        header = np.fromfile(str(path), dtype=HEADER_TYPE, count=1)
+        if len(header) == 0 or header["magic"][0] != MAGIC:
+            logger.warning("%s is no recording", path)
+            return None
+        dtype = recordType(int(header["width"][0]), int(header["max_targets"][0]))
+        # a record being written is left out
+        count = (path.stat().st_size - HEADER_SIZE) // dtype.itemsize
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(str(path), dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+    def records(self, method: Optional[str] = None) -> Iterator[np.void]:
+        """Yields the single records, optionally of one method only."""
+        for records in self:
+            if method is not None:
+                records = records[records["method"] == METHODS.index(method)]
+            yield from records
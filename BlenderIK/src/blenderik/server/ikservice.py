@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 
 
-from typing import List, Dict
+from typing import List, Dict, Callable, NamedTuple, Optional, Tuple
+from collections import OrderedDict, deque
 from operator import attrgetter
+from functools import partial
 import logging
 import math
+import time
+
+import numpy as np
 
 # Blender-Imports
 from mathutils import Vector, Quaternion
@@ -12,54 +17,184 @@ import bpy
 
 # private-imports
 from BlenderMMI.IntermediateSkeletonApplication import IntermediateSkeletonApplication
-from server import convert, check
+from BlenderMMI.SceneUpdateScheduler import scheduler
+from server import constrainteval, warmstart, sessions, workload
+from server.avatarregistry import AvatarRegistry
+from server.resultcache import ResultCache
+from server.executor import completed
+from server.metrics import Metrics
+from server.ikrecorder import IKRecorder
+from server.sessions import SessionStore
+from BlenderMMI.RigSnapshot import RigSnapshotCache
+from BlenderMMI import Conversion
 
 # MOSIM-declarations
 from MMIStandard.services import MInverseKinematicsService
 from MMIStandard.services.ttypes import MIKProperty, MIKServiceResult, MIKOperationType
-from MMIStandard.avatar.ttypes import MAvatarPostureValues, MEndeffectorType, MJointType
+from MMIStandard.avatar.ttypes import MAvatarPosture, MAvatarPostureValues, MEndeffectorType, MJointType
 from MMIStandard.core.ttypes import MBoolResponse
 from MMIStandard.constraints.ttypes import MConstraint, MJointConstraint
 
 
 logger = logging.getLogger(__name__)
 
+TEMPLATE_ID = "lalala" # name of the armature in the blend-file
+
+# values of the property "Solver"
+SOLVER_BLENDER  = "blender"     # constraints of the blender rig
+SOLVER_ANALYTIC = "analytic"    # TwoBoneIK for hands and feet, blender for the rest
+
+# distance (m) at which a position target counts as reached
+REACHED_TOLERANCE = 1e-3
+
+# properties of the iterative solve of CalculateIKPosture
+MAX_ITERATIONS = "MaxIterations"    # solves of a request, 1 solves once
+TIME_BUDGET    = "TimeBudget"       # ms after the arrival of a request, no iteration starts later
+TOLERANCE      = "Tolerance"        # L1-residual at which a constraint is satisfied
+# iterations of a request with a TimeBudget but without MaxIterations
+BUDGET_ITERATIONS = 32
+
+class BatchResult(NamedTuple):
+    """Result of one job of ComputeIKBatch"""
+    posture: Optional[MAvatarPostureValues]
+    success: bool
+    time: float         # seconds spent on the job
+    error: str = ""
+
+class SolveBudget(NamedTuple):
+    """Limits of the iterative solve of a CalculateIKPosture-request"""
+    iterations: int
+    deadline: float     # time.perf_counter(), no iteration starts later
+    tolerance: float
+
+class JointTarget(NamedTuple):
+    """Constraint converted to the blender coordinate system"""
+    joint_id: str
+    position: Optional[Vector]
+    rotation: Optional[Quaternion]
+
 class IKService(MInverseKinematicsService.Iface):
     """ 
     Adapter-Object to connect the Thrift-Server with the logic. Contains the 
     method for the <MMIServiceBase> and <MInverseKinematicsService>.
     """
 
-    def __init__(self, posture):
+    def __init__(self, posture, capacity: int = 8, solver: str = SOLVER_BLENDER, 
+            warm_start: bool = False, warm_start_tolerance: float = 1e-4, 
+            cache: Optional[ResultCache] = None, metrics: Optional[Metrics] = None,
+            recorder: Optional[IKRecorder] = None, sessions: Optional[SessionStore] = None,
+            snapshots: Optional[RigSnapshotCache] = None, max_iterations: int = 1, 
+            tolerance: float = REACHED_TOLERANCE):
+        """
+        parameters:
+            - posture: MAvatarPosture of the default avatar
+            - capacity: maximum number of avatar-armatures in the scene
+            - solver: solver for requests without the property "Solver"
+            - warm_start: continue from the last solution of an avatar, the 
+                          property "WarmStart" overrides it per request
+            - warm_start_tolerance: maximum difference of posture and target 
+                          values to the last solution
+            - cache: for the results of the requests, SetAvatar drops those
+                          of an avatar whose posture changed, all for the 
+                          default avatar
+            - metrics: latency of the stages, by default a Metrics of its own
+            - recorder: records the requests and their results, if given
+            - sessions: of the delta-encoded requests, see server.sessions
+            - snapshots: cache of the scaled armatures, see BlenderMMI.RigSnapshot
+            - max_iterations: solves of CalculateIKPosture without the property 
+                          "MaxIterations", 1 solves once
+            - tolerance: residual of satisfied constraints without the property 
+                          "Tolerance"
+        """
         logger.info("Initializing %s", self.__class__)
-        self.avatars          = dict()  # Only for reference, not in use!
-        self.skeletons        = dict()  # Only for reference, not in use!
-        self.app              = None    # IntermediateSkeletonApplication, contains the avatar and the skeleton
+        # IntermediateSkeletonApplications by AvatarID, contain the avatar and the skeleton
+        self.registry         = AvatarRegistry(TEMPLATE_ID, capacity, snapshots)
+        self._current         = None    # AvatarID of the last SetAvatar
+        self.solver           = solver.lower()
+        self.warmStart        = warm_start
+        self.warmStartTolerance = warm_start_tolerance
+        self.maxIterations    = max_iterations
+        self.tolerance        = tolerance
+        self.cache            = cache if cache is not None else ResultCache()
+        # the depsgraph evaluations are measured as a stage of their own
+        self.metrics          = metrics if metrics is not None else Metrics(
+            excluded=lambda: scheduler.evaluationTime)
+        self.recorder         = recorder
+        self.sessions         = sessions if sessions is not None else SessionStore()
         
-        # While this Class kann memorize multiple avatars and skeletons, it 
-        # doesn't provide a way to switch between them.
-        
-        avatar                = posture  # avatar = Posture ?, replaces self.avatars?
-        avatar.AvatarID       = "lalala"
-        
-        # self.counter = 0 # not in use!
+        # the default avatar uses the template armature
+        avatar                = posture
+        avatar.AvatarID       = TEMPLATE_ID
         self.SetAvatar(avatar)
         
         self._IKcounter = 0
         bpy.context.scene.unit_settings.system_rotation = 'RADIANS'
         
-    def SetAvatar(self, avatar) -> bool: # Types!
+    @property
+    def avatars(self) -> Dict[str, MAvatarPosture]:
+        """MAvatarPostures of all known avatars"""
+        return self.registry.postures
+        
+    @property
+    def app(self) -> IntermediateSkeletonApplication:
+        """Armature of the avatar set last"""
+        return self.registry.get(self._current)
+        
+    def SetAvatar(self, avatar: MAvatarPosture) -> bool:
         if avatar.AvatarID is not None and avatar.Joints is not None:
-            logger.debug('Set Avatar: %s', avatar.AvatarID)
-            avatar_id                 = avatar.AvatarID            
-            self.avatars[avatar_id]   = avatar
-            
-            # create the app. It does the scaling according to the posture automatically. 
-            self.app = IntermediateSkeletonApplication(avatar_id, avatar) # app wird bei jedem set überschrieben?           
+            if self.registry.changed(avatar):
+                logger.debug('Set Avatar: %s', avatar.AvatarID)
+                # creates the app. It does the scaling according to the posture automatically. 
+                self.registry.register(avatar)
+                # requests of unknown ids are solved with the default avatar
+                self.cache.clear(avatar.AvatarID if avatar.AvatarID != self.registry.default else None)
+            else:
+                logger.debug('Set Avatar: %s unchanged', avatar.AvatarID)
+            self._current = avatar.AvatarID
         else:
             logger.warning("Tried to set an empty avatar")
         return True
 
+    def warmUp(self, requests: int = 8):
+        """
+        Solves synthetic requests with the hands of the default avatar, 
+        alternating ComputeIK and CalculateIKPosture with both solvers, so the 
+        first real request does not pay for the first evaluations and the 
+        set-up of the solvers. Must be called from the main thread. Leaves no 
+        trace in the cache, the metrics and the recording.
+        """
+        if requests <= 0:
+            return
+        start = time.perf_counter()
+        avatar_id = self.registry.default
+        app = self.registry.get(avatar_id)
+        app.disableAllConstraints()
+        app.resetPose()
+        posture = MAvatarPostureValues(AvatarID=avatar_id, PostureData=app.ReadMAvatarPostureValues())
+        hands = {effector: np.array(app.getJointPosition(joint)) 
+            for effector, joint in (("RightHand", "RightWrist"), ("LeftHand", "LeftWrist"))}
+        recorder, self.recorder = self.recorder, None
+        try:
+            for idx in range(requests):
+                # the hands move a little, so no request repeats another
+                offset = np.array((0., -0.02 * (idx + 1), 0.))
+                if idx % 2 == 0:
+                    self.ComputeIK(posture, [prop for effector, position in hands.items() 
+                        for prop in workload.ikProperties(effector, position + offset, None)])
+                else:
+                    self.CalculateIKPosture(posture, [workload.jointConstraint(joint, 
+                        hands[effector] + offset, None, TEMPLATE_ID) for effector, joint 
+                        in (("RightHand", "RightWrist"), ("LeftHand", "LeftWrist"))], 
+                        {"Solver": (SOLVER_BLENDER, SOLVER_ANALYTIC)[idx // 2 % 2]})
+        finally:
+            self.recorder = recorder
+            self.cache.clear()
+            self.metrics.reset()
+            app.disableAllConstraints()
+            app.resetPose()
+        logger.info("Warm-up with %i requests in %.2fs", requests, time.perf_counter() - start)
+        return
+
     def CalculateIKPosture(self, postureValues: MAvatarPostureValues, constraints: List[MConstraint], properties: Dict[str, str]) -> MIKServiceResult:
     # def CalculateIKPosture(self, *args) -> MIKServiceResult:
         """
@@ -75,87 +210,199 @@ class IKService(MInverseKinematicsService.Iface):
          - MIKServiceResult
             . Posture   MAvatarPostureValues
             . Success   bool
-            . Error     list[double]
+            . Error     list[double], the residual of each constraint in the 
+                        norm of the property "ErrorNorm", see server.constrainteval
+        
+        Iterative solve (properties):
+         - MaxIterations    the position targets of unsatisfied constraints are 
+                            moved by their residual and the request is solved 
+                            again, up to this number of solves
+         - TimeBudget       ms from the arrival of the request, after which no 
+                            further solve starts
+         - Tolerance        L1-residual at which a constraint is satisfied
+        With either of the first two, the best solution is returned, Success 
+        tells whether all constraints are satisfied and the LogData holds 
+        "Iterations=<solves>".
         """
-        logger.debug("Call to CalculatIKPosture [%i]", self._IKcounter)
-        print(f"postureValues: {postureValues}")
-        print(f"Constraints: {constraints}")
-        print(f"properties: {properties}")
+        return self._prepareCalculateIKPosture(postureValues, constraints, properties)()
         
-        # preparations
-        ## check avatar id
+    def _prepareCalculateIKPosture(self, postureValues: MAvatarPostureValues, constraints: List[MConstraint], properties: Dict[str, str]) -> Callable[[], MIKServiceResult]:
+        """
+        Converts the constraints to blender targets. Does not access blender 
+        data, so it may run outside of the main thread.
         
-        avatar = self.app # Should be a dict-lookup
+        Returns:
+         - the job solving the request
+        """
+        logger.debug("Call to CalculatIKPosture")
+        if properties and sessions.SESSION_ID in properties:
+            return self._prepareSessionRequest(postureValues, constraints, properties)
         
+        # the errors are in the order of the request
+        checks = constrainteval.ConstraintSet(constraints, (properties or {}).get(constrainteval.ERROR_NORM))
+        budget = self._solveBudget(properties)
+        # sort constraint befor application            
+        constraints = sorted(constraints, key=_constraintweight)
+        targets = _convertJointConstraints(constraints)
         
-        ## ToDo: Check if this is necessary
-        avatar.disableAllConstraints()
-        bpy.context.view_layer.update() # Maybe only usefull with life-preview
-        for b in avatar.object.pose.bones: # implementation details!
-            b.rotation_mode="QUATERNION"
-            b.rotation_quaternion = Quaternion((1,0,0,0))
-            b.location = Vector((0,0,0))
+        # the targets are sorted and only the centers of the limits, the errors 
+        # depend on the order and the limits as well
+        key = self.cache.key("CalculateIKPosture", postureValues.AvatarID, postureValues.PostureData, 
+            targets, self._cacheOptions(properties) + (checks.signature(),))
+        result = self.cache.get(key)
+        if result is not None:
+            logger.debug("CalculateIKPosture answered from the cache")
+            return self._recorded("CalculateIKPosture", postureValues, targets, completed(result))
         
+        return self._recorded("CalculateIKPosture", postureValues, targets, partial(self._cached, key, 
+            partial(self._calculateIKPosture, postureValues, constraints, targets, checks, budget, properties)))
         
-        # apply posture
-        bpy.context.view_layer.update() # Maybe only usefull with life-preview
-        avatar.ApplyMAvatarPostureValues(postureValues.PostureData)
-        bpy.context.view_layer.update() # Maybe only usefull with life-preview
+    def _prepareSessionRequest(self, postureValues: MAvatarPostureValues, constraints: List[MConstraint], properties: Dict[str, str]) -> Callable[[], MIKServiceResult]:
+        """Decodes the posture of a request of a session and encodes the result."""
+        try:
+            session, postureValues = self.sessions.decode(postureValues, properties)
+        except sessions.ResyncRequired as x:
+            logger.debug("CalculateIKPosture needs a resync: %s", x)
+            return completed(sessions.resyncResult(postureValues.AvatarID, str(x)))
         
-        # End ToDo: Check if this is necessary
+        job = self._prepareCalculateIKPosture(postureValues, constraints, 
+            {key: value for key, value in properties.items() if key != sessions.SESSION_ID})
+        encoded = lambda: self.sessions.encode(session, job(), properties)
+        encoded.completed = getattr(job, "completed", False)
+        return encoded
         
-        # sort constraint befor application            
-        constraints = sorted(constraints, key=_constraintweight)
+    def _calculateIKPosture(self, postureValues: MAvatarPostureValues, constraints: List[MConstraint], targets: List[JointTarget], 
+            checks: constrainteval.ConstraintSet, budget: Optional[SolveBudget], properties: Dict[str, str]) -> MIKServiceResult:
+        """Solves a prepared CalculateIKPosture-request in blender."""
+        logger.debug("Solve CalculatIKPosture [%i]", self._IKcounter)
+        
+        avatar = self.registry.get(postureValues.AvatarID)
+        if self._useAnalytic(avatar, targets, properties):
+            values, success = avatar.twoBoneIK.solve(postureValues.PostureData, targets)
+            logger.debug("CalculateIKPosture %i solved analytically. Success: %s", 
+                self._IKcounter, success)
+            self._IKcounter += 1
+            newAvatarPval = MAvatarPostureValues(AvatarID=postureValues.AvatarID, PostureData=values.tolist())
+            # the armature does not hold the analytic solution, the joints 
+            # are computed from the posture values
+            positions, rotations = _analyticJointStates(avatar, values, checks.joints)
+            return MIKServiceResult(newAvatarPval, MBoolResponse(success), checks.errors(positions, rotations))
+            
+        start = self._warmStartMode(avatar, postureValues, targets, properties, checks)
+        if start == warmstart.REPEAT:
+            logger.debug("CalculateIKPosture %i repeats the last solution", self._IKcounter)
+            self._IKcounter += 1
+            return avatar.lastSolution.result
+            
+        avatar.scheduler.beginRequest()
+        stage = self.metrics.stage
+        
+        if start == warmstart.COLD:
+            # the depsgraph is only evaluated, once a step needs the matrices
+            with stage("reset"):
+                avatar.disableAllConstraints()
+                avatar.resetPose()
+            
+            # apply posture
+            with stage("apply"):
+                avatar.ApplyMAvatarPostureValues(postureValues.PostureData)
+            
+            # check whether both hands are constrained:
+            LeftWrist = False
+            RightWrist = False
+            for constraint in constraints:
+                if not constraint.JointConstraint is None:
+                    if constraint.JointConstraint.JointType == MJointType.LeftWrist:
+                        LeftWrist = True
+                    elif constraint.JointConstraint.JointType == MJointType.RightWrist:
+                        RightWrist = True
+            with stage("constraints"):
+                if not (LeftWrist and RightWrist) and LeftWrist:
+                    logger.debug("Only RightWrist set")
+                    avatar.FixAtCurrentPosititionRotation("RightWrist")
+                elif not (LeftWrist and RightWrist) and RightWrist:
+                    avatar.FixAtCurrentPosititionRotation("LeftWrist")
+                    logger.debug("Only LeftWrist set")
+                elif (LeftWrist and RightWrist):
+                    logger.debug("Both Wrist set")
+                else:
+                    logger.debug("No Wrist set")
+        else:
+            # the armature holds the last solution with the same constraints 
+            # active, only the targets move
+            avatar.lastSolution = None
         
         # initialization
         success = True
-        error = [float('nan')] * len(constraints)
-
-        # check whether both hands are constrained:
-        LeftWrist = False
-        RightWrist = False
-        for constraint in constraints:
-            if not constraint.JointConstraint is None:
-                if constraint.JointConstraint.JointType == MJointType.LeftWrist:
-                    LeftWrist = True
-                elif constraint.JointConstraint.JointType == MJointType.RightWrist:
-                    RightWrist = True
-        if not (LeftWrist and RightWrist) and LeftWrist:
-            logger.debug("Only RightWrist set")
-            avatar.FixAtCurrentPosititionRotation("RightWrist")
-        elif not (LeftWrist and RightWrist) and RightWrist:
-            avatar.FixAtCurrentPosititionRotation("LeftWrist")
-            logger.debug("Only LeftWrist set")
-        elif (LeftWrist and RightWrist):
-            logger.debug("Both Wrist set")
-        else:
-            logger.debug("No Wrist set")
         
-        for constraint in constraints:
-            if constraint.JointConstraint is None: 
-                continue
-                
-            success *= _applyJointConstraint(avatar, constraint)
+        with stage("constraints"):
+            for target in targets:
+                success *= _applyJointTarget(avatar, target)
             
         logger.debug("Checking results.")
-        for idx, constraint in enumerate(constraints):
-            if constraint.JointConstraint is None: 
-                continue
-                
-            suc, L1err = _checkJointConstraint(avatar, constraint)
+        with stage("check"):
+            positions, rotations = _jointStates(avatar, checks.joints)
+            residuals = checks.evaluate(positions, rotations)
             
-        bpy.context.view_layer.update()
         # read posture values from blender rig
         newAvatarPval             = MAvatarPostureValues()
         newAvatarPval.AvatarID    = postureValues.AvatarID
-        newAvatarPval.PostureData = avatar.ReadMAvatarPostureValues()        
+        with stage("readback"):
+            newAvatarPval.PostureData = avatar.ReadMAvatarPostureValues()        
+        
+        response = MBoolResponse(success)
+        if budget is not None:
+            newAvatarPval.PostureData, residuals, iterations = self._iterate(avatar, targets, checks, 
+                budget, positions, residuals, newAvatarPval.PostureData)
+            response = MBoolResponse(bool(residuals.satisfied(budget.tolerance)), 
+                ["Iterations=%i" % iterations])
+        
+        result =  MIKServiceResult(newAvatarPval, response, residuals.errors(checks.norm))
+        self._keepSolution(avatar, postureValues, targets, properties, result, checks)
         
-        logger.debug("CalculateIKPosture %i done. Success: %s", self._IKcounter, success)
+        logger.debug("CalculateIKPosture %i done (%s start). Success: %s, depsgraph evaluations: %i", 
+            self._IKcounter, start, response.Successful, avatar.scheduler.endRequest())
+        self.metrics.record("evaluate", avatar.scheduler.lastRequestTime)
         self._IKcounter += 1
-        result =  MIKServiceResult(newAvatarPval, MBoolResponse(success), error)
-        #print(result)
         return result
         
+    def _iterate(self, avatar, targets: List[JointTarget], checks: constrainteval.ConstraintSet, 
+            budget: SolveBudget, positions: np.ndarray, residuals: constrainteval.Residuals, 
+            values: List[float]) -> Tuple[List[float], constrainteval.Residuals, int]:
+        """
+        Solves the request again with the position targets moved by the 
+        residuals of their joints, until all constraints are satisfied or the 
+        budget is spent. Returns the posture values and residuals of the best 
+        solution and the number of solves.
+        """
+        stage = self.metrics.stage
+        best = (np.nansum(residuals.l1), values, residuals)
+        joints = {joint: idx for idx, joint in enumerate(checks.joints)}
+        # blender coordinates, like the targets
+        offsets = np.zeros((len(checks.joints), 3))
+        iterations = 1
+        while iterations < budget.iterations and time.perf_counter() < budget.deadline \
+                and not residuals.satisfied(budget.tolerance):
+            correction = checks.translationExcess(positions)
+            if not np.any(correction):
+                # only rotations are left, moving the targets does not help
+                break
+            offsets += Conversion.positions_m2b(correction)
+            with stage("constraints"):
+                for target in targets:
+                    _applyJointTarget(avatar, _shifted(target, offsets, joints))
+            with stage("check"):
+                positions, rotations = _jointStates(avatar, checks.joints)
+                residuals = checks.evaluate(positions, rotations)
+            iterations += 1
+            total = np.nansum(residuals.l1)
+            if total < best[0]:
+                with stage("readback"):
+                    best = (total, avatar.ReadMAvatarPostureValues(), residuals)
+        logger.debug("CalculateIKPosture %i: %i iterations, residual %g", self._IKcounter, 
+            iterations, best[0])
+        return best[1], best[2], iterations
+        
     def ComputeIK(self, avatarPval: MAvatarPostureValues, MIKprops: List[MIKProperty]) -> MAvatarPostureValues:
         """
         Implementation for <MInverseKinematicsService>: The method computes a 
@@ -169,151 +416,416 @@ class IKService(MInverseKinematicsService.Iface):
         Returns:
         - newAvatarPval MAvatarPostureValues
         """
-        logger.debug("Call to ComputeIK [%i]", self._IKcounter)
+        return self._prepareComputeIK(avatarPval, MIKprops)()
         
-        # Set the avatar's initial position to the one indicated by avatarPval
-        self.app.disableAllConstraints()
-        bpy.context.view_layer.update() # Maybe only usefull with life-preview
-        for b in self.app.object.pose.bones: # implementation details!
-            b.rotation_mode="QUATERNION"
-            b.rotation_quaternion = Quaternion((1,0,0,0))
-            b.location = Vector((0,0,0))
+    def _prepareComputeIK(self, avatarPval: MAvatarPostureValues, MIKprops: List[MIKProperty]) -> Callable[[], MAvatarPostureValues]:
+        """
+        Converts the MIKProperties to blender targets. Does not access blender 
+        data, so it may run outside of the main thread.
+        
+        Returns:
+         - the job solving the request
+        """
+        logger.debug("Call to ComputeIK")
+        
+        MIKprops, targets = _convertIKProperties(MIKprops)
+        
+        key = self.cache.key("ComputeIK", avatarPval.AvatarID, avatarPval.PostureData, 
+            targets, self._cacheOptions(None))
+        result = self.cache.get(key)
+        if result is not None:
+            logger.debug("ComputeIK answered from the cache")
+            return self._recorded("ComputeIK", avatarPval, targets, completed(result))
+            
+        return self._recorded("ComputeIK", avatarPval, targets, 
+            partial(self._cached, key, partial(self._computeIK, avatarPval, MIKprops, targets)))
+        
+    def _computeIK(self, avatarPval: MAvatarPostureValues, MIKprops: List[MIKProperty], targets: List[JointTarget]) -> MAvatarPostureValues:
+        """Solves a prepared ComputeIK-request in blender."""
+        logger.debug("Solve ComputeIK [%i]", self._IKcounter)
+        
+        app = self.registry.get(avatarPval.AvatarID)
+        if self._useAnalytic(app, targets):
+            values, success = app.twoBoneIK.solve(avatarPval.PostureData, targets)
+            logger.debug("ComputeIK %i solved analytically. Success: %s", self._IKcounter, success)
+            self._IKcounter += 1
+            return MAvatarPostureValues(AvatarID=avatarPval.AvatarID, PostureData=values.tolist())
             
-        # makes sure, that position is set before rotation
-        MIKprops.sort(key=attrgetter('OperationType'))
+        start = self._warmStartMode(app, avatarPval, targets)
+        if start == warmstart.REPEAT:
+            logger.debug("ComputeIK %i repeats the last solution", self._IKcounter)
+            self._IKcounter += 1
+            return app.lastSolution.result
             
-        bpy.context.view_layer.update() # Maybe only usefull with life-preview
-        self.app.ApplyMAvatarPostureValues(avatarPval.PostureData)
-        bpy.context.view_layer.update() # Maybe only usefull with life-preview
-        
-        # check whether both hands are constrained:
-        LeftWrist = False
-        RightWrist = False
-        for MIKelement in MIKprops:
-            joint_id = MIKelement.Target # "LeftWrist" # 
-            if not joint_id is None:
-                if joint_id == MEndeffectorType.LeftHand:
-                    LeftWrist = True
-                elif joint_id == MEndeffectorType.RightHand:
-                    RightWrist = True
-        if not (LeftWrist and RightWrist) and LeftWrist:
-            logger.debug("Only RightWrist set")
-            self.app.FixAtCurrentPosititionRotation("RightWrist")
-        elif not (LeftWrist and RightWrist) and RightWrist:
-            self.app.FixAtCurrentPosititionRotation("LeftWrist")
-            logger.debug("Only LeftWrist set")
-        elif (LeftWrist and RightWrist):
-            logger.debug("Both Wrist set")
+        app.scheduler.beginRequest()
+        if start == warmstart.COLD:
+            self._setupComputeIK(app, avatarPval, MIKprops, targets)
         else:
-            logger.debug("No Wrist set")
-
-        # For each MIKProps, add the corresponding constraint
-        for MIKelement in MIKprops:
-            weight   = MIKelement.Weight
-            values   = MIKelement.Values
-            joint_id = MEndeffectorType._VALUES_TO_NAMES[MIKelement.Target] # "LeftWrist" # 
-            OpType   = MIKOperationType._VALUES_TO_NAMES[MIKelement.OperationType]
-        
-            # Add IK constraints to skeleton bones. If blender automatically changes the posture, obtain
-            if OpType == 'SetPosition':
-                t   = Vector()
-                t.x = -values[0]
-                t.y = values[1]
-                t.z = values[2]
-                logger.debug("Asking for position %f, %f, %f", t.x, t.y, t.z)
-                self.app.AddPositionConstraint(joint_id, t)
-                
-            elif OpType == 'SetRotation':
-                q   = Quaternion()
-                q.w = -values[3]
-                q.x = -values[0]
-                q.y = values[1]
-                q.z = values[2]
-                logger.debug("Asking for Quaternion %f, %f, %f, %f", q.w, q.x, q.y, q.z)
-                self.app.AddRotationConstraint(joint_id, q)
-                
-        
-        # This step is needed if Blender doesn't compute the new position as constraints are added
-        self.app.solveIK() # pass
-        bpy.context.view_layer.update()
-                
-        # read posture values from blender rig
-        newAvatarPval             = MAvatarPostureValues()
-        newAvatarPval.AvatarID    = avatarPval.AvatarID
-        newAvatarPval.PostureData = self.app.ReadMAvatarPostureValues()
+            # the armature holds the last solution with the same constraints 
+            # active, only the targets move
+            app.lastSolution = None
+            with self.metrics.stage("constraints"):
+                for target in targets:
+                    _applyJointTarget(app, target)
+        newAvatarPval = self._readComputeIK(app, avatarPval)
+        self._keepSolution(app, avatarPval, targets, None, newAvatarPval)
         
         # Reset the constraints on the avatar posture
-        # debugMsg += self.app.CheckIKConstraintStatus()
-        bpy.context.view_layer.update()
-        logger.debug("ComputeIK %i done.", self._IKcounter)
+        # debugMsg += app.CheckIKConstraintStatus()
+        logger.debug("ComputeIK %i done (%s start). Depsgraph evaluations: %i", 
+            self._IKcounter, start, app.scheduler.endRequest())
+        self.metrics.record("evaluate", app.scheduler.lastRequestTime)
         self._IKcounter += 1
         # time.sleep(1)
         return newAvatarPval
         
-def _applyJointConstraint(avatar, constraint: MJointConstraint) -> bool:
+    def _setupComputeIK(self, app: IntermediateSkeletonApplication, avatarPval: MAvatarPostureValues, MIKprops: List[MIKProperty], targets: List[JointTarget]):
+        """Applies the posture and the constraints of a ComputeIK-request to the armature."""
+        stage = self.metrics.stage
+        # Set the avatar's initial position to the one indicated by avatarPval
+        with stage("reset"):
+            app.disableAllConstraints()
+            app.resetPose()
+            
+        with stage("apply"):
+            app.ApplyMAvatarPostureValues(avatarPval.PostureData)
+        
+        with stage("constraints"):
+            # a single constrained hand, the other one keeps its place
+            for joint_id in _heldWrists(MIKprops):
+                app.FixAtCurrentPosititionRotation(joint_id)
+
+            # For each MIKProps, add the corresponding constraint
+            for target in targets:
+                _applyJointTarget(app, target)
+        return
+        
+    def _readComputeIK(self, app: IntermediateSkeletonApplication, avatarPval: MAvatarPostureValues) -> MAvatarPostureValues:
+        """Solves the constraints and reads the posture from the armature."""
+        with self.metrics.stage("readback"):
+            # This step is needed if Blender doesn't compute the new position as constraints are added
+            app.solveIK()
+                    
+            # read posture values from blender rig
+            newAvatarPval             = MAvatarPostureValues()
+            newAvatarPval.AvatarID    = avatarPval.AvatarID
+            newAvatarPval.PostureData = app.ReadMAvatarPostureValues()
+        return newAvatarPval
+        
+    def ComputeIKBatch(self, jobs: List[Tuple[MAvatarPostureValues, List[MIKProperty]]], properties: Optional[Dict[str, str]] = None) -> List[BatchResult]:
+        """
+        Solves many independent ComputeIK-jobs at once. Not part of the 
+        Thrift-interface, see Consume.
+        
+        The jobs are solved in waves, each wave with at most one job per 
+        avatar. The postures of all armatures of a wave are applied and 
+        evaluated together, the IK-targets are then placed from that 
+        evaluation and the solution is read after a second one. So a wave 
+        costs two depsgraph evaluations, however many armatures it has.
+        
+        Arguments:
+         - jobs         list of (MAvatarPostureValues, list of MIKProperty)
+         - properties   e.g. "Solver" for all jobs
+        
+        Returns:
+         - BatchResult for each job, in the order of the jobs
+        """
+        return self._prepareComputeIKBatch(jobs, properties)()
+        
+    def _prepareComputeIKBatch(self, jobs: List[Tuple[MAvatarPostureValues, List[MIKProperty]]], properties: Optional[Dict[str, str]] = None) -> Callable[[], List[BatchResult]]:
+        logger.debug("Call to ComputeIKBatch with %i jobs", len(jobs))
+        prepared = [(avatarPval,) + _convertIKProperties(MIKprops) for avatarPval, MIKprops in jobs]
+        return partial(self._computeIKBatch, prepared, properties)
+        
+    def _computeIKBatch(self, jobs, properties: Optional[Dict[str, str]]) -> List[BatchResult]:
+        results = [None] * len(jobs)
+        
+        # jobs by armature, unknown ids share the default armature
+        queues = OrderedDict()
+        for idx, (avatarPval, MIKprops, targets) in enumerate(jobs):
+            avatar_id = avatarPval.AvatarID if avatarPval.AvatarID in self.registry else self.registry.default
+            queues.setdefault(avatar_id, deque()).append(idx)
+        
+        while queues:
+            # more armatures than the registry keeps would evict each other
+            wave = []
+            for avatar_id in list(queues)[:self.registry.capacity]:
+                wave.append((avatar_id, queues[avatar_id].popleft()))
+                if not queues[avatar_id]:
+                    del queues[avatar_id]
+                    
+            scheduler.beginRequest()
+            applied = []
+            for avatar_id, idx in wave:
+                avatarPval, MIKprops, targets = jobs[idx]
+                start = time.perf_counter()
+                try:
+                    app = self.registry.get(avatar_id)
+                    if self._useAnalytic(app, targets, properties):
+                        values, success = app.twoBoneIK.solve(avatarPval.PostureData, targets)
+                        results[idx] = BatchResult(MAvatarPostureValues(AvatarID=avatarPval.AvatarID, 
+                            PostureData=values.tolist()), success, time.perf_counter() - start)
+                        continue
+                    with self.metrics.stage("reset"):
+                        app.disableAllConstraints()
+                        app.resetPose()
+                    with self.metrics.stage("apply"):
+                        app.ApplyMAvatarPostureValues(avatarPval.PostureData)
+                    applied.append((app, idx, time.perf_counter() - start))
+                except Exception as x:
+                    logger.exception("Batch job %i failed", idx)
+                    results[idx] = BatchResult(None, False, time.perf_counter() - start, str(x))
+            
+            # one evaluation for the postures of the whole wave, the targets 
+            # are placed from it
+            scheduler.evaluate(reason="batch wave")
+            started = []
+            for app, idx, elapsed in applied:
+                avatarPval, MIKprops, targets = jobs[idx]
+                start = time.perf_counter()
+                try:
+                    with self.metrics.stage("constraints"):
+                        app.setIKTargets(targets, _heldWrists(MIKprops))
+                    started.append((app, idx, elapsed + time.perf_counter() - start))
+                except Exception as x:
+                    logger.exception("Batch job %i failed", idx)
+                    results[idx] = BatchResult(None, False, elapsed + time.perf_counter() - start, str(x))
+            
+            # the first read evaluates the armatures of the whole wave
+            for app, idx, elapsed in started:
+                avatarPval, MIKprops, targets = jobs[idx]
+                start = time.perf_counter()
+                try:
+                    newAvatarPval = self._readComputeIK(app, avatarPval)
+                    with self.metrics.stage("check"):
+                        success = _reachedTargets(app, targets)
+                    results[idx] = BatchResult(newAvatarPval, success, elapsed + time.perf_counter() - start)
+                except Exception as x:
+                    logger.exception("Batch job %i failed", idx)
+                    results[idx] = BatchResult(None, False, elapsed + time.perf_counter() - start, str(x))
+                    
+            logger.debug("Batch wave of %i jobs done. Depsgraph evaluations: %i", 
+                len(wave), scheduler.endRequest())
+            self.metrics.record("evaluate", scheduler.lastRequestTime)
+            
+        self._IKcounter += len(jobs)
+        return results
+        
+    def _cached(self, key, job: Callable):
+        """Runs the job and caches its result."""
+        result = job()
+        self.cache.put(key, result)
+        return result
+        
+    def _recorded(self, method: str, postureValues: MAvatarPostureValues, targets: List[JointTarget], 
+            job: Callable) -> Callable:
+        """Wraps the job to hand the request and its result to the recorder, if it is sampled."""
+        if self.recorder is None or not self.recorder.sample():
+            return job
+            
+        def recorded():
+            start = time.perf_counter()
+            result = job()
+            if isinstance(result, MIKServiceResult):
+                values, success = result.Posture.PostureData, result.Success.Successful
+            else:
+                values, success = result.PostureData, True
+            self.recorder.add(method, postureValues.AvatarID, postureValues.PostureData, targets, 
+                values, success, time.perf_counter() - start)
+            return result
+        # cached results are still answered without the main thread
+        recorded.completed = getattr(job, "completed", False)
+        return recorded
+        
+    def _cacheOptions(self, properties: Optional[Dict[str, str]]) -> tuple:
+        """Properties which change the result of a request"""
+        properties = properties or {}
+        return (properties.get("Solver", self.solver).lower(), 
+            properties.get(constrainteval.ERROR_NORM, constrainteval.L1).lower(),
+            properties.get(MAX_ITERATIONS), properties.get(TIME_BUDGET), properties.get(TOLERANCE))
+        
+    def _solveBudget(self, properties: Optional[Dict[str, str]]) -> Optional[SolveBudget]:
+        """Budget of an iterative solve, None to solve once. The time budget 
+        starts now, with the arrival of the request."""
+        properties = properties or {}
+        budget = properties.get(TIME_BUDGET)
+        iterations = properties.get(MAX_ITERATIONS)
+        if iterations is not None:
+            iterations = int(iterations)
+        elif budget is not None:
+            iterations = BUDGET_ITERATIONS
+        else:
+            iterations = self.maxIterations
+        if iterations <= 1 and budget is None:
+            return None
+        deadline = time.perf_counter() + float(budget) / 1000. if budget is not None else math.inf
+        return SolveBudget(max(iterations, 1), deadline, float(properties.get(TOLERANCE, self.tolerance)))
+        
+    def _warmStartEnabled(self, properties: Optional[Dict[str, str]]) -> bool:
+        value = (properties or {}).get("WarmStart")
+        if value is None:
+            return self.warmStart
+        return value.lower() not in ("false", "0", "no", "off")
+        
+    def _warmStartMode(self, app: IntermediateSkeletonApplication, postureValues: MAvatarPostureValues, 
+            targets: List[JointTarget], properties: Optional[Dict[str, str]] = None, 
+            checks: Optional[constrainteval.ConstraintSet] = None) -> str:
+        """Returns whether the request can start from the last solution of the armature."""
+        if not self._warmStartEnabled(properties):
+            return warmstart.COLD
+        return warmstart.mode(app.lastSolution, postureValues.AvatarID, postureValues.PostureData, 
+            targets, self.warmStartTolerance, self._solutionOptions(properties, checks))
+        
+    def _keepSolution(self, app: IntermediateSkeletonApplication, postureValues: MAvatarPostureValues, 
+            targets: List[JointTarget], properties: Optional[Dict[str, str]], result, 
+            checks: Optional[constrainteval.ConstraintSet] = None):
+        """Bakes the solution into the armature for the next warm start."""
+        if not self._warmStartEnabled(properties):
+            return
+        solution = result.Posture if isinstance(result, MIKServiceResult) else result
+        app.BakeMAvatarPostureValues(solution.PostureData)
+        app.lastSolution = warmstart.keep(postureValues.AvatarID, solution.PostureData, targets, 
+            result, self._solutionOptions(properties, checks))
+        return
+        
+    def _solutionOptions(self, properties: Optional[Dict[str, str]], 
+            checks: Optional[constrainteval.ConstraintSet]) -> tuple:
+        """Options a repeated solution must share with the request, like the 
+        key of the cache."""
+        return self._cacheOptions(properties) + ((checks.signature(),) if checks is not None else ())
+        
+    def _useAnalytic(self, app: IntermediateSkeletonApplication, targets: List[JointTarget], 
+            properties: Optional[Dict[str, str]] = None) -> bool:
+        """True if the analytic solver is selected and can solve all targets. 
+        Otherwise the request falls back to the blender rig."""
+        solver = (properties or {}).get("Solver", self.solver).lower()
+        if solver != SOLVER_ANALYTIC:
+            return False
+        if not app.twoBoneIK.supports(targets):
+            logger.debug("Analytic solver does not support %s, using blender", 
+                [target.joint_id for target in targets])
+            return False
+        return True
+        
+def _convertJointConstraints(constraints: List[MConstraint]) -> List[JointTarget]:
+    """Targets of the joint constraints, the coordinates of all are converted at once."""
+    joints, geometries = [], []
+    for constraint in constraints:
+        if constraint.JointConstraint is None:
+            continue
+        joint_id = MJointType._VALUES_TO_NAMES.get(constraint.JointConstraint.JointType, "Undefined")
+        if joint_id == "Undefined":
+            raise ValueError("Can't apply JointConstraint to undefined joint")
+        
+        geo = constraint.JointConstraint.GeometryConstraint
+        if geo is None:
+            logger.debug("IK-Service can only apply MGeometryConstraints.")
+            raise ValueError('No GeometryConstraint!')
+        joints.append(joint_id)
+        geometries.append(geo)
     
-    joint_id = MJointType._VALUES_TO_NAMES.get(constraint.JointConstraint.JointType, "Undefined")
-    joint_id = MJointType._VALUES_TO_NAMES.get(constraint.JointConstraint.JointType, "Undefined")
-    if joint_id == "Undefined":
-        raise ValueError("Can't apply JointConstraint to undefined joint")
+    positions = [None] * len(geometries)
+    rotations = [None] * len(geometries)
+    transforms = [idx for idx, geo in enumerate(geometries) if geo.ParentToConstraint is not None]
+    if transforms:
+        transform = [geometries[idx].ParentToConstraint for idx in transforms]
+        for idx, position, rotation in zip(transforms, 
+                Conversion.positions_m2b(Conversion.mvectors_to_array(t.Position for t in transform)),
+                Conversion.quaternions_m2b(Conversion.mquaternions_to_array(t.Rotation for t in transform))):
+            positions[idx] = Vector(position)
+            rotations[idx] = Quaternion(rotation)
     
-    geo = constraint.JointConstraint.GeometryConstraint
-    if geo is None:
-        logger.debug("IK-Service can only apply MGeometryConstraints.")
-        raise ValueError('No GeometryConstraint!')
+    # without a transform, the targets are the centers of the limits
+    translated = [idx for idx, geo in enumerate(geometries) 
+        if geo.ParentToConstraint is None and geo.TranslationConstraint is not None]
+    if translated:
+        centers = Conversion.interval_centers(*Conversion.minterval3s_to_arrays(
+            geometries[idx].TranslationConstraint.Limits for idx in translated))
+        for idx, position in zip(translated, Conversion.positions_m2b(centers)):
+            positions[idx] = Vector(position)
     
-    if geo.ParentToConstraint is not None:
-        logger.debug(geo.ParentToConstraint)
-        pos = geo.ParentToConstraint.Position
-        rot = geo.ParentToConstraint.Rotation
-        avatar.AddPositionConstraint(joint_id, Vector([-pos.X, pos.Y, pos.Z]))
-        avatar.AddRotationConstraint(joint_id, Quaternion([-rot.W, -rot.X, rot.Y, rot.Z]))
-    else:
-        translation = geo.TranslationConstraint
-        if translation is not None:
-            mCenter = convert.interval3Center(translation.Limits)
-            bCenter = convert.vector_m2b(mCenter)
-            avatar.AddPositionConstraint(joint_id, bCenter)
-            
-        rotation = geo.RotationConstraint
-        if rotation is not None:
-            mCenter = convert.interval3Center(rotation.Limits)
-            bCenter = convert.rotation_m2b(mCenter)
-            avatar.AddRotationConstraint(joint_id, bCenter)
+    rotated = [idx for idx, geo in enumerate(geometries) 
+        if geo.ParentToConstraint is None and geo.RotationConstraint is not None]
+    if rotated:
+        centers = Conversion.interval_centers(*Conversion.minterval3s_to_arrays(
+            geometries[idx].RotationConstraint.Limits for idx in rotated))
+        for idx, rotation in zip(rotated, Conversion.euler_rotations_m2b(centers)):
+            rotations[idx] = Quaternion(rotation)
         
+    return [JointTarget(*target) for target in zip(joints, positions, rotations)]
+    
+def _convertIKProperties(MIKprops: List[MIKProperty]) -> Tuple[List[MIKProperty], List[JointTarget]]:
+    # makes sure, that position is set before rotation
+    MIKprops.sort(key=attrgetter('OperationType'))
+    operations = [MIKOperationType._VALUES_TO_NAMES[MIKelement.OperationType] for MIKelement in MIKprops]
+    
+    # the coordinates of all properties are converted at once
+    positions = iter(Conversion.positions_m2b(np.array([MIKelement.Values[:3] 
+        for MIKelement, operation in zip(MIKprops, operations) if operation == 'SetPosition']).reshape(-1, 3)))
+    rotations = iter(Conversion.quaternions_m2b(np.array([MIKelement.Values[:4] 
+        for MIKelement, operation in zip(MIKprops, operations) if operation == 'SetRotation']).reshape(-1, 4)))
+    
+    targets = []
+    for MIKelement, operation in zip(MIKprops, operations):
+        joint_id = MEndeffectorType._VALUES_TO_NAMES[MIKelement.Target]
+        if operation == 'SetPosition':
+            targets.append(JointTarget(joint_id, Vector(next(positions)), None))
+        elif operation == 'SetRotation':
+            targets.append(JointTarget(joint_id, None, Quaternion(next(rotations))))
+        else:
+            targets.append(JointTarget(joint_id, None, None))
+    logger.debug("Asking for %s", targets)
+    return MIKprops, targets
+    
+def _heldWrists(MIKprops: List[MIKProperty]) -> List[str]:
+    """The wrist to hold at its place, if only the other hand is constrained."""
+    hands = {MIKelement.Target for MIKelement in MIKprops}
+    LeftWrist = MEndeffectorType.LeftHand in hands
+    RightWrist = MEndeffectorType.RightHand in hands
+    if LeftWrist and not RightWrist:
+        logger.debug("Only LeftWrist set")
+        return ["RightWrist"]
+    if RightWrist and not LeftWrist:
+        logger.debug("Only RightWrist set")
+        return ["LeftWrist"]
+    logger.debug("Both Wrist set" if LeftWrist else "No Wrist set")
+    return []
+    
+def _reachedTargets(avatar, targets: List[JointTarget]) -> bool:
+    """True if the joints of all position targets are at their target."""
+    for target in targets:
+        effector, offset = avatar.effectorMap.get(target.joint_id, (None, None))
+        if target.position is None or effector not in avatar.bones:
+            continue
+        if (avatar.getJointPosition(effector) - target.position).length > REACHED_TOLERANCE:
+            return False
     return True
     
-def _checkJointConstraint(avatar, constraint: MJointConstraint) -> (bool, float):
+def _shifted(target: JointTarget, offsets: np.ndarray, joints: Dict[str, int]) -> JointTarget:
+    """The target with its position moved against the offset of its joint."""
+    if target.position is None or target.joint_id not in joints:
+        return target
+    return target._replace(position=target.position - Vector(offsets[joints[target.joint_id]]))
     
-    success = 1
-    error = 0.
-    joint_id = MJointType._VALUES_TO_NAMES.get(
-        constraint.JointConstraint.JointType, "Undefined")
+def _applyJointTarget(avatar, target: JointTarget) -> bool:
+    # Add IK constraints to skeleton bones
+    if target.position is not None:
+        avatar.AddPositionConstraint(target.joint_id, target.position)
+    if target.rotation is not None:
+        avatar.AddRotationConstraint(target.joint_id, target.rotation)
+    return True
     
-    geo = constraint.JointConstraint.GeometryConstraint
-    if geo is None: 
-        raise ValueError('No GeometryConstraint!')
+def _jointStates(avatar, joints: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Positions and euler angles (joints, 3) of the joints in MOSIM coordinates."""
+    positions = np.array([avatar.getJointPosition(joint_id) for joint_id in joints]).reshape(-1, 3)
+    rotations = np.array([avatar.getJointRotation(joint_id).to_euler('XZY') for joint_id in joints]).reshape(-1, 3)
+    return Conversion.positions_b2m(positions), Conversion.eulers_b2m(rotations)
     
-    translation = geo.TranslationConstraint
-    if translation is not None:
-        
-        pos = avatar.getJointPosition(joint_id)
-        L1err = check.translationconstraint(
-            convert.bPosition_to_MVector(pos), 
-            translation.Limits, 
-            translation.Type
-        )
-        error = L1err
-        success *= True if L1err==0. else False
-        
-    rotation = geo.RotationConstraint
-    if rotation is not None:
-        bRot = avatar.getJointRotation(joint_id)
-        rot = convert.euler_b2m(bRot.to_euler('XZY'))
-        L1err = check.rotationconstraint(rot, rotation.Limits)
-        success *= True if L1err==0. else False
-        
-    return bool(success), error
+def _analyticJointStates(avatar, values, joints: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Like _jointStates, from posture values instead of the armature."""
+    positions, quaternions = avatar.twoBoneIK.jointStates(values, joints)
+    rotations = np.array([Quaternion(q).to_euler('XZY') for q in quaternions]).reshape(-1, 3)
+    return Conversion.positions_b2m(positions), Conversion.eulers_b2m(rotations)
     
 def _is_applicable(c: MConstraint) -> bool:
     return c.JointConstraint is not None and c.JointConstraint.GeometryConstraint is not None
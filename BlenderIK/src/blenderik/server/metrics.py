@@ -0,0 +1,289 @@
+"""
+Latency histograms and counters of the service.
+
+The stages of a request:
+ - reset        disable the constraints and reset the pose
+ - apply        apply the posture values to the armature
+ - constraints  set up the constraints and move their targets
+ - evaluate     depsgraph evaluations, wherever a step triggered them
+ - readback     solve and read the posture values from the armature
+ - check        compare the solved effectors with their targets
+ - serialization  Thrift (de)serialization of request and response
+
+The other stages do not include the evaluations they trigger. Additionally
+each method of the handler has a histogram of its whole duration and counters
+of its requests and errors.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("reset", "apply", "constraints", "evaluate", "readback", "check", "serialization")
+PERCENTILES = (50., 90., 99.)
+
+class Histogram():
+    """
+    Log-linear histogram of durations in the manner of HdrHistogram.
+
+    The durations are counted in microseconds in buckets of 2^sub_bits
+    linear steps per power of two, so a percentile is reported at most
+    2^(1-sub_bits) above its value (< 2% by default). Recording costs a few
+    integer operations, independent of the number of values.
+    """
+
+    def __init__(self, sub_bits: int = 7, max_seconds: float = 3600.):
+        self.sub_bits  = sub_bits
+        self._half     = 1 << (sub_bits - 1)
+        self._max      = int(max_seconds * 1e6)
+        self._counts   = [0] * (self._index(self._max) + 1)
+        self._lock     = threading.Lock()
+        self.count     = 0
+        self.total     = 0.     # seconds
+        self.max       = 0.     # seconds
+
+    def _index(self, value: int) -> int:
+        shift = value.bit_length() - self.sub_bits
+        if shift <= 0:
+            return value
+        return shift * self._half + (value >> shift)
+
+    def _value(self, index: int) -> int:
+        """Largest value in the bucket <index>."""
+        if index < 2 * self._half:
+            return index
+        shift = index // self._half - 1
+        return ((index - shift * self._half + 1) << shift) - 1
+
+    def record(self, seconds: float):
+        value = min(max(int(seconds * 1e6), 0), self._max)
+        index = self._index(value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+        return
+
+    def percentiles(self, percentiles=PERCENTILES) -> List[float]:
+        """Values (seconds) below which the given percentages of the durations lie."""
+        with self._lock:
+            counts = list(self._counts)
+            count = self.count
+            maximum = self.max
+        results = []
+        index, seen = 0, 0
+        for percentile in sorted(percentiles):
+            rank = max(1, int(count * percentile / 100. + 0.5))
+            while seen < rank and index < len(counts):
+                seen += counts[index]
+                index += 1
+            if count == 0:
+                results.append(0.)
+            else:
+                results.append(min(self._value(index - 1) / 1e6, maximum))
+        return results
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * len(self._counts)
+            self.count = 0
+            self.total = 0.
+            self.max = 0.
+        return
+
+class Metrics():
+    """
+    Histograms of the stages and the methods and counters of the requests.
+
+    Stages are measured with
+
+        with metrics.stage("apply"):
+            ...
+
+    <excluded> returns a clock (seconds) of time which is measured on its own,
+    e.g. the depsgraph evaluations. Its advance during a stage is subtracted.
+    """
+
+    def __init__(self, excluded: Optional[Callable[[], float]] = None):
+        self.excluded   = excluded
+        self.stages     = {name: Histogram() for name in STAGES}
+        self.methods: Dict[str, Histogram] = {}
+        self.requests: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self._lock      = threading.Lock()
+        self._local     = threading.local()
+
+    def stage(self, name: str) -> "_Stage":
+        return _Stage(self, self.stages[name])
+
+    def record(self, name: str, seconds: float):
+        self.stages[name].record(seconds)
+        return
+
+    def request(self, method: str, seconds: float, failed: bool = False):
+        """Counts a finished request of the handler-method <method>."""
+        with self._lock:
+            histogram = self.methods.get(method)
+            if histogram is None:
+                histogram = self.methods[method] = Histogram()
+            self.requests[method] = self.requests.get(method, 0) + 1
+            if failed:
+                self.errors[method] = self.errors.get(method, 0) + 1
+        histogram.record(seconds)
+        # the rest of the thrift-call is (de)serialization, see TimedProtocolFactory
+        self._local.handled = getattr(self._local, "handled", 0.) + seconds
+        return
+
+    def statistics(self) -> Dict[str, float]:
+        """Flat values for GetStatus, durations in ms."""
+        status = {}
+        for prefix, histograms in (("Stage", self.stages), ("Method", dict(self.methods))):
+            for name, histogram in histograms.items():
+                key = prefix + name[0].upper() + name[1:]
+                status[key + "Count"] = histogram.count
+                for percentile, value in zip(PERCENTILES, histogram.percentiles()):
+                    status["%sP%i" % (key, percentile)] = value * 1000.
+                status[key + "Max"] = histogram.max * 1000.
+        for method, count in list(self.requests.items()):
+            status["Requests" + method] = count
+            status["Errors" + method] = self.errors.get(method, 0)
+        return status
+
+    def prometheus(self) -> str:
+        """The metrics in the text format of Prometheus."""
+        lines = []
+        for metric, label, histograms in (
+                ("blenderik_stage_seconds", "stage", self.stages),
+                ("blenderik_request_seconds", "method", dict(self.methods))):
+            lines.append("# TYPE %s summary" % metric)
+            for name, histogram in histograms.items():
+                for percentile, value in zip(PERCENTILES, histogram.percentiles()):
+                    lines.append('%s{%s="%s",quantile="%g"} %.9g' % (metric, label, name,
+                        percentile / 100., value))
+                lines.append('%s_sum{%s="%s"} %.9g' % (metric, label, name, histogram.total))
+                lines.append('%s_count{%s="%s"} %i' % (metric, label, name, histogram.count))
+        for metric, counters in (("blenderik_requests_total", self.requests),
+                ("blenderik_errors_total", self.errors)):
+            lines.append("# TYPE %s counter" % metric)
+            for method, count in list(counters.items()):
+                lines.append('%s{method="%s"} %i' % (metric, method, count))
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        for histogram in list(self.stages.values()) + list(self.methods.values()):
+            histogram.reset()
+        with self._lock:
+            self.requests.clear()
+            self.errors.clear()
+        return
+
+    def _takeHandled(self) -> float:
+        handled, self._local.handled = getattr(self._local, "handled", 0.), 0.
+        return handled
+
+class _Stage():
+    __slots__ = ("_metrics", "_histogram", "_start", "_excluded")
+
+    def __init__(self, metrics: Metrics, histogram: Histogram):
+        self._metrics   = metrics
+        self._histogram = histogram
+
+    def __enter__(self):
+        excluded = self._metrics.excluded
+        self._excluded = excluded() if excluded is not None else 0.
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self._start
+        excluded = self._metrics.excluded
+        if excluded is not None:
+            elapsed -= excluded() - self._excluded
+        self._histogram.record(elapsed)
+        return False
+
+class TimedProtocolFactory():
+    """
+    Wraps the protocol factory of a Thrift-Server to measure the
+    (de)serialization: the time from the begin of a message to the end of its
+    response, less the time of the handler (Metrics.request).
+    """
+
+    def __init__(self, factory, metrics: Metrics):
+        self.factory = factory
+        self.metrics = metrics
+        # the servers read the request and write its response in the same
+        # thread, but not always with the same protocol (TNonblockingServer)
+        self._local  = threading.local()
+
+    def getProtocol(self, trans):
+        protocol = self.factory.getProtocol(trans)
+        metrics = self.metrics
+        local = self._local
+        readMessageBegin = protocol.readMessageBegin
+        writeMessageEnd = protocol.writeMessageEnd
+
+        def timedReadMessageBegin():
+            # blocks until the next request arrives, the clock starts afterwards
+            result = readMessageBegin()
+            metrics._takeHandled()
+            local.start = time.perf_counter()
+            return result
+
+        def timedWriteMessageEnd():
+            writeMessageEnd()
+            start, local.start = getattr(local, "start", None), None
+            if start is not None:
+                metrics.record("serialization", time.perf_counter() - start - metrics._takeHandled())
+            return
+
+        protocol.readMessageBegin = timedReadMessageBegin
+        protocol.writeMessageEnd = timedWriteMessageEnd
+        return protocol
+
+class MetricsEndpoint():
+    """Serves Metrics.prometheus() at http://<address>:<port>/metrics in a background thread."""
+
+    def __init__(self, metrics: Metrics, address: str = "127.0.0.1", port: int = 9464):
+        self.metrics = metrics
+        self.address = address
+        self.port    = port
+        self._server = None
+
+    def start(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("Metrics endpoint: " + format, *args)
+
+        self._server = ThreadingHTTPServer((self.address, self.port), Handler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever, name="MetricsEndpoint",
+            daemon=True)
+        thread.start()
+        logger.info("Metrics at http://%s:%i/metrics", self.address, self.port)
+        return
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        return
@@ -0,0 +1,157 @@
+"""
+Registration of the service at the MMIRegisterService in the background.
+
+The service serves while the registry is not reachable yet. Failed attempts
+are repeated after an exponential backoff with jitter, so many services
+starting at once do not hammer the registry in lockstep. Once registered, the
+registration is renewed every <heartbeat> seconds with the current load in
+the Properties of the MServiceDescription, so the registry can route around
+a saturated instance and re-learns a service it lost, e.g. after its restart.
+"""
+from typing import Callable, Dict, Optional
+import threading
+import logging
+import random
+import copy
+
+# MOSIM-declarations
+from MMIStandard.register import MMIRegisterService
+from MMIStandard.core.ttypes import MServiceDescription
+
+from thrift.transport import TTransport
+
+from .thriftserver import openClient
+
+logger = logging.getLogger(__name__)
+
+class Registrar():
+    """Keeps a service registered at the MMIRegisterService from a background thread."""
+
+    def __init__(self, description: Callable[[], MServiceDescription], host: str, port: int,
+            heartbeat: float = 30., backoff: float = .5, max_backoff: float = 30.,
+            load: Optional[Callable[[], Dict[str, str]]] = None, timeout: float = 5.):
+        """
+        parameters:
+            - description: returns the MServiceDescription to register
+            - host, port: address of the registry
+            - heartbeat: seconds between the renewals, 0 registers once
+            - backoff: seconds before the first repetition of a failed attempt
+            - max_backoff: upper limit of the doubled backoff
+            - load: returns the current load, published in the Properties
+            - timeout: seconds a call to the registry may take
+        """
+        self.description = description
+        self.host        = host
+        self.port        = port
+        self.heartbeat   = heartbeat
+        self.backoff     = backoff
+        self.max_backoff = max_backoff
+        self.load        = load
+        self.timeout     = timeout
+        self.registered  = threading.Event()
+        self.attempts    = 0
+        self.failures    = 0
+        self.sessionID   = None
+        self._connection = None
+        self._stop       = threading.Event()
+        self._thread     = None
+        self._random     = random.Random()
+
+    @property
+    def address(self) -> str:
+        return "%s:%i" % (self.host, self.port)
+
+    def start(self):
+        """Returns at once, the registration runs in the background."""
+        self._thread = threading.Thread(target=self._run, name="Registrar", daemon=True)
+        self._thread.start()
+        return
+
+    def stop(self, unregister: bool = True):
+        """Stops the renewals and unregisters the service, if it was registered."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.timeout + 1.)
+        if unregister and self.registered.is_set():
+            try:
+                self._client().UnregisterService(self.description())
+                logger.info("Unregistered from MMIRegister [%s]", self.address)
+            except Exception:
+                logger.warning("Unregistration at %s failed", self.address, exc_info=True)
+        self._disconnect()
+        return
+
+    def statistics(self) -> Dict[str, object]:
+        return {"Registered": self.registered.is_set(),
+            "RegistrationAttempts": self.attempts, "RegistrationFailures": self.failures}
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            if self._register():
+                failures = 0
+                if self.heartbeat <= 0:
+                    break
+                delay = self.heartbeat
+            else:
+                failures += 1
+                delay = self._delay(failures)
+            self._stop.wait(delay)
+        return
+
+    def _register(self) -> bool:
+        self.attempts += 1
+        description = self.description()
+        if self.load is not None:
+            # the description may be the one of the service
+            description = copy.copy(description)
+            description.Properties = dict(description.Properties or {})
+            description.Properties.update(self.load())
+        try:
+            client = self._client()
+            response = client.RegisterService(description)
+            if not response.Successful:
+                raise RuntimeError("Registration rejected: %s" % (response.LogData,))
+            if self.sessionID is None:
+                self.sessionID = client.CreateSessionID(dict())
+        except (TTransport.TTransportException, OSError) as x:
+            self._failed("Registration Server at %s unreachable: %s", x)
+            return False
+        except Exception as x:
+            self._failed("Registration at %s failed: %s", x)
+            return False
+
+        if not self.registered.is_set():
+            logger.info("Registered successfully at MMIRegister [%s]", self.address)
+            self.registered.set()
+        return True
+
+    def _failed(self, message: str, error: Exception):
+        self.failures += 1
+        # a broken connection is opened anew with the next attempt
+        self._disconnect()
+        if self.registered.is_set():
+            logger.warning("Lost the registration: " + message, self.address, error)
+            self.registered.clear()
+        elif self.failures == 1 or logger.isEnabledFor(logging.DEBUG):
+            logger.warning(message, self.address, error)
+        return
+
+    def _delay(self, failures: int) -> float:
+        """Exponential backoff with jitter: a random value in [d/2, d]."""
+        delay = min(self.max_backoff, self.backoff * 2 ** (failures - 1))
+        return delay * (.5 + .5 * self._random.random())
+
+    def _client(self) -> MMIRegisterService.Client:
+        # the connection is reused for the heartbeats
+        if self._connection is None:
+            transport, client = openClient(MMIRegisterService.Client, self.host, self.port,
+                timeout=self.timeout)
+            self._connection = (transport, client)
+        return self._connection[1]
+
+    def _disconnect(self):
+        if self._connection is not None:
+            self._connection[0].close()
+            self._connection = None
+        return
@@ -0,0 +1,129 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+import threading
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class ResultCache():
+    """
+    LRU-cache for the results of IK-requests with a time to live.
+
+    The key consists of the method, the AvatarID, the posture values and the
+    targets, the values quantized, so requests which differ by less than a
+    quantum share a result. The cache is used from the server threads and the
+    main thread at the same time.
+    """
+
+    def __init__(self, size: int = 1024, ttl: float = 60., posture_quantum: float = 1e-4,
+            target_quantum: float = 1e-3):
+        """
+        parameters:
+            - size: maximum number of results, 0 disables the cache
+            - ttl: seconds a result is valid, 0 for no limit
+            - posture_quantum: resolution of the posture values
+            - target_quantum: resolution of the target positions (m) and rotations
+        """
+        self.size            = size
+        self.ttl             = ttl
+        self.posture_quantum = posture_quantum
+        self.target_quantum  = target_quantum
+        self._entries        = OrderedDict()    # key -> (expiry, result), LRU first
+        self._lock           = threading.Lock()
+
+        self.hits            = 0
+        self.misses          = 0
+        self.expired         = 0
+        self.evictions       = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, method: str, avatar_id: str, values: List[float], targets,
+            options: Tuple = ()) -> Hashable:
+        """
+        parameters:
+            - method: name of the request
+            - avatar_id: AvatarID of the posture
+            - values: posture values
+            - targets: JointTargets in blender coordinates
+            - options: further values changing the result, e.g. the solver
+        """
+        posture = np.round(np.asarray(values, dtype=float) / self.posture_quantum).astype(np.int64)
+        normalized = []
+        for target in targets:
+            position = rotation = None
+            if target.position is not None:
+                position = self._quantize(target.position)
+            if target.rotation is not None:
+                # q and -q are the same rotation
+                q = np.asarray(target.rotation, dtype=float)
+                rotation = self._quantize(-q if q[0] < 0. else q)
+            normalized.append((target.joint_id, position, rotation))
+        return (method, avatar_id, posture.tobytes(), tuple(normalized), options)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Returns the result or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expiry, result = entry
+            if expiry is not None and expiry < time.monotonic():
+                del self._entries[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key: Hashable, result: Any):
+        if not self.enabled:
+            return
+        expiry = time.monotonic() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            self._entries[key] = (expiry, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return
+
+    def clear(self, avatar_id: Optional[str] = None):
+        """Drops the results of the avatar <avatar_id>, by default all results."""
+        with self._lock:
+            if avatar_id is None:
+                if self._entries:
+                    logger.debug("Flushing %i cached results", len(self._entries))
+                self._entries.clear()
+                return
+            stale = [key for key in self._entries 
+                if isinstance(key, tuple) and len(key) > 1 and key[1] == avatar_id]
+            for key in stale:
+                del self._entries[key]
+            if stale:
+                logger.debug("Flushing %i cached results of avatar %s", len(stale), avatar_id)
+        return
+
+    def statistics(self) -> Dict[str, int]:
+        return {
+            "CacheEntries": len(self._entries),
+            "CacheHits": self.hits,
+            "CacheMisses": self.misses,
+            "CacheExpired": self.expired,
+            "CacheEvictions": self.evictions,
+        }
+
+    def _quantize(self, values) -> Tuple[int, ...]:
+        return tuple(int(v) for v in np.round(np.asarray(values, dtype=float) / self.target_quantum))
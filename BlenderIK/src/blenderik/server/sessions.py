@@ -0,0 +1,205 @@
+"""
+Sessions for a delta-encoded transfer of the posture values.
+
+Setup opens a session of the client, with the property "SessionID" under an
+id of its choice, otherwise under a new one. The id is returned in the
+LogData of the response as "SessionID=<id>". The session holds the avatar
+description and the last posture known to both sides.
+
+CalculateIKPosture-properties:
+ - "SessionID":       the session of the request
+ - "PostureEncoding": "full" (default) or "delta"
+                      full: PostureData holds all values, they (re)start the
+                      session, which is opened if it does not exist
+                      delta: PostureData holds the changed channels relative
+                      to the posture of the session as [i0, .., ik, v0, .., vk],
+                      the indices followed by the values
+ - "ResultEncoding":  "full" (default) or "delta", the posture of the result
+                      relative to the posture of the request, as above
+ - "Sequence":        optional number of the request in the session, counting
+                      up from the last full request, to detect lost requests
+
+After a request, the posture of the session is the result as the client
+decodes it. If a delta cannot be applied (unknown session, no posture yet,
+wrong sequence, channels out of range), the request is not solved: the result
+is unsuccessful with RESYNC in its LogData and the client repeats it in full.
+"""
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import threading
+import logging
+import time
+import uuid
+
+import numpy as np
+
+# MOSIM-declarations
+from MMIStandard.avatar.ttypes import MAvatarDescription, MAvatarPostureValues
+from MMIStandard.services.ttypes import MIKServiceResult
+from MMIStandard.core.ttypes import MBoolResponse
+
+logger = logging.getLogger(__name__)
+
+SESSION_ID = "SessionID"
+POSTURE_ENCODING = "PostureEncoding"
+RESULT_ENCODING = "ResultEncoding"
+SEQUENCE = "Sequence"
+FULL = "full"
+DELTA = "delta"
+RESYNC = "ResyncRequired"
+
+class ResyncRequired(Exception):
+    """The delta of a request cannot be applied to its session."""
+
+class Session():
+    __slots__ = ("id", "description", "posture", "sequence", "expiry")
+
+    def __init__(self, session_id: str, description: Optional[MAvatarDescription] = None):
+        self.id          = session_id
+        self.description = description
+        self.posture     = None     # numpy-array of the last posture, None until the first full request
+        self.sequence    = 0
+        self.expiry      = None
+
+class SessionStore():
+    """
+    LRU of the sessions with a time to live. It is used from the server
+    threads, which decode the requests, and the main thread at the same time.
+    The requests of a session are expected one after the other.
+    """
+
+    def __init__(self, capacity: int = 256, ttl: float = 600., tolerance: float = 0.):
+        """
+        parameters:
+            - capacity: maximum number of sessions, 0 disables them
+            - ttl: seconds a session lasts without requests, 0 for no limit
+            - tolerance: result channels changing less are not sent
+        """
+        self.capacity  = capacity
+        self.ttl       = ttl
+        self.tolerance = tolerance
+        self._sessions = OrderedDict()     # id -> Session, LRU first
+        self._lock     = threading.Lock()
+
+        self.resyncs     = 0
+        self.channelsIn  = 0    # channels received in requests
+        self.channelsOut = 0    # channels sent in results
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def open(self, session_id: Optional[str] = None, description: Optional[MAvatarDescription] = None) -> Session:
+        """Opens the session <session_id> (a new id if None), replacing an existing one."""
+        session = Session(session_id or str(uuid.uuid4()), description)
+        with self._lock:
+            self._touch(session)
+            while len(self._sessions) > self.capacity:
+                self._sessions.popitem(last=False)
+        logger.debug("Session %s opened", session.id)
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if session.expiry is not None and session.expiry < time.monotonic():
+                del self._sessions[session_id]
+                return None
+            self._touch(session)
+            return session
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+        return
+
+    def decode(self, postureValues: MAvatarPostureValues, properties: Dict[str, str]) -> Tuple[Session, MAvatarPostureValues]:
+        """Returns the session and the full posture of the request. Raises ResyncRequired."""
+        session_id = properties[SESSION_ID]
+        sequence = properties.get(SEQUENCE)
+        values = np.asarray(postureValues.PostureData, dtype=float)
+        if properties.get(POSTURE_ENCODING, FULL).lower() != DELTA:
+            session = self.get(session_id) or self.open(session_id)
+            session.posture = values
+            session.sequence = int(sequence) if sequence is not None else 0
+            self.channelsIn += len(values)
+            return session, postureValues
+
+        try:
+            session = self.get(session_id)
+            if session is None:
+                raise ResyncRequired("Session %s unknown" % session_id)
+            if session.posture is None:
+                raise ResyncRequired("Session %s has no posture yet" % session_id)
+            expected = session.sequence + 1
+            if sequence is not None and int(sequence) != expected:
+                raise ResyncRequired("Session %s expected request %i, got %s" % (session_id,
+                    expected, sequence))
+            indices, changed = _split(values, len(session.posture))
+        except ResyncRequired:
+            self.resyncs += 1
+            raise
+        posture = session.posture.copy()
+        posture[indices] = changed
+        session.posture = posture
+        session.sequence = expected
+        self.channelsIn += len(indices)
+        return session, MAvatarPostureValues(AvatarID=postureValues.AvatarID, PostureData=posture.tolist())
+
+    def encode(self, session: Session, result: MIKServiceResult, properties: Dict[str, str]) -> MIKServiceResult:
+        """Returns the result in the ResultEncoding of the request. Keeps the
+        result as the posture of the session, <result> itself is not changed
+        (it may be cached)."""
+        values = np.asarray(result.Posture.PostureData, dtype=float)
+        if properties.get(RESULT_ENCODING, FULL).lower() != DELTA or session.posture is None \
+                or len(values) != len(session.posture):
+            session.posture = values
+            self.channelsOut += len(values)
+            return result
+
+        indices = np.flatnonzero(np.abs(values - session.posture) > self.tolerance)
+        posture = session.posture.copy()
+        posture[indices] = values[indices]
+        session.posture = posture
+        self.channelsOut += len(indices)
+        return MIKServiceResult(
+            Posture=MAvatarPostureValues(AvatarID=result.Posture.AvatarID,
+                PostureData=indices.astype(float).tolist() + values[indices].tolist()),
+            Success=result.Success, Error=result.Error)
+
+    def statistics(self) -> Dict[str, int]:
+        return {
+            "Sessions": len(self._sessions),
+            "SessionResyncs": self.resyncs,
+            "SessionChannelsIn": self.channelsIn,
+            "SessionChannelsOut": self.channelsOut,
+        }
+
+    def _touch(self, session: Session):
+        session.expiry = time.monotonic() + self.ttl if self.ttl > 0 else None
+        self._sessions[session.id] = session
+        self._sessions.move_to_end(session.id)
+        return
+
+def resyncResult(avatar_id: str, reason: str) -> MIKServiceResult:
+    """Unsuccessful result asking the client to repeat the request in full."""
+    return MIKServiceResult(Posture=MAvatarPostureValues(AvatarID=avatar_id, PostureData=[]),
+        Success=MBoolResponse(Successful=False, LogData=[RESYNC, reason]), Error=[])
+
+def encodeDelta(indices, values) -> List[float]:
+    """PostureData of a delta, for clients."""
+    return [float(idx) for idx in indices] + [float(value) for value in values]
+
+def _split(data: np.ndarray, width: int) -> Tuple[np.ndarray, np.ndarray]:
+    if len(data) % 2:
+        raise ResyncRequired("Delta of odd length %i" % len(data))
+    count = len(data) // 2
+    indices = data[:count].astype(np.int64)
+    if np.any(indices != data[:count]) or np.any(indices < 0) or np.any(indices >= width):
+        raise ResyncRequired("Delta with invalid channels")
+    return indices, data[count:]
@@ -0,0 +1,461 @@
+from pathlib import Path
+from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import subprocess
+import threading
+import logging
+import shutil
+import socket
+import queue
+import json
+import time
+import os
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Blender-Imports
+import bpy
+
+# MOSIM-declarations
+from MMIStandard.services import MInverseKinematicsService
+from MMIStandard.avatar.ttypes import MAvatarDescription
+from MMIStandard.core.ttypes import MIPAddress, MBoolResponse, MServiceDescription
+
+from thrift.transport import TTransport
+from thrift.protocol.TProtocol import TProtocolException
+
+from .registrar import Registrar
+from .thriftserver import ServerOptions, createServer, openClient
+from . import batch
+
+logger = logging.getLogger(__name__)
+
+# read by __main__.py from the working directory
+CONFIG_FILES = ("description.json", "service.config")
+
+class Worker():
+    """
+    A headless Blender process running the IK-Service with its own copy of
+    the blend-file. The worker is only reachable by the supervisor and does
+    not register itself.
+    """
+
+    def __init__(self, index: int, address: str, port: int, directory: Path,
+            script: Path, threads: int = 1, cpus: Optional[List[int]] = None,
+            server_options: ServerOptions = ServerOptions()):
+        """
+        parameters:
+            - index: number of the worker
+            - address, port: where the worker serves
+            - directory: working directory with the copy of the resources
+            - script: __main__.py of the service
+            - threads: number of threads blender may use internally
+            - cpus: cpus the process is pinned to, None for no pinning
+            - server_options: ServerOptions of the worker's Thrift-Server
+        """
+        self.index     = index
+        self.address   = address
+        self.port      = port
+        self.directory = directory
+        self.script    = script
+        self.threads   = threads
+        self.cpus      = cpus
+        self.options   = server_options
+        self.process   = None
+        self.restarts  = 0
+        self._clients  = queue.LifoQueue()   # idle connections
+
+    def __str__(self):
+        return "Worker%i" % self.index
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    @property
+    def memory(self) -> int:
+        """Resident memory in bytes, 0 if unknown"""
+        if psutil is None or not self.alive:
+            return 0
+        try:
+            return psutil.Process(self.process.pid).memory_info().rss
+        except psutil.Error:
+            return 0
+
+    def prepare(self, blendfile: Path, resources: List[Path]):
+        """Copies the blend-file with the resources next to it and the 
+        configuration of the service into the working directory."""
+        resources_dir = self.directory/"resources"
+        resources_dir.mkdir(parents=True, exist_ok=True)
+        for resource in [blendfile] + list(resources):
+            shutil.copy2(resource, resources_dir/resource.name)
+        for name in CONFIG_FILES:
+            if Path(name).exists():
+                shutil.copy2(name, self.directory/name)
+        return
+
+    def start(self, blendfile_name: str):
+        command = [
+            bpy.app.binary_path,
+            str(self.directory/"resources"/blendfile_name),
+            "--background",
+            "--threads", str(self.threads),
+            "--python", str(self.script),
+            "--", "worker", "--address", "%s:%i" % (self.address, self.port)
+        ]
+        logger.info("Starting %s: %s", self, " ".join(command))
+        self.process = subprocess.Popen(command, cwd=str(self.directory),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if self.cpus:
+            _pin(self.process.pid, self.cpus)
+        return
+
+    def stop(self, timeout: float = 10.):
+        self._dropClients()
+        if not self.alive:
+            return
+        logger.info("Stopping %s", self)
+        self.process.terminate()
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        return
+
+    def waitReady(self, timeout: float) -> bool:
+        """Waits until the worker accepts connections."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.alive:
+                return False
+            try:
+                with socket.create_connection((self.address, self.port), timeout=1.):
+                    return True
+            except OSError:
+                time.sleep(.5)
+        return False
+
+    def call(self, method: str, *args):
+        """Calls <method> of the worker's service. Connections are reused."""
+        try:
+            transport, client = self._clients.get_nowait()
+        except queue.Empty:
+            transport, client = self._connect()
+
+        broken = False
+        try:
+            return getattr(client, method)(*args)
+        except (TTransport.TTransportException, TProtocolException):
+            # the worker is gone or the stream is out of step, the connection is useless
+            broken = True
+            transport.close()
+            raise
+        finally:
+            # application errors leave the connection usable
+            if not broken:
+                self._clients.put((transport, client))
+
+    def _connect(self):
+        return openClient(MInverseKinematicsService.Client, self.address, self.port, self.options)
+
+    def _dropClients(self):
+        while not self._clients.empty():
+            transport, _ = self._clients.get_nowait()
+            transport.close()
+        return
+
+class Supervisor():
+    """
+    Runs a pool of Blender workers behind one Thrift endpoint.
+
+    Requests are dispatched with AvatarID affinity: all requests of an avatar
+    go to the same worker, so its scaled armature is reused. New avatars are
+    assigned to the worker with the fewest avatars. Workers which crash or
+    exceed the memory limit are restarted and the Setups of their avatars are
+    repeated.
+    """
+
+    def __init__(self, description: MServiceDescription, script: Path,
+            workers: int, threads: int = 1, pinning: bool = False,
+            max_memory: int = 0, directory: Path = Path("workers"),
+            resources: List[Path] = (), check_interval: float = 5.,
+            startup_timeout: float = 120., server_options: ServerOptions = ServerOptions()):
+        """
+        parameters:
+            - description: MServiceDescription of the service
+            - script: __main__.py of the service
+            - workers: number of worker processes
+            - threads: number of threads blender may use in each worker
+            - pinning: pin each worker to cpus of its own
+            - max_memory: restart workers above this resident memory (MB), 0 to disable
+            - directory: working directories of the workers
+            - resources: further files the blend-file needs (postures)
+            - check_interval: seconds between the health checks
+            - startup_timeout: seconds a worker may need to start
+            - server_options: ServerOptions of the supervisor and the workers,
+                              which read them from the same configuration
+        """
+        self.description     = description
+        self.max_memory      = max_memory * 2**20
+        self.check_interval  = check_interval
+        self.startup_timeout = startup_timeout
+        self.blendfile       = Path(bpy.data.filepath)
+        self.resources       = list(resources)
+        self.server          = None
+        self.serverOptions   = server_options
+        self.ip              = None
+        self.port            = None
+        self.registrar       = None
+
+        if max_memory and psutil is None:
+            logger.warning("psutil not installed: the memory of the workers is not supervised")
+
+        cpus = _cpuSlices(workers) if pinning else [None] * workers
+        self.workers = [
+            Worker(idx, "127.0.0.1", 0, Path(directory).resolve()/("worker%i" % idx),
+                Path(script).resolve(), threads, cpus[idx], server_options)
+            for idx in range(workers)
+        ]
+
+        self._affinity  = {}            # AvatarID -> worker index
+        self._setups    = {}            # AvatarID -> (MAvatarDescription, properties)
+        self._lock      = threading.Lock()
+        self._restart   = [threading.Lock() for _ in self.workers]
+        self._running   = False
+
+    def init_thrift(self, address, port, nthreads=None):
+        nthreads = nthreads or 2 * len(self.workers)
+        logger.info("Initalizing Supervisor at %s::%i with %i workers.", address, port, len(self.workers))
+        processor = MInverseKinematicsService.Processor(DispatchHandler(self))
+        self.server = createServer(processor, address, port, self.serverOptions._replace(threads=nthreads))
+        self.ip = address
+        self.port = port
+        self.description.Addresses = [MIPAddress(Address=address, Port=port)]
+        for idx, worker in enumerate(self.workers):
+            worker.port = port + 1 + idx
+        return
+
+    def register(self, registry_host, registry_port, heartbeat=30., max_backoff=30.):
+        # the pool is one service to the outside
+        self.registrar = Registrar(lambda: self.description, registry_host, registry_port,
+            heartbeat=heartbeat, max_backoff=max_backoff, load=self.load)
+        self.registrar.start()
+        self.launcherAddress = MIPAddress(Address=registry_host, Port=registry_port)
+        return
+
+    def load(self) -> Dict[str, str]:
+        """Load published by the registrar."""
+        with self._lock:
+            avatars = len(self._affinity)
+        return {"Workers": str(sum(worker.alive for worker in self.workers)), "Avatars": str(avatars)}
+
+    def start(self):
+        """Starts the workers and serves until interrupted."""
+        if self.server is None:
+            logger.error("Can't start supervisor; need to initialize first!")
+            return
+
+        for worker in self.workers:
+            worker.prepare(self.blendfile, self.resources)
+            worker.start(self.blendfile.name)
+        for worker in self.workers:
+            if not worker.waitReady(self.startup_timeout):
+                logger.error("%s did not start within %is", worker, self.startup_timeout)
+
+        self._running = True
+        threading.Thread(target=self._monitor, name="Supervisor", daemon=True).start()
+        try:
+            logger.info('Supervisor running')
+            self.server.serve()
+        finally:
+            self._running = False
+            if self.registrar is not None:
+                self.registrar.stop()
+            for worker in self.workers:
+                worker.stop()
+        return
+
+    def status(self) -> Dict[str, str]:
+        status = {"Running": "True", "Workers": str(len(self.workers))}
+        with self._lock:
+            avatars = [list(self._affinity.values()).count(idx) for idx in range(len(self.workers))]
+        for worker in self.workers:
+            status[str(worker)] = "%s, pid %s, avatars %i, restarts %i, memory %iMB" % (
+                "running" if worker.alive else "down",
+                worker.process.pid if worker.process else "-",
+                avatars[worker.index], worker.restarts, worker.memory // 2**20)
+        if self.registrar is not None:
+            status.update({key: str(value) for key, value in self.registrar.statistics().items()})
+        return status
+
+    def workerFor(self, avatar_id: Optional[str]) -> Worker:
+        """Returns the worker of the avatar, assigns new avatars to the least used worker."""
+        with self._lock:
+            idx = self._affinity.get(avatar_id)
+            if idx is None:
+                load = [0] * len(self.workers)
+                for assigned in self._affinity.values():
+                    load[assigned] += 1
+                idx = load.index(min(load))
+                if avatar_id is not None:
+                    self._affinity[avatar_id] = idx
+                    logger.debug("Avatar %s assigned to %s", avatar_id, self.workers[idx])
+        return self.workers[idx]
+
+    def rememberSetup(self, avatar_id: str, description: MAvatarDescription, properties: Dict[str, str]):
+        with self._lock:
+            self._setups[avatar_id] = (description, properties)
+        return
+
+    def dispatch(self, avatar_id: Optional[str], method: str, *args):
+        """Calls <method> on the worker of the avatar. A dead worker is
+        restarted and the call is repeated once."""
+        return self.dispatchTo(self.workerFor(avatar_id), method, *args)
+
+    def dispatchTo(self, worker: Worker, method: str, *args):
+        try:
+            return worker.call(method, *args)
+        except TTransport.TTransportException:
+            logger.warning("%s failed during %s", worker, method)
+            self.restart(worker)
+            return worker.call(method, *args)
+
+    def restart(self, worker: Worker):
+        with self._restart[worker.index]:
+            if worker.alive and worker.waitReady(1.):
+                # restarted by another thread in the meantime
+                return
+            worker.stop()
+            worker.restarts += 1
+            worker.start(self.blendfile.name)
+            if not worker.waitReady(self.startup_timeout):
+                logger.error("%s did not start within %is", worker, self.startup_timeout)
+                return
+            self._replaySetups(worker)
+        return
+
+    def _replaySetups(self, worker: Worker):
+        with self._lock:
+            setups = [setup for avatar_id, setup in self._setups.items()
+                if self._affinity.get(avatar_id) == worker.index]
+        for description, properties in setups:
+            worker.call("Setup", description, properties)
+        return
+
+    def _monitor(self):
+        while self._running:
+            time.sleep(self.check_interval)
+            for worker in self.workers:
+                if not self._running:
+                    break
+                if not worker.alive:
+                    logger.warning("%s crashed with exit code %s", worker, worker.process.returncode)
+                elif self.max_memory and worker.memory > self.max_memory:
+                    logger.warning("%s exceeds the memory limit (%iMB)", worker, worker.memory // 2**20)
+                else:
+                    continue
+                try:
+                    self.restart(worker)
+                except Exception:
+                    logger.exception("Restart of %s failed", worker)
+        return
+
+class DispatchHandler():
+    """Handler of the supervisor's Thrift-Processor. Forwards the calls to the workers."""
+
+    def __init__(self, supervisor: Supervisor):
+        self.supervisor = supervisor
+
+    def GetStatus(self) -> Dict[str, str]:
+        return self.supervisor.status()
+
+    def GetDescription(self) -> MServiceDescription:
+        return self.supervisor.description
+
+    def Setup(self, description: MAvatarDescription, properties: Dict[str, str]) -> MBoolResponse:
+        avatar_id = description.AvatarID if description is not None else None
+        if avatar_id is not None:
+            self.supervisor.rememberSetup(avatar_id, description, properties)
+        return self.supervisor.dispatch(avatar_id, "Setup", description, properties)
+
+    def Consume(self, properties: Dict[str, str]) -> Dict[str, str]:
+        if properties.get("Method") == batch.METHOD:
+            return self._consumeBatch(properties)
+        return self.supervisor.dispatch(properties.get("AvatarID"), "Consume", properties)
+
+    def _consumeBatch(self, properties: Dict[str, str]) -> Dict[str, str]:
+        """Splits the batch by the workers of the avatars and solves the 
+        parts in parallel."""
+        start = time.perf_counter()
+        try:
+            jobs = batch.loadJobs(properties)
+        except (KeyError, ValueError) as x:
+            logger.error("Call to Consume: invalid batch, %s", x)
+            return batch.invalidRequest(x)
+        groups = {}     # worker -> job indices
+        for idx, job in enumerate(jobs):
+            groups.setdefault(self.supervisor.workerFor(job.get("AvatarID")), []).append(idx)
+
+        def solve(worker, indices):
+            part = dict(properties, Jobs=json.dumps([jobs[idx] for idx in indices]))
+            return self.supervisor.dispatchTo(worker, "Consume", part)
+
+        with ThreadPoolExecutor(max_workers=len(groups) or 1) as pool:
+            responses = {worker: pool.submit(solve, worker, indices) for worker, indices in groups.items()}
+
+        results = [None] * len(jobs)
+        for worker, indices in groups.items():
+            response = responses[worker].result()
+            if "Results" in response:
+                for idx, result in zip(indices, json.loads(response["Results"])):
+                    results[idx] = result
+                continue
+            # the worker refused the whole part, e.g. {"Successful": "False", "Error": ...}
+            error = response.get("Error", "%s answered without results" % worker)
+            logger.error("Batch part of %i jobs failed on %s: %s", len(indices), worker, error)
+            for idx in indices:
+                results[idx] = {"AvatarID": jobs[idx].get("AvatarID"), "PostureData": [], 
+                    "Success": False, "Time": 0., "Error": error}
+        return {
+            "Successful": str(all(result["Success"] for result in results)),
+            "Results": json.dumps(results),
+            "Time": str((time.perf_counter() - start) * 1000.),
+        }
+
+    def CalculateIKPosture(self, postureValues, constraints, properties):
+        return self.supervisor.dispatch(postureValues.AvatarID,
+            "CalculateIKPosture", postureValues, constraints, properties)
+
+    def ComputeIK(self, avatarPval, MIKprops):
+        return self.supervisor.dispatch(avatarPval.AvatarID, "ComputeIK", avatarPval, MIKprops)
+
+    def __getattr__(self, name):
+        # further methods of the interface
+        return lambda *args: self.supervisor.dispatch(None, name, *args)
+
+def _cpuSlices(workers: int) -> List[List[int]]:
+    """Distributes the available cpus evenly over the workers."""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    if len(cpus) < workers:
+        return [[cpus[idx % len(cpus)]] for idx in range(workers)]
+    size = len(cpus) // workers
+    return [cpus[idx*size:(idx+1)*size] for idx in range(workers)]
+
+def _pin(pid: int, cpus: List[int]):
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(pid, cpus)
+        elif psutil is not None:
+            psutil.Process(pid).cpu_affinity(cpus)
+        else:
+            logger.warning("CPU-pinning needs psutil on this platform")
+    except (OSError, AttributeError) as x:
+        logger.warning("CPU-pinning of %i failed: %s", pid, x)
+    return
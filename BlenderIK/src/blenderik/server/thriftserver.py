@@ -0,0 +1,178 @@
+"""
+Thrift-Servers of the service, selected by the option "serverMode":
+
+ - threadpool   TThreadPoolServer, one thread per connected client, buffered
+                or framed transport
+ - nonblocking  TNonblockingServer, one thread selects on all connections,
+                <threads> workers process the complete frames
+ - asyncio      AsyncioServer, the connections are coroutines of an event
+                loop, <threads> workers process the complete frames
+
+The latter two need the framed transport on the client side. Idle connections
+cost no thread there, the workers only wait for the main thread while a
+request is in flight. Clients of the service should be created with
+openClient, so they match the server.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+import threading
+import logging
+import asyncio
+import struct
+
+from thrift.transport import TSocket
+from thrift.transport import TTransport
+from thrift.protocol import TCompactProtocol
+from thrift.server import TServer
+
+logger = logging.getLogger(__name__)
+
+SERVER_MODES = ("threadpool", "nonblocking", "asyncio")
+
+class ServerOptions(NamedTuple):
+    mode: str = "threadpool"
+    threads: int = 4            # threads of the pool, workers of the other modes
+    framed: bool = False        # framed transport, always for nonblocking and asyncio
+    accelerated: bool = False   # TCompactProtocolAccelerated, if thrift is built with it
+
+    @property
+    def isFramed(self) -> bool:
+        return self.framed or self.mode != "threadpool"
+
+def protocolFactory(options: ServerOptions):
+    if options.accelerated:
+        return TCompactProtocol.TCompactProtocolAcceleratedFactory(fallback=True)
+    return TCompactProtocol.TCompactProtocolFactory()
+
+def transportFactory(options: ServerOptions):
+    if options.isFramed:
+        return TTransport.TFramedTransportFactory()
+    return TTransport.TBufferedTransportFactory()
+
+def createServer(processor, address: str, port: int, options: ServerOptions, protocol_factory=None):
+    """
+    Server of <processor> at <address>:<port>. <protocol_factory> replaces
+    the one of the options, e.g. to wrap it (metrics.TimedProtocolFactory).
+    """
+    if options.mode not in SERVER_MODES:
+        raise ValueError("Unknown server mode %s, use one of %s" % (options.mode, ", ".join(SERVER_MODES)))
+    if protocol_factory is None:
+        protocol_factory = protocolFactory(options)
+    if options.accelerated and not _accelerated():
+        logger.warning("thrift is built without the accelerated protocol: using the pure Python one")
+
+    if options.mode == "threadpool":
+        server = TServer.TThreadPoolServer(processor, TSocket.TServerSocket(host=address, port=port),
+            transportFactory(options), protocol_factory)
+        server.setNumThreads(options.threads)
+    elif options.mode == "nonblocking":
+        from thrift.server.TNonblockingServer import TNonblockingServer
+        server = TNonblockingServer(processor, TSocket.TServerSocket(host=address, port=port),
+            protocol_factory, protocol_factory, threads=options.threads)
+    else:
+        server = AsyncioServer(processor, address, port, protocol_factory, options.threads)
+    return server
+
+def openClient(client_class, address: str, port: int, options: ServerOptions = ServerOptions(),
+        timeout: Optional[float] = None):
+    """Opens a connection matching a server with <options>, returns (transport, client).
+    <timeout> limits each socket operation (seconds)."""
+    socket = TSocket.TSocket(address, port)
+    if timeout is not None:
+        socket.setTimeout(timeout * 1000.)
+    if options.isFramed:
+        transport = TTransport.TFramedTransport(socket)
+    else:
+        transport = TTransport.TBufferedTransport(socket)
+    if options.accelerated:
+        protocol = TCompactProtocol.TCompactProtocolAccelerated(transport, fallback=True)
+    else:
+        protocol = TCompactProtocol.TCompactProtocol(transport)
+    client = client_class(protocol)
+    transport.open()
+    return transport, client
+
+def _accelerated() -> bool:
+    try:
+        from thrift.protocol import fastbinary
+    except ImportError:
+        return False
+    return True
+
+class AsyncioServer():
+    """
+    Thrift-Server on an asyncio event loop with framed transport.
+
+    Every connection is a coroutine reading frames. A complete frame is
+    processed by one of <threads> workers, which decode the request, wait for
+    the handler and encode the response; the coroutine writes it back. The
+    requests of a connection are answered in order, as the clients wait for
+    each response anyway.
+    """
+
+    def __init__(self, processor, address: str, port: int, protocol_factory, threads: int = 4,
+            max_frame: int = 256 * 2**20):
+        self.processor        = processor
+        self.address          = address
+        self.port             = port
+        self.protocol_factory = protocol_factory
+        self.max_frame        = max_frame
+        self.connections      = 0
+        self._pool            = ThreadPoolExecutor(threads, thread_name_prefix="ThriftWorker")
+        self._loop            = None
+        self._stopped         = threading.Event()
+
+    def serve(self):
+        """Serves until stop() is called. Blocks the calling thread."""
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        server = self._loop.run_until_complete(
+            asyncio.start_server(self._connection, self.address, self.port))
+        try:
+            if not self._stopped.is_set():
+                self._loop.run_forever()
+        finally:
+            server.close()
+            self._loop.run_until_complete(server.wait_closed())
+            self._loop.close()
+            self._pool.shutdown(wait=False)
+        return
+
+    def stop(self):
+        """May be called from any thread."""
+        self._stopped.set()
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        return
+
+    async def _connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                size, = struct.unpack("!i", await reader.readexactly(4))
+                if size < 0 or size > self.max_frame:
+                    logger.warning("Frame of %i bytes from %s, closing the connection", size,
+                        writer.get_extra_info("peername"))
+                    break
+                frame = await reader.readexactly(size)
+                response = await self._loop.run_in_executor(self._pool, self._process, frame)
+                if response:
+                    # oneway calls have no response
+                    writer.write(struct.pack("!i", len(response)) + response)
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # the client closed the connection
+            pass
+        except Exception:
+            logger.exception("Connection to %s failed", writer.get_extra_info("peername"))
+        finally:
+            self.connections -= 1
+            writer.close()
+        return
+
+    def _process(self, frame: bytes) -> bytes:
+        input = TTransport.TMemoryBuffer(frame)
+        output = TTransport.TMemoryBuffer()
+        self.processor.process(self.protocol_factory.getProtocol(input),
+            self.protocol_factory.getProtocol(output))
+        return output.getvalue()
@@ -0,0 +1,139 @@
+from collections import deque
+from datetime import datetime
+from typing import Any, Optional, Tuple
+import logging.handlers
+import threading
+import logging
+import queue
+import time
+
+logger = logging.getLogger(__name__)
+
+# records of the tracer, handled in a thread of their own
+trace_logger = logging.getLogger("blenderik.trace")
+
+class _Lazy():
+    """Formats the arguments of a request only when the record is written."""
+
+    def __init__(self, args: Tuple):
+        self.args = args
+
+    def __str__(self):
+        return ", ".join(repr(arg) for arg in self.args)
+
+class _Trace():
+    __slots__ = ("number", "method", "start")
+
+    def __init__(self, number: int, method: str):
+        self.number = number
+        self.method = method
+        self.start  = time.perf_counter()
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler which leaves the formatting to the listener thread."""
+
+    def prepare(self, record):
+        return record
+
+class RequestTracer():
+    """
+    Traces the requests of the service.
+
+    Every <sample_every>-th request is written with its arguments, result and
+    duration to the logger "blenderik.trace". The records are queued and
+    formatted by a background thread, so the requests only pay for an append
+    to the queue. Independent of the sampling, the last <ring_size> requests
+    are kept (unformatted) and written when a request fails.
+    """
+
+    def __init__(self, sample_every: int = 0, ring_size: int = 32):
+        """
+        parameters:
+            - sample_every: trace every n-th request, 0 disables the sampling
+            - ring_size: number of requests kept for error dumps, 0 disables it
+        """
+        self.sample_every = sample_every
+        self._ring        = deque(maxlen=ring_size)
+        self._counter     = 0
+        self._lock        = threading.Lock()
+        self._listener    = None
+        self._handler     = None
+        self._propagate   = trace_logger.propagate
+
+    @property
+    def ring_size(self) -> int:
+        return self._ring.maxlen
+
+    def configure(self, sample_every: Optional[int] = None, ring_size: Optional[int] = None):
+        """Changes the tracing at runtime."""
+        if sample_every is not None:
+            self.sample_every = sample_every
+        if ring_size is not None and ring_size != self._ring.maxlen:
+            with self._lock:
+                self._ring = deque(self._ring, maxlen=ring_size)
+        logger.info("Tracing every %i. request, keeping %i requests for errors",
+            self.sample_every, self.ring_size)
+        return
+
+    def start(self, *handlers: logging.Handler):
+        """
+        Starts the background thread writing the traces to <handlers>, by
+        default to the handlers of the root logger.
+        """
+        if self._listener is not None:
+            return
+        records = queue.SimpleQueue()
+        handlers = handlers or tuple(logging.getLogger().handlers)
+        self._listener = logging.handlers.QueueListener(records, *handlers,
+            respect_handler_level=True)
+        self._handler = _DeferredQueueHandler(records)
+        trace_logger.addHandler(self._handler)
+        trace_logger.setLevel(logging.INFO)
+        self._propagate = trace_logger.propagate
+        trace_logger.propagate = False
+        self._listener.start()
+        return
+
+    def stop(self):
+        """Writes the queued traces and detaches the tracer from the logger."""
+        if self._listener is not None:
+            # no further records are queued once the listener stopped
+            trace_logger.removeHandler(self._handler)
+            trace_logger.propagate = self._propagate
+            self._handler = None
+            self._listener.stop()
+            self._listener = None
+        return
+
+    def begin(self, method: str, args: Tuple) -> Optional[_Trace]:
+        """
+        Registers a request. Returns a trace for end(), if the request is
+        sampled, otherwise None.
+        """
+        with self._lock:
+            self._counter += 1
+            number = self._counter
+            if self._ring.maxlen:
+                self._ring.append((datetime.now(), number, method, args))
+
+        if self.sample_every <= 0 or number % self.sample_every:
+            return None
+        trace_logger.info("Request %i %s(%s)", number, method, _Lazy(args))
+        return _Trace(number, method)
+
+    def end(self, trace: Optional[_Trace], result: Any = None):
+        if trace is None:
+            return
+        trace_logger.info("Request %i %s done in %.3f ms: %r", trace.number, trace.method,
+            (time.perf_counter() - trace.start) * 1000., result)
+        return
+
+    def failed(self, method: str, error: BaseException):
+        """Writes the kept requests after a failed request."""
+        with self._lock:
+            requests = list(self._ring)
+        trace_logger.error("%s failed: %r. The last %i requests:", method, error, len(requests))
+        for timestamp, number, name, args in requests:
+            trace_logger.error("Request %i at %s %s(%s)", number, timestamp.isoformat(), name,
+                _Lazy(args))
+        return
@@ -0,0 +1,70 @@
+"""
+Warm start of the blender solver from the previous solution of an avatar.
+It is opt-in: IKService(warm_start=True), the option warmStart of the
+config, or the property "WarmStart" of a request.
+
+After a solve, the solution is baked into the pose of the armature and the
+constraints stay active. The next request of the avatar is then
+
+ - a repeat, if its posture is the last solution and neither its targets
+   nor its options (properties, limits of the constraints) changed: the
+   last result is returned without touching blender.
+ - warm, if its posture is the last solution and the same effectors are
+   constrained: only the targets are moved, the solver starts from the
+   last solution.
+ - cold otherwise: reset, apply posture, set up constraints.
+
+The solution is dropped (IntermediateSkeletonApplication.lastSolution) as soon
+as anything else changes the armature: disableAllConstraints, resetPose,
+scaling, reloading the file, or an error during the solve.
+"""
+from typing import Any, Hashable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+REPEAT = "repeat"
+WARM   = "warm"
+COLD   = "cold"
+
+class Solution(NamedTuple):
+    avatar_id: str
+    values: np.ndarray          # posture values baked into the armature
+    effectors: Tuple            # (joint_id, position?, rotation?) of the targets
+    targets: np.ndarray         # target positions and rotations
+    result: Any                 # response of the request
+    options: Hashable = ()      # everything else the result depends on
+
+def keep(avatar_id: str, values: List[float], targets, result, options: Hashable = ()) -> Solution:
+    return Solution(avatar_id, np.asarray(values, dtype=float), _effectors(targets), 
+        _targetValues(targets), result, options)
+
+def mode(solution: Optional[Solution], avatar_id: str, values: List[float], targets, 
+        tolerance: float, options: Hashable = ()) -> str:
+    """Returns how a request can start from the last solution. Other options 
+    than those of the last solution rule out a repeat."""
+    if solution is None or solution.avatar_id != avatar_id or solution.effectors != _effectors(targets):
+        return COLD
+
+    values = np.asarray(values, dtype=float)
+    if values.shape != solution.values.shape or np.max(np.abs(values - solution.values), initial=0.) > tolerance:
+        return COLD
+
+    if np.max(np.abs(_targetValues(targets) - solution.targets), initial=0.) <= tolerance \
+            and solution.options == options:
+        return REPEAT
+    return WARM
+
+def _effectors(targets) -> Tuple:
+    return tuple((target.joint_id, target.position is not None, target.rotation is not None)
+        for target in targets)
+
+def _targetValues(targets) -> np.ndarray:
+    values = []
+    for target in targets:
+        if target.position is not None:
+            values.extend(target.position)
+        if target.rotation is not None:
+            # q and -q are the same rotation
+            rotation = np.asarray(target.rotation, dtype=float)
+            values.extend(-rotation if rotation[0] < 0. else rotation)
+    return np.array(values, dtype=float)
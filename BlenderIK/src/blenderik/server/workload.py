@@ -0,0 +1,96 @@
+"""
+Requests of the IK service built from targets in blender coordinates, e.g.
+to replay a recording of server.ikrecorder. Does not need blender, so the
+load test can use it as well.
+"""
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+import math
+
+import numpy as np
+
+from BlenderMMI.PoseMath import quaternions_to_matrices
+from BlenderMMI import Conversion
+from server.ikrecorder import RecordingReader, METHODS
+
+# MOSIM-declarations
+from MMIStandard.services.ttypes import MIKProperty, MIKOperationType
+from MMIStandard.avatar.ttypes import MAvatarPostureValues, MEndeffectorType, MJointType
+from MMIStandard.constraints.ttypes import (MConstraint, MJointConstraint, MGeometryConstraint,
+    MTranslationConstraint, MTranslationConstraintType, MRotationConstraint, MInterval, MInterval3)
+from MMIStandard.math.ttypes import MTransform, MVector3, MQuaternion
+
+class Request(NamedTuple):
+    method: str             # "ComputeIK" or "CalculateIKPosture"
+    name: str
+    args: Tuple
+    # (joint, position in blender coordinates) of the position targets
+    goals: List[Tuple[str, np.ndarray]]
+
+def toMosim(position) -> List[float]:
+    return Conversion.positions_b2m(position).tolist()
+
+def ikProperties(effector: str, position: Optional[np.ndarray], rotation: Optional[np.ndarray]) -> List[MIKProperty]:
+    """MIKProperties of <effector> (MEndeffectorType) with the position and rotation
+    in blender coordinates, None or NaN if not set."""
+    props = []
+    target = MEndeffectorType._NAMES_TO_VALUES[effector]
+    if _isSet(position):
+        props.append(MIKProperty(Values=toMosim(position), Weight=1., Target=target,
+            OperationType=MIKOperationType._NAMES_TO_VALUES['SetPosition']))
+    if _isSet(rotation):
+        props.append(MIKProperty(Values=Conversion.quaternions_b2m(rotation).tolist(), Weight=1.,
+            Target=target, OperationType=MIKOperationType._NAMES_TO_VALUES['SetRotation']))
+    return props
+
+def jointConstraint(joint: str, position: Optional[np.ndarray], rotation: Optional[np.ndarray],
+        parent: str = "") -> MConstraint:
+    """MConstraint of <joint> (MJointType) with the position and rotation in
+    blender coordinates, None or NaN if not set."""
+    geometry = MGeometryConstraint(ParentObjectID=parent)
+    if _isSet(position) and _isSet(rotation):
+        geometry.ParentToConstraint = MTransform(ID=joint,
+            Position=MVector3(**dict(zip("XYZ", toMosim(position)))),
+            Rotation=MQuaternion(**dict(zip("XYZW", Conversion.quaternions_b2m(rotation).tolist()))))
+    elif _isSet(position):
+        geometry.TranslationConstraint = MTranslationConstraint(
+            Type=MTranslationConstraintType._NAMES_TO_VALUES['BOX'], Limits=_interval3(toMosim(position)))
+    elif _isSet(rotation):
+        geometry.RotationConstraint = MRotationConstraint(Limits=_interval3(_eulerMosim(rotation)))
+    return MConstraint(ID=joint, JointConstraint=MJointConstraint(
+        JointType=MJointType._NAMES_TO_VALUES[joint], GeometryConstraint=geometry))
+
+def fromRecord(record: np.void, name: str = "") -> Request:
+    """Request of a record of server.ikrecorder."""
+    method = METHODS[record["method"]]
+    posture = MAvatarPostureValues(AvatarID=record["avatar"].decode("utf-8"),
+        PostureData=record["posture"].tolist())
+    targets = [(record["joints"][slot].decode("utf-8"), record["positions"][slot],
+        record["rotations"][slot]) for slot in range(record["targets"])]
+    if method == "ComputeIK":
+        args = (posture, [prop for target in targets for prop in ikProperties(*target)])
+    else:
+        args = (posture, [jointConstraint(*target) for target in targets], {})
+    goals = [(joint, np.array(position)) for joint, position, rotation in targets if _isSet(position)]
+    return Request(method, name, args, goals)
+
+def fromRecording(directory, limit: Optional[int] = None) -> Iterator[Request]:
+    """Requests of a recording, at most <limit>."""
+    for idx, record in enumerate(RecordingReader(directory).records()):
+        if limit is not None and idx >= limit:
+            break
+        yield fromRecord(record, "record/%i" % idx)
+
+def _isSet(values) -> bool:
+    return values is not None and not np.isnan(values).any()
+
+def _interval3(values) -> MInterval3:
+    x, y, z = (float(value) for value in values)
+    return MInterval3(X=MInterval(Min=x, Max=x), Y=MInterval(Min=y, Max=y), Z=MInterval(Min=z, Max=z))
+
+def _eulerMosim(rotation) -> Tuple[float, float, float]:
+    """Inverse of Conversion.euler_rotations_m2b, which builds R = Ry(-e1) Rx(e0) Rz(-e2)."""
+    m = quaternions_to_matrices(np.asarray(rotation, dtype=float))
+    x = math.asin(max(-1., min(1., -m[1, 2])))
+    y = math.atan2(m[0, 2], m[2, 2])
+    z = math.atan2(m[1, 0], m[1, 1])
+    return x, -y, -z
@@ -1,2 +1,17 @@
 from tests.test_intermediateskeletonapplication import TestIntermediateSkeletonApplication
-from tests.test_ikservice import TestIKService
\ No newline at end of file
+from tests.test_ikservice import TestIKService
+from tests.test_channelcodec import TestChannelCodec
+from tests.test_executor import TestMainThreadExecutor
+from tests.test_twoboneik import TestTwoBoneIK
+from tests.test_resultcache import TestResultCache
+from tests.test_tracing import TestRequestTracer
+from tests.test_metrics import TestMetrics
+from tests.test_bench import TestBenchmark
+from tests.test_ikrecorder import TestIKRecorder
+from tests.test_thriftserver import TestThriftServer
+from tests.test_sessions import TestSessionStore
+from tests.test_rigsnapshot import TestRigSnapshotCache
+from tests.test_registrar import TestRegistrar
+from tests.test_constrainteval import TestConstraintEval
+from tests.test_conversion import TestConversion
+from tests.test_skeletonformat import TestSkeletonFormat
@@ -0,0 +1,34 @@
+import unittest
+import bpy
+from pathlib import Path
+import copy
+import json
+
+from BlenderMMI.MAvatarPostureGenerator import JSON2MAvatarPosture
+from server.bench import Benchmark, compare
+
+RESOURCES = Path(bpy.data.filepath).parent # not so clean!
+
+class TestBenchmark(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._m_avatar_posture = JSON2MAvatarPosture(RESOURCES/"intermediate.mos")
+        with RESOURCES.joinpath('PostureValueCases.json').open() as file:
+            cls._posture_value_cases = json.load(file)
+            
+    def test_run(self):
+        benchmark = Benchmark(self._m_avatar_posture, avatars=2)
+        benchmark.addCases({'tpose': self._posture_value_cases['tpose']}, targets=1)
+        report = benchmark.run(iterations=1, warmup=0)
+        
+        self.assertEqual(set(report["entrypoints"]), {"ComputeIK", "CalculateIKPosture"})
+        self.assertEqual(set(report["avatars"]), {"bench0", "bench1"})
+        self.assertIn("readback", report["stages"])
+        for accuracy in report["accuracy"].values():
+            self.assertGreater(accuracy["count"], 0)
+        self.assertEqual(compare(report, report), [])
+        
+        slower = copy.deepcopy(report)
+        slower["entrypoints"]["ComputeIK"]["p99"] *= 2.
+        self.assertEqual(len(compare(slower, report)), 1)
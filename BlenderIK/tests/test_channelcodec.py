@@ -0,0 +1,68 @@
+import unittest
+import bpy
+from pathlib import Path
+import random
+
+import MMIStandard.avatar.ttypes as tavatar
+from BlenderMMI.ChannelCodec import ChannelCodec
+from BlenderMMI.MAvatarPostureGenerator import JSON2MAvatarPosture
+
+RESOURCES = Path(bpy.data.filepath).parent # not so clean!
+
+class TestChannelCodec(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._m_avatar_posture = JSON2MAvatarPosture(RESOURCES/"intermediate.mos")
+        
+    def setUp(self):
+        self.codec = ChannelCodec(self._m_avatar_posture)
+        
+    def test_size(self):
+        channels = sum(len(joint.Channels) for joint in self._m_avatar_posture.Joints)
+        self.assertEqual(self.codec.size, channels)
+        
+    def test_roundtrip(self):
+        values = [random.uniform(-1., 1.) for _ in range(self.codec.size)]
+        locations, rotations = self.codec.decode(values)
+        for value, expected in zip(self.codec.encode(locations, rotations), values):
+            self.assertAlmostEqual(value, expected)
+            
+    def test_handedness(self):
+        """Compare with the per-channel transform (x,y,z) -> (-x,y,z) and 
+        (w,x,y,z) -> (-w,-x,y,z)"""
+        values = [random.uniform(-1., 1.) for _ in range(self.codec.size)]
+        locations, rotations = self.codec.decode(values)
+        i = 0
+        for idx, joint in enumerate(self._m_avatar_posture.Joints):
+            for channel in joint.Channels:
+                expected = {
+                    tavatar.MChannel.XOffset:   -locations[idx][0],
+                    tavatar.MChannel.YOffset:    locations[idx][1],
+                    tavatar.MChannel.ZOffset:    locations[idx][2],
+                    tavatar.MChannel.WRotation: -rotations[idx][0],
+                    tavatar.MChannel.XRotation: -rotations[idx][1],
+                    tavatar.MChannel.YRotation:  rotations[idx][2],
+                    tavatar.MChannel.ZRotation:  rotations[idx][3],
+                }[channel]
+                self.assertAlmostEqual(values[i], expected)
+                i += 1
+                
+    def test_identity_without_channels(self):
+        locations, rotations = self.codec.decode([0.] * self.codec.size)
+        idx = self.codec.jointIndex['HeadTip']
+        self.assertEqual(list(rotations[idx]), [1., 0., 0., 0.])
+        self.assertEqual(list(locations[idx]), [0., 0., 0.])
+
+    def test_rotation_mask(self):
+        """The quaternion components (w, x, y, z) of the rotation channels"""
+        components = {tavatar.MChannel.WRotation: 0, tavatar.MChannel.XRotation: 1,
+            tavatar.MChannel.YRotation: 2, tavatar.MChannel.ZRotation: 3}
+        for joint in self._m_avatar_posture.Joints:
+            expected = [False] * 4
+            for channel in joint.Channels:
+                if channel in components:
+                    expected[components[channel]] = True
+            self.assertEqual(list(self.codec.rotationMask(joint.ID)), expected, joint.ID)
+            self.assertEqual(self.codec.hasRotation(joint.ID), any(expected))
+        self.assertEqual(self.codec.rotationMask('unknown'), (False,) * 4)
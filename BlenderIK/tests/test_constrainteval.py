@@ -0,0 +1,123 @@
+import unittest
+from math import pi, sqrt
+
+import numpy as np
+
+from server.constrainteval import ConstraintSet, ellipsoidExcess, angleExcess, ELLIPSOID, BOX
+from server import check
+
+from MMIStandard.avatar.ttypes import MJointType
+from MMIStandard.constraints.ttypes import (MConstraint, MJointConstraint, MGeometryConstraint,
+    MTranslationConstraint, MRotationConstraint, MInterval, MInterval3)
+
+def _interval3(lo, hi):
+    return MInterval3(*(MInterval(Min=l, Max=h) for l, h in zip(lo, hi)))
+
+def _constraint(joint, translation=None, shape=BOX, rotation=None):
+    geometry = MGeometryConstraint(ParentObjectID="")
+    if translation is not None:
+        geometry.TranslationConstraint = MTranslationConstraint(Type=shape, Limits=_interval3(*translation))
+    if rotation is not None:
+        geometry.RotationConstraint = MRotationConstraint(Limits=_interval3(*rotation))
+    return MConstraint(ID=joint, JointConstraint=MJointConstraint(
+        JointType=MJointType._NAMES_TO_VALUES[joint], GeometryConstraint=geometry))
+
+class TestConstraintEval(unittest.TestCase):
+
+    def setUp(self):
+        self.constraints = [
+            _constraint("RightWrist", ((0., 0., 0.), (1., 1., 1.))),
+            MConstraint(ID="none"),
+            _constraint("LeftWrist", ((-1., -2., -3.), (1., 2., 3.)), shape=ELLIPSOID),
+            _constraint("RightWrist", rotation=((-.1, -.1, -.1), (.1, .1, .1))),
+        ]
+        self.checks = ConstraintSet(self.constraints, "both")
+
+    def test_single(self):
+        self.assertEqual(self.checks.joints, ["RightWrist", "LeftWrist"])
+        positions = np.array([(2., 0.5, -1.), (0., 0., 6.)])
+        rotations = np.array([(0., 0.3, 0.), (0., 0., 0.)])
+        l1, l2 = self.checks.evaluate(positions, rotations)
+
+        # box: outside by 1 in x and z
+        self.assertAlmostEqual(l1[0], 2.)
+        self.assertAlmostEqual(l2[0], sqrt(2.))
+        self.assertTrue(np.isnan(l1[1]) and np.isnan(l2[1]))
+        # ellipsoid: the closest point on the z-axis is the pole
+        self.assertAlmostEqual(l1[2], 3.)
+        self.assertAlmostEqual(l2[2], 3.)
+        self.assertAlmostEqual(l1[3], .2)
+
+        errors = self.checks.errors(positions, rotations)
+        self.assertEqual(len(errors), 2 * len(self.constraints))
+        self.assertAlmostEqual(errors[4], sqrt(2.))
+
+    def test_batch(self):
+        rng = np.random.default_rng(0)
+        positions = rng.uniform(-4., 4., (5, 7, 2, 3))
+        rotations = rng.uniform(-pi, pi, (5, 7, 2, 3))
+        residuals = self.checks.evaluate(positions, rotations)
+        self.assertEqual(residuals.l1.shape, (5, 7, 4))
+        single = self.checks.evaluate(positions[3, 2], rotations[3, 2])
+        np.testing.assert_allclose(residuals.l1[3, 2], single.l1)
+
+        inside = self.checks.evaluate(np.array([(.5, .5, .5), (0., 0., 0.)]), np.zeros((2, 3)))
+        self.assertTrue(inside.satisfied())
+        self.assertEqual(inside.l1[0], 0.)
+
+    def test_translationExcess(self):
+        positions = np.array([[(2., 0.5, -1.), (0., 0., 6.)], [(.5, .5, .5), (0., 0., 0.)]])
+        excess = self.checks.translationExcess(positions)
+        self.assertEqual(excess.shape, (2, 2, 3))
+        np.testing.assert_allclose(excess[0], [(1., 0., -1.), (0., 0., 3.)], atol=1e-9)
+        np.testing.assert_array_equal(excess[1], 0.)
+        # moved against the excess, the joints satisfy the translations
+        moved = self.checks.evaluate(positions[0] - excess[0], np.zeros((2, 3)))
+        self.assertAlmostEqual(moved.l1[0], 0.)
+        self.assertAlmostEqual(moved.l1[2], 0.)
+
+    def test_ellipsoid(self):
+        semi = np.array([1., 2., 3.])
+        points = np.random.default_rng(1).uniform(-6., 6., (200, 3))
+        excess = ellipsoidExcess(points, semi)
+        surface = points - excess
+        outside = np.sum((points / semi) ** 2, axis=-1) > 1.
+        # the closest points lie on the surface, the excess is normal to it
+        np.testing.assert_allclose(np.sum((surface[outside] / semi) ** 2, axis=-1), 1., atol=1e-9)
+        normal = surface[outside] / semi ** 2
+        cross = np.cross(normal, excess[outside])
+        np.testing.assert_allclose(cross, 0., atol=1e-6)
+        np.testing.assert_array_equal(excess[~outside], 0.)
+        # an unbounded axis is not constrained
+        np.testing.assert_allclose(ellipsoidExcess(np.array([0., 0., 10.]), np.array([1., 1., np.inf])), 0.)
+
+    def test_angles(self):
+        lo, hi = np.array([-.1, 3., -np.inf]), np.array([.1, 3.2, 0.])
+        excess = angleExcess(np.array([2. * pi + .2, -3., 5.]), lo, hi)
+        np.testing.assert_allclose(excess, [.1, 2. * pi - 6.2, 0.], atol=1e-12)
+
+    def test_signature(self):
+        """Order, shapes and limits of the constraints tell sets apart."""
+        self.assertEqual(self.checks.signature(), ConstraintSet(list(self.constraints), "both").signature())
+        reordered = ConstraintSet(self.constraints[::-1], "both")
+        self.assertNotEqual(self.checks.signature(), reordered.signature())
+        # same center, other limits
+        wider = list(self.constraints)
+        wider[0] = _constraint("RightWrist", ((-1., -1., -1.), (2., 2., 2.)))
+        self.assertNotEqual(self.checks.signature(), ConstraintSet(wider, "both").signature())
+        box = list(self.constraints)
+        box[2] = _constraint("LeftWrist", ((-1., -2., -3.), (1., 2., 3.)), shape=BOX)
+        self.assertNotEqual(self.checks.signature(), ConstraintSet(box, "both").signature())
+
+    def test_check(self):
+        limits = _interval3((-1., -2., -3.), (1., 2., 3.))
+        self.assertAlmostEqual(check.translationconstraint((0., 0., 6.), limits, 'ELLIPSOID'), 3.)
+        self.assertEqual(check.translationconstraint((0., 1., 2.), limits, 'ELLIPSOID'), 0.)
+        self.assertAlmostEqual(check.translationconstraint((2., 0., 0.), limits, 0), 1.)
+        with self.assertRaises(ValueError):
+            check.translationconstraint((0., 0., 0.), limits, 'SPHERE')
+        with self.assertRaises(ValueError):
+            ConstraintSet(self.constraints, "L3")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import random
+from math import inf
+
+import numpy as np
+from mathutils import Vector, Euler
+
+from BlenderMMI import Conversion
+from BlenderMMI.MAvatarPostureGenerator import MVector2Vector, MQuaternion2Quaternion
+from server import convert
+
+from MMIStandard.math.ttypes import MVector3, MQuaternion
+from MMIStandard.constraints.ttypes import MInterval, MInterval3
+
+class TestConversion(unittest.TestCase):
+    """Parity of the vectorized conversion with the scalar functions of server.convert."""
+
+    COUNT = 50
+
+    def setUp(self):
+        self.random = np.random.default_rng(7)
+        self.vectors = self.random.uniform(-2., 2., (self.COUNT, 3))
+        quaternions = self.random.normal(size=(self.COUNT, 4))
+        self.quaternions = quaternions / np.linalg.norm(quaternions, axis=-1, keepdims=True)
+        self.eulers = self.random.uniform(-3., 3., (self.COUNT, 3))
+
+    def test_positions(self):
+        converted = Conversion.positions_m2b(self.vectors)
+        for vector, expected in zip(self.vectors, converted):
+            np.testing.assert_allclose(convert.vector_m2b(vector), expected)
+            np.testing.assert_allclose(convert.bPosition_to_MVector(Vector(expected)), vector)
+        np.testing.assert_allclose(Conversion.positions_b2m(converted), self.vectors)
+
+        mvectors = [MVector3(*vector) for vector in self.vectors]
+        np.testing.assert_allclose(Conversion.positions_m2b(Conversion.mvectors_to_array(mvectors)),
+            [MVector2Vector(v) for v in mvectors])
+
+    def test_quaternions(self):
+        mquaternions = [MQuaternion(*q) for q in self.quaternions]
+        converted = Conversion.quaternions_m2b(Conversion.mquaternions_to_array(mquaternions))
+        np.testing.assert_allclose(converted, [MQuaternion2Quaternion(q) for q in mquaternions])
+        np.testing.assert_allclose(Conversion.quaternions_b2m(converted), self.quaternions)
+
+    def test_eulers(self):
+        converted = Conversion.eulers_b2m(self.eulers)
+        for euler, expected in zip(self.eulers, converted):
+            np.testing.assert_allclose(convert.euler_b2m(Euler(euler, 'XZY')), expected)
+            np.testing.assert_allclose(convert.euler_m2b(expected), euler)
+        np.testing.assert_allclose(Conversion.eulers_m2b(converted), self.eulers)
+
+    def test_rotations(self):
+        converted = Conversion.euler_rotations_m2b(self.eulers)
+        self.assertEqual(converted.shape, (self.COUNT, 4))
+        for euler, expected in zip(self.eulers, converted):
+            np.testing.assert_allclose(convert.rotation_m2b(euler), expected, atol=1e-6)
+        # batch dimensions
+        np.testing.assert_allclose(Conversion.euler_rotations_m2b(self.eulers.reshape(5, -1, 3)),
+            converted.reshape(5, -1, 4))
+
+    def test_intervals(self):
+        bounds = [(-1., 1.), (0.5, 0.5), (2., inf), (-inf, -3.), (-inf, inf)]
+        intervals = [MInterval3(*(MInterval(*random.choice(bounds)) for axis in range(3)))
+            for idx in range(self.COUNT)]
+        centers = Conversion.interval_centers(*Conversion.minterval3s_to_arrays(intervals))
+        for interval, expected in zip(intervals, centers):
+            np.testing.assert_allclose(convert.interval3Center(interval), expected)
+
+        for lo, hi in ((1., 0.), (inf, inf), (float('nan'), 0.)):
+            with self.assertRaises(ValueError):
+                Conversion.interval_centers(np.array([lo]), np.array([hi]))
+
+if __name__ == '__main__':
+    unittest.main()
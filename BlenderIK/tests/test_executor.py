@@ -0,0 +1,64 @@
+import unittest
+import threading
+
+from server.executor import MainThreadExecutor, MainThreadHandler
+
+class _Handler():
+    def __init__(self):
+        self.threads = []
+        
+    def Solve(self, value):
+        self.threads.append(threading.current_thread())
+        if value < 0:
+            raise ValueError("negative")
+        return value * 2
+        
+    def Convert(self, value):
+        return self._prepareConvert(value)()
+        
+    def _prepareConvert(self, value):
+        self.threads.append(threading.current_thread())
+        return lambda: self.Solve(value + 1)
+
+class TestMainThreadExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = MainThreadExecutor()
+        self.handler = _Handler()
+        self.proxy = MainThreadHandler(self.handler, self.executor)
+        
+    def _runClients(self, *calls):
+        results = [None] * len(calls)
+        def client(idx, call):
+            try:
+                results[idx] = call()
+            except Exception as x:
+                results[idx] = x
+        threads = [threading.Thread(target=client, args=(idx, call)) 
+            for idx, call in enumerate(calls)]
+        for thread in threads:
+            thread.start()
+        def stop():
+            for thread in threads:
+                thread.join()
+            self.executor.shutdown()
+        threading.Thread(target=stop).start()
+        self.executor.run()
+        return results
+        
+    def test_jobs_run_in_calling_thread(self):
+        results = self._runClients(*[lambda i=i: self.proxy.Solve(i) for i in range(8)])
+        self.assertEqual(results, [i * 2 for i in range(8)])
+        self.assertEqual(set(self.handler.threads), {threading.current_thread()})
+        self.assertEqual(self.executor.processed, 8)
+        
+    def test_prepare_runs_in_server_thread(self):
+        results = self._runClients(lambda: self.proxy.Convert(1))
+        self.assertEqual(results, [4])
+        prepare, solve = self.handler.threads
+        self.assertIsNot(prepare, threading.current_thread())
+        self.assertIs(solve, threading.current_thread())
+        
+    def test_exception_is_forwarded(self):
+        results = self._runClients(lambda: self.proxy.Solve(-1))
+        self.assertIsInstance(results[0], ValueError)
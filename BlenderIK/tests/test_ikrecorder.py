@@ -0,0 +1,77 @@
+import unittest
+import tempfile
+import os
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from server.ikrecorder import IKRecorder, RecordingReader
+
+class _Target(NamedTuple):
+    joint_id: str
+    position: Optional[Tuple[float, float, float]]
+    rotation: Optional[Tuple[float, float, float, float]]
+
+class TestIKRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._dir = tempfile.TemporaryDirectory()
+        os.chdir(self._dir.name)
+        
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._dir.cleanup()
+        
+    def _record(self, recorder, count, width=10):
+        for idx in range(count):
+            if recorder.sample():
+                recorder.add("ComputeIK" if idx % 2 else "CalculateIKPosture", "avatar%i" % idx,
+                    [float(idx)] * width, [_Target("RightHand", (1., 2., 3.), None)], 
+                    [idx + .5] * width, True, 1e-3)
+        
+    def test_roundtrip(self):
+        recorder = IKRecorder("recording", segment_records=4)
+        self._record(recorder, 10)
+        recorder.close()
+        self.assertEqual(recorder.count, 10)
+        
+        reader = RecordingReader("recording")
+        self.assertEqual(len(reader.segments), 3)
+        self.assertEqual(len(reader), 10)
+        records = list(reader.records("ComputeIK"))
+        self.assertEqual(len(records), 5)
+        record = records[0]
+        self.assertEqual(record["avatar"], b"avatar1")
+        np.testing.assert_array_equal(record["posture"], [1.] * 10)
+        np.testing.assert_array_equal(record["result"], [1.5] * 10)
+        self.assertEqual(record["targets"], 1)
+        self.assertEqual(record["joints"][0], b"RightHand")
+        np.testing.assert_array_equal(record["positions"][0], [1., 2., 3.])
+        self.assertTrue(np.isnan(record["rotations"][0]).all())
+        
+    def test_continue(self):
+        """A new recorder appends after the highest segment, even with gaps."""
+        recorder = IKRecorder("recording", segment_records=4)
+        self._record(recorder, 8)
+        recorder.close()
+        os.remove(os.path.join("recording", "segment_000000.ikr"))
+        recorder = IKRecorder("recording", segment_records=4)
+        self._record(recorder, 2)
+        recorder.close()
+        self.assertEqual(sorted(os.listdir("recording")), ["segment_000001.ikr", "segment_000002.ikr"])
+        self.assertEqual(len(RecordingReader("recording")), 6)
+        
+    def test_sampling(self):
+        recorder = IKRecorder("recording", sample_every=3)
+        self._record(recorder, 9)
+        recorder.close()
+        self.assertEqual(len(RecordingReader("recording")), 3)
+        
+    def test_width(self):
+        recorder = IKRecorder("recording")
+        self._record(recorder, 2, width=10)
+        self._record(recorder, 2, width=12)
+        recorder.close()
+        shapes = [records["posture"].shape for records in RecordingReader("recording")]
+        self.assertEqual(shapes, [(2, 10), (2, 12)])
@@ -6,6 +6,7 @@ from math import pi
 
 from BlenderMMI.MAvatarPostureGenerator import JSON2MAvatarPosture
 from server.ikservice import IKService
+from BlenderMMI.SceneUpdateScheduler import scheduler
 import MMIStandard.services.ttypes as tservice
 import MMIStandard.scene.ttypes as tscene
 import MMIStandard.mmu.ttypes as tmmu
@@ -32,6 +33,67 @@ class TestIKService(unittest.TestCase):
         props = [tservice.MIKProperty(Values=[1., 1., 1.], Weight=1., Target=righthand, OperationType=0)]
         result = self.adapter.ComputeIK(posture, props)
         
+    def test_ComputeIKBatch(self):
+        """A batch returns the same postures as single calls, in order."""
+        righthand = tscene.MEndeffectorType._NAMES_TO_VALUES['RightHand']
+        tpose = self._posture_value_cases['tpose']
+        jobs = [
+            (tscene.MAvatarPostureValues(AvatarID='lalala', PostureData=tpose), 
+             [tservice.MIKProperty(Values=[x, 1., 0.3], Weight=1., Target=righthand, OperationType=0)])
+            for x in (0.2, 0.3, 0.4)
+        ]
+        expected = [self.adapter.ComputeIK(*job).PostureData for job in jobs]
+        results = self.adapter.ComputeIKBatch(jobs)
+        
+        self.assertEqual(len(results), len(jobs))
+        for result, values in zip(results, expected):
+            self.assertEqual(result.error, "")
+            self.assertGreaterEqual(result.time, 0.)
+            for value, single in zip(result.posture.PostureData, values):
+                self.assertAlmostEqual(value, single, places=4)
+        
+    def test_ComputeIKBatch_evaluations(self):
+        """A wave of several avatars costs two depsgraph evaluations."""
+        righthand = tscene.MEndeffectorType._NAMES_TO_VALUES['RightHand']
+        tpose = self._posture_value_cases['tpose']
+        avatars = ['lalala']
+        for name in ('second', 'third'):
+            posture = JSON2MAvatarPosture(RESOURCES/"intermediate.mos")
+            posture.AvatarID = name
+            self.adapter.SetAvatar(posture)
+            avatars.append(name)
+        jobs = [
+            (tscene.MAvatarPostureValues(AvatarID=avatar_id, PostureData=tpose), 
+             [tservice.MIKProperty(Values=[0.3, 1., 0.3], Weight=1., Target=righthand, OperationType=0)])
+            for avatar_id in avatars
+        ]
+        results = self.adapter.ComputeIKBatch(jobs)
+        self.assertTrue(all(result.error == "" for result in results))
+        self.assertEqual(scheduler.lastRequest, 2)
+        
+    def test_warm_start(self):
+        """Continuing from the own result reuses the solution."""
+        righthand = tscene.MEndeffectorType._NAMES_TO_VALUES['RightHand']
+        props = [tservice.MIKProperty(Values=[0.3, 1., 0.3], Weight=1., Target=righthand, OperationType=0)]
+        tpose = tscene.MAvatarPostureValues(AvatarID='lalala', 
+            PostureData=self._posture_value_cases['tpose'])
+        self.adapter.ComputeIK(tpose, props)
+        self.assertIsNone(self.adapter.app.lastSolution, "warm start is opt-in")
+        
+        self.adapter.warmStart = True
+        first = self.adapter.ComputeIK(tpose, props)
+        self.assertIsNotNone(self.adapter.app.lastSolution)
+        
+        repeat = self.adapter.ComputeIK(first, props)
+        self.assertEqual(repeat.PostureData, first.PostureData)
+        
+        props[0].Values = [0.31, 1., 0.3]
+        moved = self.adapter.ComputeIK(first, props)
+        self.assertNotEqual(moved.PostureData, first.PostureData)
+        
+        self.adapter.app.disableAllConstraints()
+        self.assertIsNone(self.adapter.app.lastSolution)
+        
     def test_CalculateIKPosture(self):
         posture = tscene.MAvatarPostureValues(AvatarID='lalala', 
             PostureData=self._posture_value_cases['tpose'])
@@ -63,4 +125,22 @@ class TestIKService(unittest.TestCase):
         constraints = [
             tmmu.MConstraint(ID='Whatever', JointConstraint=jointconstraint)
         ]
-        self.adapter.CalculateIKPosture(posture, constraints, {})
\ No newline at end of file
+        result = self.adapter.CalculateIKPosture(posture, constraints, {})
+        self.assertEqual(len(result.Error), 1)
+        self.assertGreaterEqual(result.Error[0], 0.)
+        
+        result = self.adapter.CalculateIKPosture(posture, constraints, {"ErrorNorm": "both"})
+        self.assertEqual(len(result.Error), 2)
+        self.assertLessEqual(result.Error[1], result.Error[0])
+        
+        iterative = self.adapter.CalculateIKPosture(posture, constraints, 
+            {"MaxIterations": "4", "TimeBudget": "1000"})
+        self.assertEqual(len(iterative.Error), 1)
+        self.assertLessEqual(iterative.Error[0], result.Error[0] + 1e-9)
+        self.assertTrue(iterative.Success.LogData[0].startswith("Iterations="))
+        
+        # the last solution with the same targets, but other options, is solved again
+        repeat = self.adapter.CalculateIKPosture(iterative.Posture, constraints, {"ErrorNorm": "both"})
+        self.assertEqual(len(repeat.Error), 2)
+        repeat = self.adapter.CalculateIKPosture(repeat.Posture, constraints, {"MaxIterations": "2"})
+        self.assertTrue(repeat.Success.LogData[0].startswith("Iterations="))
@@ -1,10 +1,14 @@
 import unittest
 import bpy
 from pathlib import Path
+import tempfile
 import json
 
+import numpy as np
+
 from BlenderMMI.IntermediateSkeletonApplication import IntermediateSkeletonApplication
 from BlenderMMI.MAvatarPostureGenerator import JSON2MAvatarPosture
+from BlenderMMI.RigSnapshot import RigSnapshotCache
 
 RESOURCES = Path(bpy.data.filepath).parent # not so clean!
 
@@ -32,6 +36,19 @@ class TestIntermediateSkeletonApplication(unittest.TestCase):
         for value, tpose in zip(pose, self._posture_value_cases['tpose']):
             self.assertAlmostEqual(value, tpose)
         
+    def test_RigSnapshot(self):
+        """A skeleton scaled from the snapshot equals the one scaled from the posture"""
+        with tempfile.TemporaryDirectory() as directory:
+            snapshots = RigSnapshotCache(directory, bpy.data.filepath)
+            scaled = IntermediateSkeletonApplication("lalala", self._m_avatar_posture, snapshots)
+            self.assertEqual(snapshots.misses, 1)
+            loaded = IntermediateSkeletonApplication("lalala", self._m_avatar_posture, snapshots)
+            self.assertEqual(snapshots.hits, 1)
+        np.testing.assert_allclose(loaded._baseStack, scaled._baseStack, atol=1e-5)
+        pose = loaded.ReadMAvatarPostureValues()
+        for value, tpose in zip(pose, self._posture_value_cases['tpose']):
+            self.assertAlmostEqual(value, tpose)
+        
     def test_AddPositionConstraint(self):
         pass
         
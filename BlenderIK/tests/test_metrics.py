@@ -0,0 +1,41 @@
+import unittest
+import random
+
+from server.metrics import Histogram, Metrics
+
+class TestMetrics(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = Histogram()
+        values = [random.expovariate(200.) for _ in range(10000)]
+        for value in values:
+            histogram.record(value)
+        values.sort()
+        for percentile, value in zip((50, 90, 99), histogram.percentiles()):
+            exact = values[int(len(values) * percentile / 100.)]
+            self.assertAlmostEqual(value, exact, delta=exact * 0.02 + 2e-6)
+        self.assertEqual(histogram.max, values[-1])
+        self.assertEqual(histogram.count, len(values))
+        
+    def test_empty(self):
+        self.assertEqual(Histogram().percentiles(), [0., 0., 0.])
+        
+    def test_excluded(self):
+        clock = [0.]
+        metrics = Metrics(excluded=lambda: clock[0])
+        with metrics.stage("apply"):
+            clock[0] += 10.
+        self.assertLess(metrics.stages["apply"].max, 1.)
+        
+    def test_statistics(self):
+        metrics = Metrics()
+        metrics.request("ComputeIK", 0.010)
+        metrics.request("ComputeIK", 0.020, failed=True)
+        status = metrics.statistics()
+        self.assertEqual(status["RequestsComputeIK"], 2)
+        self.assertEqual(status["ErrorsComputeIK"], 1)
+        self.assertAlmostEqual(status["MethodComputeIKMax"], 20.)
+        self.assertIn("StageEvaluateP99", status)
+        text = metrics.prometheus()
+        self.assertIn('blenderik_requests_total{method="ComputeIK"} 2', text)
+        self.assertIn('blenderik_stage_seconds_count{stage="readback"} 0', text)
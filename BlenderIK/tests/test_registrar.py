@@ -0,0 +1,61 @@
+import unittest
+import socket
+import time
+
+from server.registrar import Registrar
+from loadtest import RegistryStandIn
+
+from MMIStandard.core.ttypes import MServiceDescription
+
+def _freePort() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class TestRegistrar(unittest.TestCase):
+
+    def setUp(self):
+        self.port = _freePort()
+        self.description = MServiceDescription(ID="ik", Name="ikService", Language="Python",
+            Addresses=[], Properties={"Threads": "4"})
+        self.load = 0
+        self.registrar = Registrar(lambda: self.description, "127.0.0.1", self.port,
+            heartbeat=.05, backoff=.02, max_backoff=.1, load=self._load, timeout=1.)
+
+    def tearDown(self):
+        self.registrar.stop(unregister=False)
+
+    def _load(self):
+        self.load += 1
+        return {"PendingRequests": str(self.load)}
+
+    def test_backoff(self):
+        self.registrar.start()
+        # the registry is not up yet, the registrar keeps trying in the background
+        time.sleep(.3)
+        self.assertFalse(self.registrar.registered.is_set())
+        self.assertGreater(self.registrar.failures, 1)
+        self.assertLess(self.registrar.attempts, 20)
+
+        registry = RegistryStandIn()
+        registry.serve("127.0.0.1", self.port)
+        self.assertTrue(self.registrar.registered.wait(2.))
+        self.assertEqual(len(registry.services), 1)
+
+    def test_heartbeat(self):
+        registry = RegistryStandIn()
+        registry.serve("127.0.0.1", self.port)
+        self.registrar.start()
+        self.assertTrue(self.registrar.registered.wait(2.))
+        time.sleep(.3)
+        service, = registry.services
+        self.assertGreater(int(service.Properties["PendingRequests"]), 1)
+        self.assertEqual(service.Properties["Threads"], "4")
+        # the description of the service is not changed
+        self.assertNotIn("PendingRequests", self.description.Properties)
+
+        self.registrar.stop()
+        self.assertEqual(registry.services, [])
+
+if __name__ == '__main__':
+    unittest.main()
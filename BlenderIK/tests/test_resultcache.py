@@ -0,0 +1,55 @@
+import unittest
+import time
+
+from server.resultcache import ResultCache
+from server.ikservice import JointTarget
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = ResultCache(size=2, ttl=0., posture_quantum=1e-3, target_quantum=1e-3)
+        self.targets = [JointTarget('RightHand', (0.3, 1., 0.3), None)]
+        
+    def test_quantization(self):
+        key = self.cache.key("ComputeIK", "a", [0.1, 0.2], self.targets)
+        close = self.cache.key("ComputeIK", "a", [0.1001, 0.2], 
+            [JointTarget('RightHand', (0.3002, 1., 0.3), None)])
+        far = self.cache.key("ComputeIK", "a", [0.102, 0.2], self.targets)
+        self.assertEqual(key, close)
+        self.assertNotEqual(key, far)
+        
+    def test_rotation_sign(self):
+        q = (0.5, 0.5, 0.5, 0.5)
+        self.assertEqual(
+            self.cache.key("ComputeIK", "a", [], [JointTarget('RightHand', None, q)]),
+            self.cache.key("ComputeIK", "a", [], [JointTarget('RightHand', None, tuple(-v for v in q))]))
+        
+    def test_lru(self):
+        for name in ("a", "b"):
+            self.cache.put(name, name)
+        self.cache.get("a")
+        self.cache.put("c", "c")
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), "a")
+        self.assertEqual(self.cache.evictions, 1)
+        
+    def test_ttl(self):
+        self.cache.ttl = 0.01
+        self.cache.put("a", "a")
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.expired, 1)
+        
+    def test_clear_avatar(self):
+        key_a = self.cache.key("ComputeIK", "a", [0.1], self.targets)
+        key_b = self.cache.key("ComputeIK", "b", [0.1], self.targets)
+        self.cache.put(key_a, "a")
+        self.cache.put(key_b, "b")
+        self.cache.clear("a")
+        self.assertIsNone(self.cache.get(key_a))
+        self.assertEqual(self.cache.get(key_b), "b")
+        
+    def test_disabled(self):
+        cache = ResultCache(size=0)
+        cache.put("a", "a")
+        self.assertIsNone(cache.get("a"))
@@ -0,0 +1,57 @@
+import unittest
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+from BlenderMMI.RigSnapshot import RigSnapshot, RigSnapshotCache
+
+def _posture(x: float):
+    joint = lambda name, parent: SimpleNamespace(ID=name, Parent=parent,
+        Position=SimpleNamespace(X=x, Y=1., Z=0.), Rotation=SimpleNamespace(X=0., Y=0., Z=0., W=1.))
+    return SimpleNamespace(Joints=[joint("PelvisCenter", None), joint("S1L5Joint", "PelvisCenter")])
+
+def _snapshot():
+    return RigSnapshot(["a", "b"], np.ones((2, 3), np.float32), np.zeros((2, 3), np.float32),
+        np.zeros(2, np.float32), ["a", "b"], np.stack([np.eye(4)] * 2), np.stack([2 * np.eye(4)] * 2))
+
+class TestRigSnapshotCache(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.dir = Path(self._dir.name)
+        self.blendfile = self.dir/"rig.blend"
+        self.blendfile.write_bytes(b"blend")
+        self.cache = RigSnapshotCache(self.dir/"snapshots", self.blendfile)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_roundtrip(self):
+        key = self.cache.key(_posture(0.1))
+        self.assertIsNone(self.cache.load(key))
+        self.cache.save(key, _snapshot())
+        snapshot = self.cache.load(key)
+        self.assertEqual(snapshot.editBones, ["a", "b"])
+        self.assertEqual(snapshot.poseBones, ["a", "b"])
+        np.testing.assert_array_equal(snapshot.base, _snapshot().base)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        # only the snapshot is left, no temporary file
+        self.assertEqual(list(self.dir.joinpath("snapshots").iterdir()), [self.dir/"snapshots"/("rig_%s.npz" % key)])
+
+    def test_key(self):
+        key = self.cache.key(_posture(0.1))
+        self.assertEqual(key, self.cache.key(_posture(0.1)))
+        self.assertNotEqual(key, self.cache.key(_posture(0.2)))
+        # another blend-file
+        self.blendfile.write_bytes(b"other blend")
+        self.assertNotEqual(key, RigSnapshotCache(self.dir/"snapshots", self.blendfile).key(_posture(0.1)))
+
+    def test_unreadable(self):
+        key = self.cache.key(_posture(0.1))
+        (self.dir/"snapshots"/("rig_%s.npz" % key)).write_bytes(b"garbage")
+        self.assertIsNone(self.cache.load(key))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+
+from server.sessions import SessionStore, ResyncRequired, encodeDelta, resyncResult, RESYNC
+
+from MMIStandard.avatar.ttypes import MAvatarPostureValues
+from MMIStandard.services.ttypes import MIKServiceResult
+from MMIStandard.core.ttypes import MBoolResponse
+
+def _result(values):
+    return MIKServiceResult(Posture=MAvatarPostureValues(AvatarID="a", PostureData=list(values)),
+        Success=MBoolResponse(Successful=True), Error=[])
+
+class TestSessionStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = SessionStore(capacity=2, ttl=0)
+        self.posture = [float(idx) for idx in range(10)]
+
+    def _request(self, data, **properties):
+        properties.setdefault("SessionID", "s")
+        return self.store.decode(MAvatarPostureValues(AvatarID="a", PostureData=data), properties)
+
+    def test_roundtrip(self):
+        session, posture = self._request(self.posture)
+        self.assertEqual(posture.PostureData, self.posture)
+
+        session, posture = self._request(encodeDelta([2, 7], [20., 70.]), PostureEncoding="delta")
+        expected = list(self.posture)
+        expected[2], expected[7] = 20., 70.
+        self.assertEqual(posture.PostureData, expected)
+
+        # the client applies the delta of the result to the posture it sent
+        solved = list(expected)
+        solved[3] = 30.
+        result = self.store.encode(session, _result(solved), {"ResultEncoding": "delta"})
+        self.assertEqual(result.Posture.PostureData, [3., 30.])
+        self.assertTrue(result.Success.Successful)
+
+        # the next delta is relative to the result
+        session, posture = self._request(encodeDelta([0], [-1.]), PostureEncoding="delta")
+        solved[0] = -1.
+        self.assertEqual(posture.PostureData, solved)
+
+    def test_fullResult(self):
+        session, posture = self._request(self.posture)
+        result = _result(self.posture)
+        self.assertIs(self.store.encode(session, result, {}), result)
+
+    def test_resync(self):
+        with self.assertRaises(ResyncRequired):
+            self._request(encodeDelta([1], [1.]), PostureEncoding="delta")
+        self._request(self.posture, Sequence="5")
+        self._request(encodeDelta([1], [1.]), PostureEncoding="delta", Sequence="6")
+        # a request got lost
+        with self.assertRaises(ResyncRequired):
+            self._request(encodeDelta([1], [1.]), PostureEncoding="delta", Sequence="8")
+        with self.assertRaises(ResyncRequired):
+            self._request(encodeDelta([10], [1.]), PostureEncoding="delta")
+        with self.assertRaises(ResyncRequired):
+            self._request([1., 2., 3.], PostureEncoding="delta")
+        self.assertEqual(self.store.statistics()["SessionResyncs"], 4)
+
+        result = resyncResult("a", "lost")
+        self.assertFalse(result.Success.Successful)
+        self.assertIn(RESYNC, result.Success.LogData)
+
+    def test_eviction(self):
+        for session_id in ("s", "t", "u"):
+            self._request(self.posture, SessionID=session_id)
+        self.assertEqual(len(self.store), 2)
+        with self.assertRaises(ResyncRequired):
+            self._request(encodeDelta([1], [1.]), PostureEncoding="delta", SessionID="s")
+
+    def test_open(self):
+        session = self.store.open()
+        self.assertTrue(session.id)
+        self.assertIsNone(session.posture)
+        self.assertIs(self.store.get(session.id), session)
+
+if __name__ == '__main__':
+    unittest.main()
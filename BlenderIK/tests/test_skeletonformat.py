@@ -0,0 +1,68 @@
+import unittest
+import shutil
+import tempfile
+from pathlib import Path
+
+import bpy
+
+from BlenderMMI import SkeletonFormat
+from BlenderMMI.MAvatarPostureGenerator import JSON2MAvatarPosture
+
+RESOURCES = Path(bpy.data.filepath).parent # not so clean!
+
+class TestSkeletonFormat(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = Path(tempfile.mkdtemp())
+        self.source = self.dir/"intermediate.mos"
+        shutil.copy2(RESOURCES/"intermediate.mos", self.source)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_posture(self):
+        """The compiled skeleton gives the posture of the .mos-file."""
+        skeleton = SkeletonFormat.load(self.source)
+        try:
+            self.assertEqual(skeleton.posture(), JSON2MAvatarPosture(self.source))
+            self.assertEqual(skeleton.positions.shape, (len(skeleton), 3))
+            self.assertEqual(skeleton.parents[0], -1)
+        finally:
+            skeleton.close()
+        self.assertTrue(SkeletonFormat.compiledPath(self.source).exists())
+
+    def test_arrays_outlive_close(self):
+        skeleton = SkeletonFormat.load(self.source)
+        positions = skeleton.positions
+        skeleton.close()
+        self.assertEqual(positions.shape[1], 3)
+        self.assertEqual(list(self.dir.glob("*.partial")), [])
+
+    def test_postures_are_independent(self):
+        skeleton = SkeletonFormat.load(self.source)
+        try:
+            posture = skeleton.posture()
+            posture.Joints[0].Position.X = 42.
+            self.assertNotEqual(skeleton.posture().Joints[0].Position.X, 42.)
+        finally:
+            skeleton.close()
+
+    def test_outdated(self):
+        """A changed .mos-file or another version is compiled again."""
+        compiled = SkeletonFormat.compileSkeleton(self.source)
+        text = self.source.read_text().replace('"asdf363"', '"changed"', 1)
+        self.source.write_text(text)
+        self.assertEqual(SkeletonFormat.loadPosture(self.source).AvatarID, "changed")
+
+        data = bytearray(compiled.read_bytes())
+        data[4] = SkeletonFormat.VERSION + 1
+        compiled.write_bytes(bytes(data))
+        with self.assertRaises(ValueError):
+            SkeletonFormat.CompiledSkeleton(compiled)
+        self.assertEqual(SkeletonFormat.loadPosture(self.source).AvatarID, "changed")
+
+    def test_invalid(self):
+        path = self.dir/"invalid.mskel"
+        path.write_bytes(b"not a skeleton")
+        with self.assertRaises(ValueError):
+            SkeletonFormat.CompiledSkeleton(path)
@@ -0,0 +1,82 @@
+import unittest
+import threading
+import socket
+
+from server.thriftserver import ServerOptions, createServer, openClient
+from server.executor import MainThreadExecutor, MainThreadHandler
+
+from MMIStandard.services import MInverseKinematicsService
+
+class _Handler():
+    def __init__(self):
+        self.threads = []
+
+    def GetStatus(self):
+        self.threads.append(threading.current_thread())
+        return {"Running": "True"}
+
+def _freePort() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class TestThriftServer(unittest.TestCase):
+    """Many connections to the servers without a thread per connection."""
+
+    CONNECTIONS = 32
+
+    def _serve(self, options: ServerOptions):
+        executor = MainThreadExecutor()
+        handler = _Handler()
+        port = _freePort()
+        server = createServer(MInverseKinematicsService.Processor(MainThreadHandler(handler, executor)),
+            "127.0.0.1", port, options)
+        threading.Thread(target=server.serve, daemon=True).start()
+        clients = [self._connect(port, options) for idx in range(self.CONNECTIONS)]
+
+        results = []
+        def call(client):
+            results.append(client.GetStatus())
+        threads = [threading.Thread(target=call, args=(client,)) for transport, client in clients]
+        def clients_done():
+            for thread in threads:
+                thread.join()
+            executor.shutdown()
+        for thread in threads:
+            thread.start()
+        threading.Thread(target=clients_done, daemon=True).start()
+        # executes the requests here, in the "main thread"
+        executor.run()
+
+        for transport, client in clients:
+            transport.close()
+        if hasattr(server, "stop"):
+            server.stop()
+        self.assertEqual(results, [{"Running": "True"}] * self.CONNECTIONS)
+        self.assertEqual(set(handler.threads), {threading.current_thread()})
+        return
+
+    def _connect(self, port: int, options: ServerOptions):
+        # the server may not listen yet
+        for attempt in range(50):
+            try:
+                return openClient(MInverseKinematicsService.Client, "127.0.0.1", port, options)
+            except Exception:
+                threading.Event().wait(.1)
+        self.fail("Server at %i not reachable" % port)
+
+    def test_asyncio(self):
+        self._serve(ServerOptions(mode="asyncio", threads=2))
+
+    def test_nonblocking(self):
+        self._serve(ServerOptions(mode="nonblocking", threads=2))
+
+    def test_accelerated(self):
+        self._serve(ServerOptions(mode="asyncio", threads=2, accelerated=True))
+
+    def test_unknownMode(self):
+        with self.assertRaises(ValueError):
+            createServer(None, "127.0.0.1", 0, ServerOptions(mode="forking"))
+
+if __name__ == '__main__':
+    unittest.main()
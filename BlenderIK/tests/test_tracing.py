@@ -0,0 +1,68 @@
+import unittest
+import logging
+
+from server.tracing import RequestTracer, trace_logger
+
+class _Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class TestRequestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.records = _Records()
+        self.tracer = RequestTracer(sample_every=3, ring_size=2)
+        self.tracer.start(self.records)
+        
+    def tearDown(self):
+        self.tracer.stop()
+        
+    def test_sampling(self):
+        traces = [self.tracer.begin("Solve", (idx,)) for idx in range(1, 7)]
+        self.assertEqual([trace is not None for trace in traces], 
+            [False, False, True, False, False, True])
+        self.tracer.end(traces[2], 6)
+        self.tracer.stop()
+        self.assertEqual(len(self.records.messages), 3)
+        self.assertIn("Solve(3)", self.records.messages[0])
+        
+    def test_restart(self):
+        """A stopped tracer leaves the logger as it was, a restart writes every trace once."""
+        self.tracer.stop()
+        self.assertEqual(trace_logger.handlers, [])
+        self.assertTrue(trace_logger.propagate)
+        self.tracer.start(self.records)
+        self.tracer.configure(sample_every=1)
+        self.tracer.begin("Solve", (1,))
+        self.tracer.stop()
+        self.assertEqual(len(self.records.messages), 1)
+        
+    def test_disabled(self):
+        self.tracer.configure(sample_every=0)
+        self.assertIsNone(self.tracer.begin("Solve", (1,)))
+        
+    def test_ring(self):
+        self.tracer.configure(sample_every=0)
+        for idx in range(5):
+            self.tracer.begin("Solve", (idx,))
+        self.tracer.failed("Solve", ValueError("negative"))
+        self.tracer.stop()
+        # the error and the last two requests
+        self.assertEqual(len(self.records.messages), 3)
+        self.assertIn("Solve(3)", self.records.messages[1])
+        self.assertIn("Solve(4)", self.records.messages[2])
+        
+    def test_lazy(self):
+        class Payload():
+            formatted = 0
+            def __repr__(self):
+                Payload.formatted += 1
+                return "payload"
+        self.tracer.configure(sample_every=0)
+        self.tracer.begin("Solve", (Payload(),))
+        self.tracer.stop()
+        self.assertEqual(Payload.formatted, 0)
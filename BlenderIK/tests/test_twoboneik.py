@@ -0,0 +1,74 @@
+import unittest
+import bpy
+from pathlib import Path
+import json
+
+from mathutils import Vector, Quaternion
+
+from BlenderMMI.IntermediateSkeletonApplication import IntermediateSkeletonApplication
+from BlenderMMI.MAvatarPostureGenerator import JSON2MAvatarPosture
+from server.ikservice import JointTarget
+
+RESOURCES = Path(bpy.data.filepath).parent # not so clean!
+
+class TestTwoBoneIK(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls._m_avatar_posture = JSON2MAvatarPosture(RESOURCES/"intermediate.mos")
+        with RESOURCES.joinpath('PostureValueCases.json').open() as file:
+            cls._posture_value_cases = json.load(file)
+        
+    def setUp(self):
+        self.app = IntermediateSkeletonApplication("lalala", self._m_avatar_posture)
+        self.solver = self.app.twoBoneIK
+        self.tpose = self._posture_value_cases['tpose']
+        
+    def _applied(self, values):
+        """Applies the values to the blender rig."""
+        self.app.ApplyMAvatarPostureValues(values)
+        self.app.evaluate("test")
+        return self.app
+        
+    def test_joint_states(self):
+        """The joints computed from the posture values are those of the rig."""
+        values, reached = self.solver.solve(self.tpose, [JointTarget('RightHand', Vector((0.3, 1.2, 0.4)), None)])
+        joints = ['RightWrist', 'LeftElbow']
+        heads, rotations = self.solver.jointStates(values, joints)
+        app = self._applied(values.tolist())
+        for joint_id, head, rotation in zip(joints, heads, rotations):
+            for value, expected in zip(head, app.bones[joint_id].head):
+                self.assertAlmostEqual(value, expected, places=4)
+            self.assertAlmostEqual(abs(Quaternion(rotation).dot(app.getJointRotation(joint_id))), 1., places=4)
+        
+    def test_supports(self):
+        self.assertTrue(self.solver.supports([JointTarget('RightHand', Vector(), None)]))
+        self.assertTrue(self.solver.supports([JointTarget('LeftAnkle', None, Quaternion())]))
+        self.assertFalse(self.solver.supports([JointTarget('HeadJoint', Vector(), None)]))
+        self.assertFalse(self.solver.supports([]))
+        
+    def test_reaches_target_in_blender(self):
+        """The blender rig shows the wrist at the target, the shoulder stays."""
+        shoulder = Vector(self._applied(self.tpose).bones['RightShoulder'].head)
+        wrist = Vector(self.app.bones['RightWrist'].head)
+        target = shoulder + (wrist - shoulder) * 0.6 + Vector((0., 0., -0.1))
+        
+        values, reached = self.solver.solve(self.tpose, [JointTarget('RightHand', target, None)])
+        self.assertTrue(reached)
+        
+        app = self._applied(values.tolist())
+        self.assertAlmostEqual((app.bones['RightWrist'].head - target).length, 0., places=4)
+        self.assertAlmostEqual((app.bones['RightShoulder'].head - shoulder).length, 0., places=5)
+        
+    def test_rotation_target(self):
+        rotation = Quaternion((0., 0., 1.), 0.5)
+        values, reached = self.solver.solve(self.tpose, [JointTarget('LeftHand', None, rotation)])
+        
+        app = self._applied(values.tolist())
+        difference = app.bones['LeftWrist'].matrix.to_quaternion().rotation_difference(rotation)
+        self.assertAlmostEqual(difference.angle, 0., places=4)
+        
+    def test_unreachable(self):
+        values, reached = self.solver.solve(self.tpose, 
+            [JointTarget('RightFoot', Vector((0., 10., 0.)), None)])
+        self.assertFalse(reached)